@@ -0,0 +1,342 @@
+"""Offline benchmarks of the crawl engine
+
+A synthetic tenant is served by the fake ARM api (mce_azure.testing) in a
+separate process and each benchmark runs in a new interpreter, so the peak
+memory (max RSS) is the one of the benchmark only.
+
+Benchmarks:
+
+- list: get_resources_list (pages of 1000)
+- list_groups: get_resources_list with group_concurrency=10
+- keep, keep_compact: get_resources_list kept in memory, as dicts or model.Resource
+- expand: aio engine, one GET per resource
+- expand_batch: aio engine, ARM batch requests of 20
+- graph: full resources with Resource Graph queries (pages of 1000)
+- export: get_resources_list to an ndjson file
+- resolve: get_api_version of all IDs (no server)
+- diff: diff.diff_exports of two ndjson exports, 1% of the resources modified (no server)
+- inventory: inventory.Inventory of all resources and 1000 compound queries (no server)
+- codec_json, codec_orjson: codec.loads and codec.dumps of pages of 1000 resources (no server)
+
+Results are appended to an ndjson file: with --compare, the throughput is
+compared to the median of the previous runs of the same benchmark and size,
+and the exit code is 1 for a regression.
+
+$ python benchmarks/bench_arm.py --sizes 1000,10000 --compare
+$ python benchmarks/bench_arm.py --sizes 100000 --benchmarks list,resolve --latency 0.02
+$ python benchmarks/bench_arm.py --sizes 10000 --benchmarks expand --ratelimit 2000 --ratelimit-refill 500
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CURRENT = os.path.abspath(os.path.dirname(__file__))
+ROOT = os.path.dirname(CURRENT)
+sys.path.insert(0, ROOT)
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+
+BENCHMARKS = ('list', 'list_groups', 'keep', 'keep_compact', 'expand', 'expand_batch', 'graph', 'export', 'resolve', 'diff',
+              'inventory', 'codec_json', 'codec_orjson')
+
+DEFAULT_OUTPUT = os.path.join(CURRENT, 'results.ndjson')
+
+MIN_ELAPSED = 0.1
+
+
+# --- benchmarks (run in the child process)
+
+def bench_list(size, **kwargs):
+    from mce_azure import core
+
+    session = core.get_session("bench", pool_size=20)
+    count = sum(1 for _ in core.get_resources_list(SUBSCRIPTION_ID, session=session))
+    return {'items': count}
+
+
+def bench_list_groups(size, **kwargs):
+    from mce_azure import core
+
+    session = core.get_session("bench", pool_size=20)
+    count = sum(1 for _ in core.get_resources_list(SUBSCRIPTION_ID, session=session, group_concurrency=10))
+    return {'items': count}
+
+
+def bench_keep(size, compact=False, **kwargs):
+    from mce_azure import core
+
+    session = core.get_session("bench", pool_size=20)
+    resources = list(core.get_resources_list(SUBSCRIPTION_ID, session=session, compact=compact))
+    return {'items': len(resources)}
+
+
+def bench_keep_compact(size, **kwargs):
+    return bench_keep(size, compact=True)
+
+
+def bench_expand(size, batch_size=None, **kwargs):
+    from mce_azure import core
+
+    session = core.get_session("bench", pool_size=20)
+    resources, errors = core.async_get_resources(
+        SUBSCRIPTION_ID, session, pool_size=20, batch_size=batch_size
+    )
+    return {'items': len(resources), 'errors': len(errors)}
+
+
+def bench_expand_batch(size, **kwargs):
+    from mce_azure import core
+
+    return bench_expand(size, batch_size=core.BATCH_SIZE)
+
+
+def bench_graph(size, **kwargs):
+    from mce_azure import core
+    from mce_azure.graph import iter_resources_graph
+
+    session = core.get_session("bench", pool_size=20)
+    count = sum(1 for _ in iter_resources_graph(SUBSCRIPTION_ID, session=session))
+    return {'items': count}
+
+
+def bench_export(size, **kwargs):
+    from mce_azure import core
+    from mce_azure.export import open_exporter
+
+    session = core.get_session("bench", pool_size=20)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, "export.ndjson")
+        with open_exporter(filepath) as exporter:
+            for item in core.get_resources_list(SUBSCRIPTION_ID, session=session):
+                exporter.write(item)
+        return {'items': exporter.count, 'bytes': os.path.getsize(filepath)}
+
+
+def bench_resolve(size, **kwargs):
+    from mce_azure import core
+    from mce_azure.testing import synthetic_resources
+
+    resource_ids = [item['id'] for item in synthetic_resources(size)]
+    core.get_providers()
+    start = time.perf_counter()
+    for resource_id in resource_ids:
+        core.get_api_version(resource_id)
+    # without the generation of the IDs
+    return {'items': len(resource_ids), 'elapsed': time.perf_counter() - start}
+
+
+def bench_diff(size, **kwargs):
+    from mce_azure.diff import diff_exports
+    from mce_azure.export import open_exporter
+    from mce_azure.testing import synthetic_resources
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepaths = [os.path.join(tmpdir, "old.ndjson"), os.path.join(tmpdir, "new.ndjson")]
+        for index, filepath in enumerate(filepaths):
+            with open_exporter(filepath) as exporter:
+                for i, item in enumerate(synthetic_resources(size)):
+                    if index and i % 100 == 0:
+                        item['tags']['env'] = "changed"
+                    exporter.write(item)
+        start = time.perf_counter()
+        changes = sum(1 for _ in diff_exports(*filepaths))
+        # without the generation of the exports
+        return {'items': size, 'changes': changes, 'elapsed': time.perf_counter() - start}
+
+
+def bench_inventory(size, **kwargs):
+    from mce_azure.inventory import Inventory
+    from mce_azure.model import Resource
+    from mce_azure.testing import synthetic_resources
+
+    inventory = Inventory(Resource.from_dict(item) for item in synthetic_resources(size))
+    samples = list(inventory)[:1000]
+    start = time.perf_counter()
+    for resource in samples:
+        inventory.select(type=resource.type, location=resource.location, resource_group=resource.resource_group)
+    # queries per second
+    return {'items': len(samples), 'elapsed': time.perf_counter() - start}
+
+
+def bench_codec(size, backend='json', **kwargs):
+    from mce_azure import codec
+    from mce_azure.testing import synthetic_resources
+
+    codec.set_backend(backend)
+    items = list(synthetic_resources(size))
+    pages = [
+        json.dumps({'value': items[i:i + 1000]}).encode('utf-8') for i in range(0, len(items), 1000)
+    ]
+    start = time.perf_counter()
+    for page in pages:
+        for item in codec.loads(page)['value']:
+            codec.dumps(item)
+    # without the generation of the pages
+    return {'items': size, 'bytes': sum(len(page) for page in pages), 'elapsed': time.perf_counter() - start}
+
+
+def bench_codec_json(size, **kwargs):
+    return bench_codec(size, backend='json', **kwargs)
+
+
+def bench_codec_orjson(size, **kwargs):
+    return bench_codec(size, backend='orjson', **kwargs)
+
+
+def run_benchmark(name, size, base_url, repeat=1):
+    """Child process: run one benchmark (best of repeat) and print the result"""
+    from mce_azure import core
+
+    core.AZURE_BASE_URL = base_url
+    func = globals()[f"bench_{name}"]
+
+    elapsed = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(size)
+        duration = result.pop('elapsed', None) or time.perf_counter() - start
+        elapsed = duration if elapsed is None else min(elapsed, duration)
+
+    result.update({
+        'elapsed': round(elapsed, 4),
+        'throughput': round(result['items'] / elapsed, 1) if elapsed else None,
+        # linux: KB
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+    print(json.dumps(result))
+
+
+# --- harness
+
+def start_server(size, args):
+    cmd = [
+        sys.executable, "-m", "mce_azure.testing", "--synthetic", str(size),
+        "--latency", str(args.latency), "--retry-after", str(args.retry_after),
+    ]
+    if args.throttle_every:
+        cmd += ["--throttle-every", str(args.throttle_every)]
+    if args.ratelimit:
+        cmd += ["--ratelimit", str(args.ratelimit)]
+    if args.ratelimit_refill:
+        cmd += ["--ratelimit-refill", str(args.ratelimit_refill)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    base_url = proc.stdout.readline().strip()
+    if not base_url:
+        proc.kill()
+        raise RuntimeError("fake ARM server not started")
+    return proc, base_url
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(filepath):
+    if not os.path.exists(filepath):
+        return []
+    with open(filepath) as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def compare(result, history, threshold):
+    """Relative change of throughput vs the median of the previous runs, regression flag"""
+    key = ('benchmark', 'size', 'latency', 'throttle_every', 'ratelimit')
+    previous = [
+        item['throughput'] for item in history
+        if all(item.get(k) == result.get(k) for k in key) and item.get('throughput')
+    ]
+    # too short to be compared
+    if not previous or not result.get('throughput') or result['elapsed'] < MIN_ELAPSED:
+        return None, False
+    change = result['throughput'] / statistics.median(previous) - 1
+    return round(change, 3), change < -threshold
+
+
+def options():
+    parser = argparse.ArgumentParser(description='mce_azure offline benchmarks')
+    parser.add_argument('--sizes', default="1000,10000", help='resources of the subscription. Default: %(default)s')
+    parser.add_argument('--benchmarks', default=",".join(BENCHMARKS), help='Default: %(default)s')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per ARM response')
+    parser.add_argument('--throttle-every', dest='throttle_every', type=int, default=None)
+    parser.add_argument('--retry-after', dest='retry_after', type=float, default=1)
+    parser.add_argument('--ratelimit', type=int, default=None, help='ARM read quota')
+    parser.add_argument('--ratelimit-refill', dest='ratelimit_refill', type=float, default=None)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='results history. Default: %(default)s')
+    parser.add_argument('--repeat', type=int, default=1, help='best of repeat runs. Default: %(default)s')
+    parser.add_argument('--compare', action='store_true', help='exit 1 if slower than the previous runs')
+    parser.add_argument('--threshold', type=float, default=0.2, help='regression threshold. Default: %(default)s')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', dest='base_url', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = options()
+
+    if args.run:
+        return run_benchmark(args.run, args.size, args.base_url, repeat=args.repeat)
+
+    benchmarks = [name for name in args.benchmarks.split(',') if name]
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            raise SystemExit(f"unknown benchmark [{name}]. choices: {', '.join(BENCHMARKS)}")
+
+    history = load_history(args.output)
+    revision = git_revision()
+    regressions = []
+
+    for size in [int(value) for value in args.sizes.split(',')]:
+        server, base_url = start_server(size, args)
+        try:
+            for name in benchmarks:
+                output = subprocess.check_output([
+                    sys.executable, __file__, "--run", name, "--size", str(size), "--base-url", base_url,
+                    "--repeat", str(args.repeat),
+                ], text=True, cwd=ROOT)
+                result = {
+                    'benchmark': name,
+                    'size': size,
+                    'latency': args.latency,
+                    'throttle_every': args.throttle_every,
+                    'ratelimit': args.ratelimit,
+                    'timestamp': int(time.time()),
+                    'revision': revision,
+                    'python': platform.python_version(),
+                }
+                result.update(json.loads(output.splitlines()[-1]))
+
+                change, regression = compare(result, history, args.threshold)
+                result['change'] = change
+                if regression:
+                    regressions.append(result)
+
+                print("%-13s %7s items  %8.2fs  %10s/s  %7.1f MB%s" % (
+                    name, result['items'], result['elapsed'], result['throughput'], result['max_rss_mb'],
+                    "" if change is None else "  %+.1f%%%s" % (change * 100, "  REGRESSION" if regression else "")
+                ), flush=True)
+
+                with open(args.output, 'a') as fp:
+                    fp.write(json.dumps(result) + "\n")
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.compare and regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Import time of mce_azure
+
+Each run imports the package in a new interpreter (python -X importtime)
+and the median is reported, with the slowest direct imports.
+
+$ python benchmarks/bench_import.py --runs 20 --module mce_azure.core
+$ python benchmarks/bench_import.py --output benchmarks/results/import.ndjson
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+
+def import_times(module):
+    """Cumulative import time (microseconds) of the module and of its direct imports"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE, text=True, check=True
+    )
+    children = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # children are listed before their parent, indented by 2 spaces
+        indent = len(name) - len(name.lstrip())
+        if indent == 1:
+            if name.strip() == module:
+                children[module] = int(cumulative)
+                return children
+            children = {}
+        elif indent == 3:
+            children[name.strip()] = int(cumulative)
+    return children
+
+
+def run(module, runs=10):
+    totals = []
+    packages = defaultdict(list)
+    for _ in range(runs):
+        times = import_times(module)
+        totals.append(times.pop(module, 0))
+        for name, value in times.items():
+            packages[name].append(value)
+
+    slowest = sorted(
+        ((name, statistics.median(values) / 1000) for name, values in packages.items()),
+        key=lambda item: item[1], reverse=True
+    )[:10]
+
+    return {
+        'benchmark': 'import',
+        'module': module,
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'runs': runs,
+        'median_ms': round(statistics.median(totals) / 1000, 2),
+        'min_ms': round(min(totals) / 1000, 2),
+        'slowest_ms': {name: round(value, 2) for name, value in slowest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mce_azure import time')
+    parser.add_argument('--module', default='mce_azure.core')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='append the result to this ndjson file')
+    args = parser.parse_args()
+
+    # warm up: bytecode and providers cache
+    import_times(args.module)
+    subprocess.run([sys.executable, "-c", f"import {args.module}; {args.module}.get_providers()"], check=False)
+
+    result = run(args.module, runs=args.runs)
+    print(json.dumps(result, indent=4))
+
+    if args.output:
+        with open(args.output, 'a') as fp:
+            fp.write(json.dumps(result) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""asyncio fetch engine
+
+Blocking ARM calls from core are executed in a thread pool sharing one
+requests.Session, so keep-alive connections are reused across requests.
+The number of requests in flight is bounded by pool_size.
+
+>>> resources, errors = await get_resources(subscription_id, session, pool_size=20)
+"""
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from requests.adapters import HTTPAdapter
+
+from . import core
+from .children import get_child_collections, get_children_list
+from .metrics import emit
+from .model import Resource
+from .resource_id import parse_resource_id
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['AsyncFetcher', 'get_resources']
+
+_END = object()
+
+
+class _Limiter:
+    """Semaphore whose width can change while in use"""
+
+    def __init__(self, width):
+        self.width = width
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            while self.in_flight >= max(1, self.width()):
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+
+class AsyncFetcher:
+    """Run core functions concurrently from asyncio
+
+    The connection pools of the session are enlarged to pool_size (or the
+    controller max_width) keep-alive connections: plain HTTPAdapter smaller
+    than that are replaced, other adapters (transports) are kept.
+
+    >>> async with AsyncFetcher(session, pool_size=20) as fetcher:
+    >>> ...resources, errors = await fetcher.get_resources(resource_ids)
+    """
+
+    def __init__(self, session, pool_size=20, timeout=None, is_china=False, controller=None,
+                 cache=None):
+        self.session = session
+        self.cache = cache
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.is_china = is_china
+        self.controller = controller
+        self._executor = None
+        self._limiter = None
+
+    async def __aenter__(self):
+        if self.controller:
+            self.controller.install(self.session)
+            max_workers = self.controller.max_width
+            width = lambda: self.controller.width  # noqa: E731
+        else:
+            max_workers = self.pool_size
+            width = lambda: self.pool_size  # noqa: E731
+        _fit_pool(self.session, max_workers)
+        # one more thread for the listing generator
+        self._executor = ThreadPoolExecutor(max_workers=max_workers + 1)
+        self._limiter = _Limiter(width)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _acquire(self):
+        await self._limiter.acquire()
+        if self.controller:
+            delay = self.controller.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                self.controller.add_wait_time(delay)
+                emit('throttle_wait', delay)
+
+    async def call(self, func, *args, **kwargs):
+        """Run a blocking function in the pool, bounded by pool_size"""
+        await self._acquire()
+        try:
+            return await self._run(func, *args, **kwargs)
+        finally:
+            await self._limiter.release()
+
+    async def iter_resources_list(self, subscription_id, **kwargs):
+        """Async iterator over get_resources_list"""
+        items = core.get_resources_list(
+            subscription_id,
+            session=self.session,
+            is_china=self.is_china,
+            timeout=self.timeout,
+            **kwargs
+        )
+        while True:
+            item = await self._run(next, items, _END)
+            if item is _END:
+                break
+            yield item
+
+    async def get_resource(self, resource_id):
+        return await self.call(
+            core.get_resource_by_id,
+            resource_id,
+            session=self.session,
+            is_china=self.is_china,
+            timeout=self.timeout,
+            cache=self.cache,
+        )
+
+    async def get_resources(self, resource_ids, batch_size=None, callback=None, compact=False, children=False,
+                            exclude_ids=None):
+        """Fetch resources by ID. resource_ids is an iterable or an async iterable
+
+        New requests are only scheduled when a slot is free, so pending
+        work never exceeds pool_size (or the controller width) whatever
+        the number of IDs.
+
+        :param batch_size: send ARM batch requests of batch_size resources (at most core.BATCH_SIZE)
+        :param callback: called with each resource (from the event loop)
+                         instead of collecting them: resources is empty
+        :param compact: model.Resource records instead of dicts
+        :param children: list the child resources (children.CHILD_COLLECTIONS) in the same pool.
+                         Child collections are listed as soon as their parent ID is known,
+                         before the next resources. Duplicates are removed.
+        :param exclude_ids: with children, resource IDs (lower case) already exported: they are
+                            not returned again and their children are listed again
+
+        :return: (resources, errors)
+        """
+        resources = _Collector(callback, compact=compact)
+        errors = []
+        pending = set()
+        # (parent id, collection) to list
+        collections = deque()
+        seen = set(exclude_ids or ())
+
+        def add_children(resource_id):
+            try:
+                resource_type = parse_resource_id(resource_id).resource_type
+            except ValueError:
+                return
+            for collection, _ in get_child_collections(resource_type):
+                collections.append((resource_id, collection))
+
+        def is_new(resource_id):
+            key = resource_id.lower()
+            if key in seen:
+                return False
+            seen.add(key)
+            add_children(resource_id)
+            return True
+
+        async def list_children(parent_id, collection):
+            try:
+                items = await self._run(list, get_children_list(
+                    parent_id, collection, session=self.session, is_china=self.is_china, timeout=self.timeout
+                ))
+                for item in items:
+                    if is_new(item['id']):
+                        resources.append(item)
+            except Exception as err:
+                msg = "list children [%s/%s] error : %s" % (parent_id, collection, err)
+                logger.error(msg)
+                errors.append(err)
+            finally:
+                await self._limiter.release()
+
+        async def fetch(resource_id):
+            try:
+                resources.append(
+                    await self._run(
+                        core.get_resource_by_id,
+                        resource_id,
+                        session=self.session,
+                        is_china=self.is_china,
+                        timeout=self.timeout,
+                        cache=self.cache,
+                    )
+                )
+            except Exception as err:
+                msg = "fetch resource [%s] error : %s" % (resource_id, err)
+                logger.error(msg)
+                errors.append(err)
+            finally:
+                await self._limiter.release()
+
+        async def fetch_batch(chunk):
+            try:
+                results, batch_errors = await self._run(
+                    core.get_resources_by_ids,
+                    chunk,
+                    session=self.session,
+                    is_china=self.is_china,
+                    timeout=self.timeout,
+                    cache=self.cache,
+                )
+                resources.extend(results.values())
+                for resource_id, err in batch_errors.items():
+                    msg = "fetch resource [%s] error : %s" % (resource_id, err)
+                    logger.error(msg)
+                    errors.append(err)
+            except Exception as err:
+                msg = "fetch batch [%s] error : %s" % (", ".join(chunk), err)
+                logger.error(msg)
+                errors.append(err)
+            finally:
+                await self._limiter.release()
+
+        async def schedule(func, *args):
+            await self._acquire()
+            task = asyncio.ensure_future(func(*args))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            emit('queue_depth', len(pending), queue='fetch')
+
+        async def schedule_children():
+            while collections:
+                await schedule(list_children, *collections.popleft())
+
+        if children:
+            resource_ids = (resource_id async for resource_id in _aiter(resource_ids) if is_new(resource_id))
+            # resumed export: new children of the resources already exported
+            for resource_id in seen:
+                add_children(resource_id)
+
+        if batch_size:
+            func, items = fetch_batch, _achunks(resource_ids, min(batch_size, core.BATCH_SIZE))
+        else:
+            func, items = fetch, _aiter(resource_ids)
+
+        async for item in items:
+            # children of the known resources first: no level barrier
+            await schedule_children()
+            await schedule(func, item)
+
+        while pending or collections:
+            if collections:
+                await schedule_children()
+            else:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+
+        return resources.items, errors
+
+
+class _Collector:
+
+    def __init__(self, callback=None, compact=False):
+        self.items = []
+        self._append = callback or self.items.append
+        self._compact = compact
+
+    def append(self, item):
+        self._append(Resource.from_dict(item) if self._compact else item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+
+async def _aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def _fit_pool(session, size):
+    """Mount HTTPAdapter of size connections instead of the smaller ones"""
+    for prefix, adapter in list(session.adapters.items()):
+        if type(adapter) is HTTPAdapter and adapter._pool_maxsize < size:
+            session.mount(prefix, HTTPAdapter(
+                pool_connections=size, pool_maxsize=size, max_retries=adapter.max_retries
+            ))
+
+
+async def _achunks(iterable, size):
+    chunk = []
+    async for item in _aiter(iterable):
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def get_resources(subscription_id, session, pool_size=20, timeout=None, is_china=False,
+                        controller=None, batch_size=None, query=None, cache=None, exclude_ids=None,
+                        callback=None, group_concurrency=None, compact=False, children=False):
+    """List all resources of a subscription and fetch each one by ID
+
+    :param controller: optional ratelimit.ConcurrencyController, replaces pool_size
+    :param batch_size: fetch resources with ARM batch requests (at most core.BATCH_SIZE)
+    :param query: query.ResourceQuery for the listing
+    :param cache: cache.ResourceCache
+    :param exclude_ids: resource IDs (lower case) not to fetch
+    :param callback: called with each resource instead of collecting them
+    :param group_concurrency: list resource groups concurrently
+    :param compact: model.Resource records instead of dicts
+    :param children: list the child resources (see AsyncFetcher.get_resources)
+
+    :return: (resources, errors)
+    """
+    async with AsyncFetcher(
+        session, pool_size=pool_size, timeout=timeout, is_china=is_china, controller=controller,
+        cache=cache
+    ) as fetcher:
+        exclude_ids = exclude_ids or ()
+        resource_ids = (
+            item['id'] async for item in fetcher.iter_resources_list(
+                subscription_id, query=query, group_concurrency=group_concurrency
+            )
+            if item['id'].lower() not in exclude_ids
+        )
+        return await fetcher.get_resources(
+            resource_ids, batch_size=batch_size, callback=callback, compact=compact, children=children,
+            exclude_ids=exclude_ids
+        )
@@ -0,0 +1,229 @@
+"""Token provider
+
+Tokens are cached per cloud, tenant and client, refreshed in the background
+before expiry and pushed to the sessions attached to the provider.
+A request rejected with 401 is sent again once with the refreshed token.
+With cache_file, tokens are shared by the processes using the same file
+(the file contains secrets: it is created with 0600 permissions).
+
+>>> provider = TokenProvider(user, password, tenant=tenant, cache_file="/run/mce/tokens.json")
+>>> session = provider.attach(core.get_session())
+>>> provider.start()
+>>> ...
+>>> provider.stop()
+"""
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+
+from .utils import get_credentials
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TokenProvider', 'get_expires_on']
+
+DEFAULT_EXPIRES_IN = 3600
+
+# process-wide cache: key -> {'token': token, 'expires_on': timestamp}
+_TOKENS = {}
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+def _get_lock(key):
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(key, threading.Lock())
+
+
+def get_expires_on(token, stored_at=None):
+    """Expiration timestamp of an AAD token
+
+    :param stored_at: time the token was received, for a relative expires_in. Default: now
+    """
+    for field in ('expires_on', 'expires_at'):
+        if token.get(field):
+            return float(token[field])
+    return (stored_at or time.time()) + float(token.get('expires_in', DEFAULT_EXPIRES_IN))
+
+
+class _FileLock:
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._fp = None
+
+    def __enter__(self):
+        self._fp = open(self.filepath, 'a')
+        if fcntl:
+            fcntl.flock(self._fp, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._fp, fcntl.LOCK_UN)
+        self._fp.close()
+
+
+class TokenProvider:
+    """
+    :param user: Client ID or UserName
+    :param password: Secret ID or Password
+    :param tenant: Tenant ID. Without tenant: user/password authentication
+    :param refresh_margin: seconds before expiry to refresh the token
+    :param cache_file: json file to share tokens between processes
+    """
+
+    def __init__(self, user, password, tenant=None, is_china=False, refresh_margin=300,
+                 cache_file=None, timeout=None):
+        self.user = user
+        self.password = password
+        self.tenant = tenant
+        self.is_china = is_china
+        self.refresh_margin = refresh_margin
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.key = "%s:%s:%s" % ('china' if is_china else 'azure', tenant or 'common', user)
+        self._sessions = weakref.WeakSet()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _acquire(self):
+        credentials = get_credentials(
+            user=self.user, password=self.password, tenant=self.tenant,
+            is_china=self.is_china, timeout=self.timeout
+        )
+        logger.info("new token for %s" % self.key)
+        return credentials.token
+
+    def _new_entry(self):
+        token = self._acquire()
+        return {'token': token, 'expires_on': get_expires_on(token, stored_at=time.time())}
+
+    def _is_valid(self, entry):
+        return bool(entry) and 'token' in entry and entry['expires_on'] - self.refresh_margin > time.time()
+
+    def _read_file(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as fp:
+                return json.load(fp)
+        except ValueError:
+            return {}
+
+    def _write_file(self, entry):
+        tokens = self._read_file()
+        tokens[self.key] = entry
+        tmp_filepath = f"{self.cache_file}.tmp"
+        fd = os.open(tmp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(tokens, fp)
+        os.replace(tmp_filepath, self.cache_file)
+
+    def _load(self, current=None):
+        """Entry from the cache file if valid and newer than current, or a new token"""
+        if not self.cache_file:
+            return self._new_entry()
+
+        with _FileLock(f"{self.cache_file}.lock"):
+            entry = self._read_file().get(self.key)
+            if self._is_valid(entry) and entry != current:
+                return entry
+            entry = self._new_entry()
+            self._write_file(entry)
+            return entry
+
+    def _get_entry(self, force=False):
+        with _get_lock(self.key):
+            entry = _TOKENS.get(self.key)
+            if force or not self._is_valid(entry):
+                entry = self._load(current=entry)
+                _TOKENS[self.key] = entry
+            return entry
+
+    def get_token(self, force=False):
+        """Valid token (dict) from the cache or a new one
+
+        :param force: the current token is rejected (ex: 401)
+        """
+        return self._get_entry(force=force)['token']
+
+    @property
+    def access_token(self):
+        return self.get_token()['access_token']
+
+    def refresh(self):
+        token = self.get_token(force=True)
+        self._update_sessions(token)
+        return token
+
+    def _update_sessions(self, token):
+        authorization = 'Bearer %s' % token['access_token']
+        for session in list(self._sessions):
+            session.headers['authorization'] = authorization
+
+    def _current_authorization(self):
+        return 'Bearer %s' % _TOKENS.get(self.key, {}).get('token', {}).get('access_token')
+
+    def _response_hook(self, resp, *args, **kwargs):
+        if resp.status_code != 401 or resp.request is None:
+            return None
+        rejected = resp.request.headers.get('authorization')
+        # refresh once: only if the rejected token is still the current one
+        if rejected == self._current_authorization():
+            logger.warning("401 - refresh token for %s" % self.key)
+            self.refresh()
+        authorization = self._current_authorization()
+        if rejected is None or rejected == authorization or getattr(resp, 'connection', None) is None:
+            return None
+
+        # send the request again with the new token (the replayed response is not hooked again)
+        resp.content
+        resp.close()
+        request = resp.request.copy()
+        request.headers['authorization'] = authorization
+        replayed = resp.connection.send(request, **kwargs)
+        replayed.history.append(resp)
+        replayed.request = request
+        return replayed
+
+    def attach(self, session):
+        """Keep the session authorization header up to date"""
+        session.headers['authorization'] = 'Bearer %s' % self.access_token
+        if self._response_hook not in session.hooks['response']:
+            session.hooks['response'].append(self._response_hook)
+        self._sessions.add(session)
+        return session
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                entry = self._get_entry()
+                self._update_sessions(entry['token'])
+                delay = entry['expires_on'] - self.refresh_margin - time.time()
+            except Exception as err:
+                logger.error("token refresh error for %s : %s" % (self.key, err))
+                delay = 30
+            self._stop.wait(max(1, delay))
+
+    def start(self):
+        """Refresh the token in a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"token-{self.key}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,206 @@
+"""Persistent resource cache (SQLite)
+
+Resources fetched by get_resource_by_id are stored by resource ID and
+api-version, with a TTL depending on the resource type. The database is in
+WAL mode so several processes can read and write the same file.
+
+>>> cache = ResourceCache("/var/cache/mce/resources.db", default_ttl=600, ttls={
+>>> ..."Microsoft.Network/virtualNetworks": 86400,
+>>> ..."Microsoft.Compute/virtualMachines": 300,
+>>> })
+>>> get_resource_by_id(resource_id, session=session, cache=cache)
+
+Expired entries with an ETag are kept stale_ttl seconds more: they are
+revalidated with If-None-Match and a 304 Not Modified response extends
+them without downloading the resource again.
+
+>>> cache = ResourceCache("/var/cache/mce/resources.db", default_ttl=600, stale_ttl=7 * 86400)
+>>> cache.stats()
+{'hits': 0, 'misses': 120, 'revalidated': 112, 'downloaded': 8, 'entries': 120}
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ResourceCache']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    resource_id TEXT NOT NULL,
+    api_version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    etag TEXT,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (resource_id, api_version)
+);
+CREATE INDEX IF NOT EXISTS resources_expires_at ON resources (expires_at);
+CREATE INDEX IF NOT EXISTS resources_stored_at ON resources (stored_at);
+"""
+
+
+class ResourceCache:
+    """
+    :param default_ttl: TTL in seconds for types not in ttls
+    :param ttls: resource type -> TTL in seconds
+    :param max_entries: the oldest entries are evicted beyond this size
+    :param evict_every: eviction check every N writes (per process)
+    :param stale_ttl: expired entries with an ETag are kept stale_ttl seconds for revalidation
+    """
+
+    def __init__(self, filepath, default_ttl=3600, ttls=None, max_entries=100000, evict_every=500, stale_ttl=0):
+        self.filepath = filepath
+        self.default_ttl = default_ttl
+        self.ttls = {k.lower(): v for k, v in (ttls or {}).items()}
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        # 304 responses / resources downloaded
+        self.revalidated = 0
+        self.downloaded = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._execute(self._create)
+
+    @staticmethod
+    def _create(conn):
+        conn.executescript(SCHEMA)
+        # cache files created before the etag column. locked: other processes can open the file
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(resources)")]
+            if 'etag' not in columns:
+                conn.execute("ALTER TABLE resources ADD COLUMN etag TEXT")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.filepath, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, func):
+        return func(self._connect())
+
+    @staticmethod
+    def _key(resource_id):
+        return "/" + resource_id.strip('/').lower()
+
+    def get_ttl(self, resource_type):
+        return self.ttls.get((resource_type or '').lower(), self.default_ttl)
+
+    def get(self, resource_id, api_version):
+        """Cached resource or None"""
+        row = self._execute(lambda conn: conn.execute(
+            "SELECT data FROM resources WHERE resource_id=? AND api_version=? AND expires_at > ?",
+            (self._key(resource_id), api_version, time.time())
+        ).fetchone())
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return codec.loads(row[0])
+
+    def get_stale(self, resource_id, api_version):
+        """(resource, etag) of an expired entry with an ETag or None"""
+        if not self.stale_ttl:
+            return None
+        row = self._execute(lambda conn: conn.execute(
+            "SELECT data, etag FROM resources WHERE resource_id=? AND api_version=? AND etag IS NOT NULL "
+            "AND expires_at > ?",
+            (self._key(resource_id), api_version, time.time() - self.stale_ttl)
+        ).fetchone())
+        if row is None:
+            return None
+        return codec.loads(row[0]), row[1]
+
+    def set(self, resource_id, api_version, resource, etag=None):
+        now = time.time()
+        ttl = self.get_ttl(resource.get('type'))
+        self._execute(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO resources (resource_id, api_version, data, etag, stored_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self._key(resource_id), api_version, codec.dumps(resource).decode('utf-8'), etag, now, now + ttl)
+        ))
+        with self._lock:
+            self.downloaded += 1
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def revalidate(self, resource_id, api_version, resource_type=None):
+        """The resource is not modified (304): extend the entry by its TTL
+
+        :return: False if the entry was evicted meanwhile
+        """
+        now = time.time()
+        cursor = self._execute(lambda conn: conn.execute(
+            "UPDATE resources SET stored_at=?, expires_at=? WHERE resource_id=? AND api_version=?",
+            (now, now + self.get_ttl(resource_type), self._key(resource_id), api_version)
+        ))
+        with self._lock:
+            self.revalidated += 1
+        return cursor.rowcount > 0
+
+    def delete(self, resource_id):
+        self._execute(lambda conn: conn.execute(
+            "DELETE FROM resources WHERE resource_id=?", (self._key(resource_id),)
+        ))
+
+    def clear(self):
+        self._execute(lambda conn: conn.execute("DELETE FROM resources"))
+
+    def evict(self):
+        """Remove expired entries (after stale_ttl) then the oldest ones beyond max_entries
+
+        :return: number of removed entries
+        """
+        def _evict(conn):
+            removed = conn.execute(
+                "DELETE FROM resources WHERE expires_at <= ? AND (etag IS NULL OR expires_at <= ?)",
+                (time.time(), time.time() - self.stale_ttl)
+            ).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM resources").fetchone()[0]
+            if count > self.max_entries:
+                removed += conn.execute(
+                    "DELETE FROM resources WHERE rowid IN "
+                    "(SELECT rowid FROM resources ORDER BY stored_at LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+            return removed
+
+        removed = self._execute(_evict)
+        if removed:
+            logger.debug("cache evict %s entries" % removed)
+        return removed
+
+    def __len__(self):
+        return self._execute(lambda conn: conn.execute("SELECT COUNT(*) FROM resources").fetchone()[0])
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'downloaded': self.downloaded,
+            'entries': len(self),
+        }
@@ -0,0 +1,117 @@
+"""Checkpoint and resume of an export
+
+A journal file next to the export records each exported resource ID with
+the export file offset after it. On resume, the export is truncated to the
+last recorded offset (a resource being written is dropped) and resources
+already exported are not fetched again.
+
+>>> exporter, checkpoint = open_checkpoint("resources.ndjson", resume=True)
+>>> items = iter_resources_expanded(subscription_id, session=session, exclude_ids=checkpoint.done)
+>>> for resource in items:
+>>> ...checkpoint.write(exporter, resource)
+>>> exporter.close()
+>>> checkpoint.remove()
+"""
+import logging
+import os
+
+from .export import NDJsonExporter, JsonArrayExporter, get_format, open_exporter
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Checkpoint', 'open_checkpoint']
+
+
+class Checkpoint:
+    """Journal file: one "offset<TAB>resource_id" line per exported resource"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.done = set()
+        self.offset = 0
+        self._fp = None
+
+    def load(self):
+        """Read the journal. A partially written last line is ignored"""
+        self.done = set()
+        self.offset = 0
+        if not os.path.exists(self.filepath):
+            return self
+        with open(self.filepath) as fp:
+            for line in fp:
+                if not line.endswith("\n"):
+                    break
+                offset, _, resource_id = line.rstrip("\n").partition("\t")
+                self.done.add(resource_id.lower())
+                self.offset = int(offset)
+        return self
+
+    def open(self, resume=False):
+        if resume:
+            # drop a partially written last line
+            with open(self.filepath, 'a+') as fp:
+                fp.seek(0)
+                size = sum(len(line.encode('utf-8')) for line in fp if line.endswith("\n"))
+                fp.truncate(size)
+        self._fp = open(self.filepath, 'a' if resume else 'w')
+        return self
+
+    def record(self, resource_id, offset):
+        self._fp.write(f"{offset}\t{resource_id}\n")
+        self._fp.flush()
+        self.done.add(resource_id.lower())
+        self.offset = offset
+
+    def write(self, exporter, resource):
+        """Export a resource and record it once it's on disk"""
+        exporter.write(resource)
+        exporter.fp.flush()
+        self.record(resource['id'], exporter.offset)
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+    def remove(self):
+        """Export completed"""
+        self.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+def open_checkpoint(filepath, export_format=None, resume=False, journal_filepath=None, compress=None):
+    """Open an export file and its journal
+
+    :param resume: continue a previous export in place
+    :param compress: not supported, raise ValueError if True (as a .gz filepath)
+
+    :return: (exporter, checkpoint)
+    """
+    if compress or filepath.endswith('.gz'):
+        raise ValueError("checkpoint is not available for compressed export")
+
+    checkpoint = Checkpoint(journal_filepath or f"{filepath}.journal")
+
+    if not resume or not os.path.exists(filepath):
+        return open_exporter(filepath, export_format=export_format), checkpoint.open()
+
+    checkpoint.load()
+    if not checkpoint.done:
+        return open_exporter(filepath, export_format=export_format), checkpoint.open()
+
+    logger.info(
+        "resume export %s : %s resources already exported" % (filepath, len(checkpoint.done))
+    )
+
+    fp = open(filepath, 'r+b')
+    fp.seek(checkpoint.offset)
+    fp.truncate()
+
+    if get_format(filepath, export_format) == 'ndjson':
+        exporter = NDJsonExporter(fp)
+        exporter.count = len(checkpoint.done)
+    else:
+        exporter = JsonArrayExporter(fp, count=len(checkpoint.done))
+
+    return exporter, checkpoint.open(resume=True)
@@ -0,0 +1,106 @@
+"""Child resources
+
+Child resources (subnets, NSG rules, SQL databases, VM extensions, storage
+containers...) are not all returned by the resources list. They are listed
+from their parent: {parent id}/{collection}?api-version=... with the
+api-version of the child type.
+
+The collections of a type are registered in CHILD_COLLECTIONS, children of
+children are listed with the collections of their own type.
+
+>>> register_child_collection("Microsoft.Network/applicationGateways", "privateEndpointConnections")
+>>> for child in iter_children(vnet_id, session=session):
+>>> ...print(child['type'], child['name'])
+Microsoft.Network/virtualNetworks/subnets default
+
+With the asyncio engine, children are fetched in the same pool as the resources:
+
+>>> resources, errors = core.async_get_resources(subscription_id, session, children=True)
+"""
+import logging
+
+from . import core
+from .resource_id import parse_resource_id
+
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    'CHILD_COLLECTIONS', 'register_child_collection', 'get_child_collections', 'get_children_list', 'iter_children'
+]
+
+# parent type (lower case) -> child collections
+CHILD_COLLECTIONS = {}
+
+
+def register_child_collection(parent_type, collection):
+    """Register a child collection of a type
+
+    :param collection: path of the collection from the parent. ex: subnets, blobServices/default/containers
+    """
+    collections = CHILD_COLLECTIONS.setdefault(parent_type.lower(), [])
+    if collection not in collections:
+        collections.append(collection)
+
+
+for _parent_type, _collection in (
+    ("Microsoft.Network/virtualNetworks", "subnets"),
+    ("Microsoft.Network/virtualNetworks", "virtualNetworkPeerings"),
+    ("Microsoft.Network/networkSecurityGroups", "securityRules"),
+    ("Microsoft.Network/routeTables", "routes"),
+    ("Microsoft.Sql/servers", "databases"),
+    ("Microsoft.Sql/servers", "firewallRules"),
+    ("Microsoft.Compute/virtualMachines", "extensions"),
+    ("Microsoft.Storage/storageAccounts", "blobServices/default/containers"),
+    ("Microsoft.Web/sites", "slots"),
+):
+    register_child_collection(_parent_type, _collection)
+
+
+def get_child_type(parent_type, collection):
+    """ex: Microsoft.Storage/storageAccounts/blobServices/containers for blobServices/default/containers"""
+    return "/".join([parent_type] + collection.split('/')[0::2])
+
+
+def get_child_collections(resource_type):
+    """[(collection, child type)] of a resource type"""
+    return [
+        (collection, get_child_type(resource_type, collection))
+        for collection in CHILD_COLLECTIONS.get(resource_type.lower(), ())
+    ]
+
+
+def get_children_list(parent_id, collection, session=None, token=None, is_china=False, timeout=None):
+    """Get the children of a collection of a parent resource
+
+    Lazy generator: pages are followed through nextLink.
+    """
+    parent_type = parse_resource_id(parent_id).resource_type
+    api_version = core.get_type_api_version(get_child_type(parent_type, collection))
+
+    base_url = core.get_azure_base_url(is_china=is_china)
+    url = f"{base_url}/{parent_id.strip('/')}/{collection}?api-version={api_version}"
+    session = session or core.get_session(token=token)
+
+    yield from core.iter_items(url, session, timeout=timeout, log_id=parent_id, prefetch=False)
+
+
+def iter_children(parent_id, session=None, token=None, is_china=False, timeout=None, recursive=True):
+    """Iterate over all children of a resource (depth first)
+
+    Errors are logged and skipped.
+    """
+    session = session or core.get_session(token=token)
+    stack = [parent_id]
+    while stack:
+        resource_id = stack.pop()
+        for collection, child_type in get_child_collections(parse_resource_id(resource_id).resource_type):
+            try:
+                for child in get_children_list(
+                    resource_id, collection, session=session, is_china=is_china, timeout=timeout
+                ):
+                    yield child
+                    if recursive:
+                        stack.append(child['id'])
+            except Exception as err:
+                msg = "list children [%s/%s] error : %s" % (resource_id, collection, err)
+                logger.error(msg)
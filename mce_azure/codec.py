@@ -0,0 +1,106 @@
+"""JSON codec
+
+Decoding of the ARM responses and encoding of the exports go through
+loads() and dumps(): orjson is used when installed (pip install .[orjson]),
+the stdlib json module otherwise. The backend can be forced with the
+MCE_AZURE_JSON environment variable (json or orjson) or set_backend().
+
+dumps() always returns compact UTF-8 bytes (no ascii escaping), as the
+stdlib with ensure_ascii=False and separators=(',', ':'). indent=2 and
+sort_keys are supported by all backends, other indents use the stdlib.
+
+>>> codec.loads(resp.content)
+>>> codec.dumps(resource, default=lambda obj: obj.to_dict())
+b'{"id":"/subscriptions/...","name":"vm1"}'
+>>> codec.dumps(resource, indent=4).decode('utf-8')
+"""
+import json
+import logging
+
+from decouple import config
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['loads', 'dumps', 'response_json', 'get_backend', 'set_backend', 'BACKENDS']
+
+
+class StdlibBackend:
+
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj, indent=None, sort_keys=False, default=None):
+        separators = None if indent else (',', ':')
+        return json.dumps(
+            obj, ensure_ascii=False, separators=separators, indent=indent, sort_keys=sort_keys, default=default
+        ).encode('utf-8')
+
+
+class OrjsonBackend:
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self.loads = orjson.loads
+
+    def dumps(self, obj, indent=None, sort_keys=False, default=None):
+        if indent not in (None, 2):
+            return StdlibBackend.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+        option = self._orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= self._orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= self._orjson.OPT_SORT_KEYS
+        try:
+            return self._orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # integers beyond 64 bits...
+            return StdlibBackend.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+
+
+BACKENDS = {
+    'json': StdlibBackend,
+    'orjson': OrjsonBackend,
+}
+
+_backend = None
+
+
+def set_backend(name=None):
+    """Select the backend: json, orjson. Default: the fastest installed"""
+    global _backend
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError(f"invalid json backend [{name}]. choices: {', '.join(BACKENDS)}")
+        _backend = BACKENDS[name]()
+        return _backend
+    try:
+        _backend = OrjsonBackend()
+    except ImportError:
+        _backend = StdlibBackend()
+    return _backend
+
+
+def get_backend():
+    return _backend or set_backend(config('MCE_AZURE_JSON', default=None))
+
+
+def loads(data):
+    """Decode a json document (bytes or str)"""
+    return get_backend().loads(data)
+
+
+def dumps(obj, indent=None, sort_keys=False, default=None):
+    """Encode to UTF-8 json bytes"""
+    return get_backend().dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+
+
+def response_json(resp):
+    """Decoded body of a requests Response"""
+    return loads(resp.content)
@@ -4,34 +4,51 @@ from pprint import pprint
 import os
 import argparse
 import json
+import marshal
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 
 import requests
+from requests.adapters import HTTPAdapter
 from decouple import config
-from dotenv import load_dotenv
 
-try:
-    from gevent.pool import Pool
-    GEVENT = True
-except Exception:
-    GEVENT = False
-
-from .utils import get_access_token, retry
+from .utils import chunks, RetryPolicy
+from .auth import TokenProvider
+from .ratelimit import get_retry_after
+from .query import ResourceQuery, EXPAND_FIELDS
+from .export import open_exporter, FORMATS
+from .checkpoint import open_checkpoint
+from .resource_id import parse_resource_id, ProviderTrie
+from .metrics import emit
+from .model import Resource
+from . import codec
 
 logger = logging.getLogger(__name__)
 
-load_dotenv(verbose=False)
-
-DEFAULT_SUBSCRIPTION = config('MCE_AZURE_SUBSCRIPTION', default=None)
-DEFAULT_TENANT = config('MCE_AZURE_TENANT', default=None)
-DEFAULT_USER = config('MCE_AZURE_USER', default=None)
-DEFAULT_PASSWORD = config('MCE_AZURE_PASSWORD', default=None)
-
 CURRENT = os.path.abspath(os.path.dirname(__file__))
 PROVIDERS_FILEPATH = config(
     'MCE_PROVIDERS_FILEPATH', default=os.path.join(CURRENT, 'azure-providers.json')
 )
 
-PROVIDERS = None
+# override ARM endpoint (tests, proxy)
+AZURE_BASE_URL = config('MCE_AZURE_BASE_URL', default=None)
+
+BATCH_API_VERSION = "2020-06-01"
+BATCH_SIZE = 20
+
+# retry policy of the sessions created without one (shared retry budget)
+RETRY_POLICY = RetryPolicy()
+
+# loaded on first use: see get_providers()
+_PROVIDERS = None
+_PROVIDER_TRIE = None
+
+# default of includes: the resource types of the providers file
+KNOWN_TYPES = object()
 
 
 def get_ratelimit_header(headers):
@@ -42,56 +59,220 @@ def get_ratelimit_header(headers):
     return None, None
 
 
-def load_providers(filepath=PROVIDERS_FILEPATH):
-    global PROVIDERS
+def get_providers_cache_filepath(filepath):
+    return os.path.splitext(filepath)[0] + ".marshal"
+
+
+def _read_providers_cache(filepath, stat):
+    cache_filepath = get_providers_cache_filepath(filepath)
+    try:
+        with open(cache_filepath, 'rb') as fp:
+            mtime, size, providers = marshal.load(fp)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        return None
+    return providers
 
-    if not os.path.exists(filepath):
+
+def _write_providers_cache(filepath, stat, providers):
+    cache_filepath = get_providers_cache_filepath(filepath)
+    tmp_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filepath, 'wb') as fp:
+            marshal.dump((stat.st_mtime_ns, stat.st_size, providers), fp)
+        os.replace(tmp_filepath, cache_filepath)
+    except OSError as err:
+        # read-only install: the json file is parsed each time
+        logger.debug("providers cache not written: %s" % err)
+
+
+def load_providers(filepath=None):
+    """Load the providers file: resource type (lower case) -> api-version
+
+    The parsed file is cached next to it in a marshal file,
+    used while the json file is unchanged (mtime and size).
+    """
+    global _PROVIDERS, _PROVIDER_TRIE
+
+    filepath = filepath or PROVIDERS_FILEPATH
+
+    try:
+        stat = os.stat(filepath)
+    except OSError:
         raise RuntimeError(f"{filepath} not found")
 
-    with open(filepath) as fp:
-        _providers = json.load(fp)
-        PROVIDERS = {k.lower(): v for k, v in _providers.items()}
-    if not PROVIDERS:
+    providers = _read_providers_cache(filepath, stat)
+    if providers is None:
+        with open(filepath) as fp:
+            providers = {k.lower(): v for k, v in json.load(fp).items()}
+        _write_providers_cache(filepath, stat, providers)
+
+    if not providers:
         raise Exception("PROVIDERS empty")
 
+    _PROVIDERS = providers
+    _PROVIDER_TRIE = ProviderTrie(providers)
+
     logger.info(f"user provider filepath: {filepath}")
 
-    return PROVIDERS
+    return _PROVIDERS
+
+
+def get_providers():
+    if _PROVIDERS is None:
+        load_providers()
+    return _PROVIDERS
+
+
+def get_provider_trie():
+    if _PROVIDER_TRIE is None:
+        load_providers()
+    return _PROVIDER_TRIE
 
 
-load_providers()
+def __getattr__(name):
+    # compatibility: core.PROVIDERS was loaded at import
+    if name == 'PROVIDERS':
+        return get_providers()
+    if name == 'PROVIDER_TRIE':
+        return get_provider_trie()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_azure_base_url(is_china=False):
+    if AZURE_BASE_URL:
+        return AZURE_BASE_URL.rstrip('/')
     if is_china:
         return "https://management.chinacloudapi.cn"
     return "https://management.azure.com"
 
 
-def get_api_version(resource_id):
-    asset_split = resource_id.split('/')
-    asset_type = f"{asset_split[6]}/{asset_split[7]}"
-    api_version = PROVIDERS.get(asset_type.lower())
+def get_type_api_version(resource_type):
+    """api-version of a resource type or of its nearest known parent type"""
+    api_version = get_provider_trie().get(resource_type)
 
     if not api_version:
-        raise Exception(f"api_version not found for type {asset_type}")
+        raise Exception(f"api_version not found for type {resource_type}")
 
     return api_version
 
 
-def get_session(token=None):
+def get_api_version(resource_id):
+    try:
+        resource_type = parse_resource_id(resource_id).resource_type
+    except ValueError:
+        raise Exception(f"api_version not found for resource id {resource_id}")
+
+    return get_type_api_version(resource_type)
+
+
+def get_session(token=None, pool_size=None, retry_policy=None, transport=None):
+    """Create a requests Session for the ARM api
+
+    :param pool_size: keep-alive connections kept per host. Use the
+                      concurrency of the engine (requests default: 10)
+    :param retry_policy: utils.RetryPolicy of the ARM calls. Default: RETRY_POLICY
+    :param transport: requests adapter of all requests. ex: transport.RecordingAdapter
+    """
     session = requests.Session()
     session.headers['authorization'] = 'Bearer %s' % token
+    session.retry_policy = retry_policy
+    adapter = transport
+    if adapter is None and pool_size:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    if adapter is not None:
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
     return session
 
 
-# TODO: retry paramètrable
+def get_retry_policy(session):
+    return getattr(session, 'retry_policy', None) or RETRY_POLICY
+
+
+def get_response(url, session, timeout=None, log_id=None, headers=None):
+    """GET url, raise for errors (a 304 Not Modified is returned)"""
+
+    resp = get_retry_policy(session).call(session.get, url, timeout=timeout, headers=headers, name='get')
+
+    rate_header, rate_value = get_ratelimit_header(resp.headers)
+    msg = f"ratelimit : {rate_header}={rate_value} - {log_id or url}"
+    logger.info(msg)
+
+    if resp.status_code != 304:
+        resp.raise_for_status()
+
+    return resp
+
+
+def get_json(url, session, timeout=None, log_id=None):
+    """GET url and return decoded json body"""
+
+    return codec.response_json(get_response(url, session, timeout=timeout, log_id=log_id))
+
+
+def get_etag(headers, data=None):
+    """ETag header of a response or etag field of the resource"""
+    for k, v in (headers or {}).items():
+        if k.lower() == 'etag':
+            return v
+    if isinstance(data, dict) and isinstance(data.get('etag'), str):
+        return data['etag']
+    return None
+
+
+def iter_pages(url, session, timeout=None, log_id=None, prefetch=True):
+    """Iterate over pages of an ARM list operation, following nextLink
+
+    With prefetch, the next page is downloaded in a background thread while
+    the caller consumes the current one. At most two pages are kept in memory.
+
+    @see: https://docs.microsoft.com/en-us/rest/api/azure/#async-operations-throttling-and-paging
+    """
+
+    if not prefetch:
+        while url:
+            data = get_json(url, session, timeout=timeout, log_id=log_id)
+            url = data.get('nextLink')
+            yield data.get('value', [])
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(get_json, url, session, timeout=timeout, log_id=log_id)
+        while future:
+            data = future.result()
+            next_link = data.get('nextLink')
+            future = None
+            if next_link:
+                future = executor.submit(
+                    get_json, next_link, session, timeout=timeout, log_id=log_id
+                )
+            yield data.get('value', [])
+
+
+def iter_items(url, session, timeout=None, log_id=None, prefetch=True):
+    """Iterate over all items of an ARM list operation"""
+
+    for page in iter_pages(url, session, timeout=timeout, log_id=log_id, prefetch=prefetch):
+        yield from page
+
+
+def fetch_all(list_func, *args, **kwargs):
+    """Collect the output of a list function (get_*_list) in a list
+
+    >>> groups = fetch_all(get_resourcegroups_list, subscription_id, session=session)
+    """
+    return list(list_func(*args, **kwargs))
+
+
 # TODO: renvoyer le ratelimit
-# @retry(tries=3, sleep_time=10)
-def get_resource_by_id(resource_id, session=None, token=None, is_china=False, timeout=None):
+def get_resource_by_id(resource_id, session=None, token=None, is_china=False, timeout=None, cache=None):
     """Get Resource by ID
 
     # TODO: doc args
+    :param cache: cache.ResourceCache - read through cache. An expired resource
+                  with an ETag is revalidated (If-None-Match): not downloaded if not modified
 
     @see: https://docs.microsoft.com/en-us/rest/api/resources/resources/getbyid
     """
@@ -100,20 +281,236 @@ def get_resource_by_id(resource_id, session=None, token=None, is_china=False, ti
 
     base_url = get_azure_base_url(is_china=is_china)
     api_version = get_api_version(resource_id)
-    resource_id = resource_id.lstrip('/')
 
-    url = f"{base_url}/{resource_id}?api-version={api_version}"
+    stale = None
+    if cache is not None:
+        data = cache.get(resource_id, api_version)
+        if data is not None:
+            return data
+        stale = cache.get_stale(resource_id, api_version)
+
+    path = resource_id.lstrip('/')
+
+    url = f"{base_url}/{path}?api-version={api_version}"
     session = session or get_session(token=token)
 
-    resp = session.get(url, timeout=timeout)
+    headers = {'If-None-Match': stale[1]} if stale else None
+    resp = get_response(url, session, timeout=timeout, log_id=path, headers=headers)
+
+    if resp.status_code == 304 and stale:
+        logger.debug("not modified : %s" % resource_id)
+        if not cache.revalidate(resource_id, api_version, stale[0].get('type')):
+            # evicted since get_stale
+            cache.set(resource_id, api_version, stale[0], etag=stale[1])
+        return stale[0]
+
+    if resp.status_code == 304:
+        # no cached copy of this version: get it without condition
+        resp = get_response(url, session, timeout=timeout, log_id=path, headers={'If-None-Match': None})
+        if resp.status_code == 304:
+            msg = "not modified without cached resource : %s" % resource_id
+            logger.error(msg)
+            raise Exception(msg)
+
+    data = codec.response_json(resp)
+
+    if cache is not None:
+        cache.set(resource_id, api_version, data, etag=get_etag(resp.headers, data))
+
+    return data
+
+
+class BatchError(Exception):
+    """Error of one request in an ARM batch"""
+
+    def __init__(self, resource_id, status_code, content=None):
+        self.resource_id = resource_id
+        self.status_code = status_code
+        self.content = content
+        super().__init__(f"{status_code} - {resource_id} - {content}")
+
+
+def _post_batch(url, batch_requests, session, policy, timeout=None):
+    resp = policy.call(session.post, url, json={"requests": batch_requests}, timeout=timeout, name='batch')
+
+    # long running batch: poll Location
+    while resp.status_code == 202:
+        time.sleep(get_retry_after(resp.headers, default=1))
+        resp = policy.call(session.get, resp.headers['Location'], timeout=timeout, name='batch')
 
     rate_header, rate_value = get_ratelimit_header(resp.headers)
-    msg = f"ratelimit : {rate_header}={rate_value} - {resource_id}"
-    logger.info(msg)
+    logger.info(f"ratelimit : {rate_header}={rate_value} - batch of {len(batch_requests)}")
 
     resp.raise_for_status()
 
-    return resp.json()
+    return resp
+
+
+def get_resources_by_ids(resource_ids, session=None, token=None, is_china=False, timeout=None, cache=None):
+    """Get Resources by ID with ARM batch requests
+
+    :param resource_ids: resource IDs, one batch request per BATCH_SIZE resources
+    :param cache: cache.ResourceCache - cached resources are not requested
+
+    :return: (results, errors): dicts of resource_id -> resource and resource_id -> BatchError
+
+    @see: https://docs.microsoft.com/en-us/rest/api/resources/#batch (Microsoft.Resources/batch)
+    """
+
+    base_url = get_azure_base_url(is_china=is_china)
+    session = session or get_session(token=token)
+
+    results = {}
+    errors = {}
+    requests_ids = []
+    batch_requests = []
+
+    for resource_id in resource_ids:
+        try:
+            api_version = get_api_version(resource_id)
+        except Exception as err:
+            errors[resource_id] = BatchError(resource_id, None, str(err))
+            continue
+        if cache is not None:
+            data = cache.get(resource_id, api_version)
+            if data is not None:
+                results[resource_id] = data
+                continue
+        batch_requests.append({
+            "httpMethod": "GET",
+            "name": str(len(requests_ids)),
+            "url": f"/{resource_id.lstrip('/')}?api-version={api_version}",
+        })
+        requests_ids.append(resource_id)
+
+    if not batch_requests:
+        return results, errors
+
+    batch_requests_by_name = {request['name']: request for request in batch_requests}
+
+    url = f"{base_url}/batch?api-version={BATCH_API_VERSION}"
+    policy = get_retry_policy(session)
+    # a batch is limited to BATCH_SIZE requests
+    for batch_requests in chunks(batch_requests, BATCH_SIZE):
+        attempt = 0
+
+        while batch_requests:
+            attempt += 1
+            resp = _post_batch(url, batch_requests, session, policy, timeout=timeout)
+
+            retry_requests = []
+            retry_headers = retry_status = None
+            for response in codec.response_json(resp)['responses']:
+                resource_id = requests_ids[int(response['name'])]
+                status_code = response.get('httpStatusCode')
+                if status_code == 200:
+                    results[resource_id] = response.get('content')
+                    errors.pop(resource_id, None)
+                    if cache is not None:
+                        cache.set(
+                            resource_id, get_api_version(resource_id), results[resource_id],
+                            etag=get_etag(response.get('headers'), results[resource_id])
+                        )
+                else:
+                    errors[resource_id] = BatchError(resource_id, status_code, response.get('content'))
+                    if policy.is_retryable(status_code=status_code):
+                        retry_requests.append(batch_requests_by_name[response['name']])
+                        retry_headers = response.get('headers') or retry_headers
+                        retry_status = status_code
+
+            batch_requests = []
+            if retry_requests and policy.should_retry(attempt, name='batch'):
+                logger.warning(f"retry {len(retry_requests)} requests of batch - attempts[{attempt}/{policy.tries}]")
+                policy.wait(attempt, retry_headers, name='batch', status_code=retry_status)
+                batch_requests = retry_requests
+
+    return results, errors
+
+
+def iter_resources_expanded(subscription_id, session=None, token=None, is_china=False,
+                            batch_size=None, timeout=None, query=None, cache=None, exclude_ids=None,
+                            group_concurrency=None, compact=False, children=False):
+    """Iterate over all resources of a subscription fetched by ID
+
+    Errors are logged and skipped.
+
+    :param batch_size: use ARM batch requests of batch_size resources (at most BATCH_SIZE)
+    :param query: query.ResourceQuery for the listing
+    :param cache: cache.ResourceCache
+    :param exclude_ids: resource IDs (lower case) not to fetch. ex: already exported
+    :param group_concurrency: list resource groups concurrently
+    :param compact: yield model.Resource records instead of dicts
+    :param children: yield the child resources of each resource (children.CHILD_COLLECTIONS)
+                     after it, as returned by the listing of their parent. The children of
+                     exclude_ids are listed again. The asyncio engine lists them concurrently
+    """
+    session = session or get_session(token=token)
+    # not "or ()": the set of the children branch grows while the resources are listed
+    exclude_ids = () if exclude_ids is None else exclude_ids
+    convert = Resource.from_dict if compact else None
+    resource_ids = (
+        item['id'] for item in get_resources_list(
+            subscription_id, session=session, is_china=is_china, timeout=timeout,
+            query=query, group_concurrency=group_concurrency
+        ) if item['id'].lower() not in exclude_ids
+    )
+
+    if children:
+        from .children import iter_children
+
+        # also the exclude filter of the listing: a listed child (ex: sql database)
+        # already returned by its parent is not fetched again
+        seen = set(exclude_ids)
+        # exclude_ids can grow while exporting (checkpoint.done)
+        exported = list(exclude_ids)
+
+        def list_children(resource_id):
+            for child in iter_children(resource_id, session=session, is_china=is_china, timeout=timeout,
+                                       recursive=False):
+                if child['id'].lower() not in seen:
+                    seen.add(child['id'].lower())
+                    yield convert(child) if convert else child
+                    yield from list_children(child['id'])
+
+        for item in iter_resources_expanded(
+            subscription_id, session=session, is_china=is_china, batch_size=batch_size, timeout=timeout,
+            query=query, cache=cache, exclude_ids=seen, group_concurrency=group_concurrency
+        ):
+            if item['id'].lower() not in seen:
+                seen.add(item['id'].lower())
+                yield convert(item) if convert else item
+                yield from list_children(item['id'])
+
+        # resumed export: new children of the resources already exported
+        for resource_id in exported:
+            yield from list_children(resource_id)
+        return
+
+    if not batch_size:
+        for resource_id in resource_ids:
+            try:
+                data = get_resource_by_id(
+                    resource_id, session=session, is_china=is_china, timeout=timeout, cache=cache
+                )
+                yield convert(data) if convert else data
+            except Exception as err:
+                msg = "fetch resource [%s] error : %s" % (resource_id, err)
+                logger.error(msg)
+        return
+
+    for chunk in chunks(resource_ids, min(batch_size, BATCH_SIZE)):
+        try:
+            results, errors = get_resources_by_ids(
+                chunk, session=session, is_china=is_china, timeout=timeout, cache=cache
+            )
+        except Exception as err:
+            msg = "fetch batch [%s] error : %s" % (", ".join(chunk), err)
+            logger.error(msg)
+            continue
+        for resource_id, err in errors.items():
+            msg = "fetch resource [%s] error : %s" % (resource_id, err)
+            logger.error(msg)
+        yield from map(convert, results.values()) if convert else results.values()
 
 
 def get_tenants_list(session=None, token=None, is_china=False, timeout=None):
@@ -136,15 +533,12 @@ def get_tenants_list(session=None, token=None, is_china=False, timeout=None):
     """
     base_url = get_azure_base_url(is_china=is_china)
 
-    api_version = PROVIDERS.get("Microsoft.Resources/tenants".lower())
+    api_version = get_providers().get("Microsoft.Resources/tenants".lower())
 
     url = f"{base_url}/tenants?api-version={api_version}"
     session = session or get_session(token=token)
 
-    resp = session.get(url, timeout=timeout)
-    resp.raise_for_status()
-
-    return resp.json()['value']
+    yield from iter_items(url, session, timeout=timeout)
 
 
 def get_subscriptions_list(session=None, token=None, is_china=False, timeout=None):
@@ -178,15 +572,12 @@ def get_subscriptions_list(session=None, token=None, is_china=False, timeout=Non
     """
     base_url = get_azure_base_url(is_china=is_china)
 
-    api_version = PROVIDERS.get("Microsoft.Resources/subscriptions".lower())
+    api_version = get_providers().get("Microsoft.Resources/subscriptions".lower())
 
     url = f"{base_url}/subscriptions?api-version={api_version}"
     session = session or get_session(token=token)
 
-    resp = session.get(url, timeout=timeout)
-    resp.raise_for_status()
-
-    return resp.json()['value']
+    yield from iter_items(url, session, timeout=timeout)
 
 def get_regions_list(subscription_id, session=None, token=None, is_china=False, timeout=None):
     """
@@ -217,18 +608,12 @@ def get_regions_list(subscription_id, session=None, token=None, is_china=False,
     base_url = get_azure_base_url(is_china=is_china)
 
     #api_version = PROVIDERS.get("Microsoft.Resources/subscriptions/locations".lower())
-    api_version = PROVIDERS.get("Microsoft.Resources/locations".lower())
+    api_version = get_providers().get("Microsoft.Resources/locations".lower())
 
     url = f"{base_url}/subscriptions/{subscription_id}/locations?api-version={api_version}"
     session = session or get_session(token=token)
 
-    resp = session.get(url, timeout=timeout)
-
-    rate_header, rate_value = get_ratelimit_header(resp.headers)
-    msg = f"ratelimit : {rate_header}={rate_value} - {subscription_id}"
-    logger.info(msg)
-
-    resp.raise_for_status()
+    data = get_json(url, session, timeout=timeout, log_id=subscription_id)
 
     global_region = {
       "id": f"/subscriptions/{subscription_id}/locations/global",
@@ -238,36 +623,123 @@ def get_regions_list(subscription_id, session=None, token=None, is_china=False,
       "latitude": "0.0"
     }
 
-    return resp.json()['value'] + [global_region]
+    return data['value'] + [global_region]
 
 
-# TODO: filter type
-def get_resources_list(subscription_id, session=None, token=None, is_china=False, includes=PROVIDERS, timeout=None):
+def get_resources_list(subscription_id, session=None, token=None, is_china=False, includes=KNOWN_TYPES, timeout=None,
+                       query=None, group_concurrency=None, compact=False):
     """Get Resources List
 
+    Lazy generator: pages are followed through nextLink.
+
+    :param includes: resource types (lower case) to keep, client side
+    :param query: query.ResourceQuery - filters pushed to ARM ($filter, $top, $expand)
+    :param group_concurrency: list resource groups concurrently (see get_resources_list_by_groups)
+    :param compact: yield model.Resource records instead of dicts
+
     @see: https://docs.microsoft.com/en-us/rest/api/resources/resources/list
     """
 
+    query = query or ResourceQuery()
+
+    if group_concurrency and not query.resource_group:
+        yield from get_resources_list_by_groups(
+            subscription_id, session=session, token=token, is_china=is_china, includes=includes,
+            timeout=timeout, query=query, concurrency=group_concurrency, compact=compact
+        )
+        return
+
     base_url = get_azure_base_url(is_china=is_china)
 
-    api_version = PROVIDERS.get("Microsoft.Resources/resources".lower())
+    api_version = get_providers().get("Microsoft.Resources/resources".lower())
 
-    url = f"{base_url}/subscriptions/{subscription_id}/resources?api-version={api_version}"
+    path = query.get_path(subscription_id)
+    url = f"{base_url}/{path}?api-version={api_version}{query.get_querystring()}"
     session = session or get_session(token=token)
 
-    resp = session.get(url, timeout=timeout)
+    if includes is KNOWN_TYPES:
+        includes = get_providers()
 
-    rate_header, rate_value = get_ratelimit_header(resp.headers)
-    msg = f"ratelimit : {rate_header}={rate_value} - {subscription_id}"
-    logger.info(msg)
+    for item in iter_items(url, session, timeout=timeout, log_id=subscription_id):
+        if includes is not None and item['type'].lower() not in includes:
+            logger.debug("exclude type : %s" % item['type'].lower())
+        elif query.match(item):
+            yield Resource.from_dict(item) if compact else item
 
-    resp.raise_for_status()
 
-    for item in resp.json()['value']:
-        if item['type'].lower() in includes:
-            yield item
-        else:
-            logger.info("exclude type : %s" % item['type'].lower())
+def get_resources_list_by_groups(subscription_id, session=None, token=None, is_china=False, includes=KNOWN_TYPES,
+                                 timeout=None, query=None, concurrency=10, max_pending=1000, compact=False):
+    """Get Resources List, sharded by resource group
+
+    Lists resource groups then resourceGroups/{name}/resources of all groups
+    concurrently. Resources are yielded as they arrive (order is not stable)
+    and duplicates are removed. Workers block when max_pending resources are
+    waiting to be consumed. query.top is the limit of all the groups.
+
+    Groups not started yet are cancelled when the generator is closed or
+    a group fails.
+
+    :param concurrency: resource groups listed at the same time
+    """
+    session = session or get_session(token=token)
+    query = query or ResourceQuery()
+    items = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def list_group(group_name):
+        if stop.is_set():
+            return
+        try:
+            for item in get_resources_list(
+                subscription_id, session=session, is_china=is_china, includes=includes, timeout=timeout,
+                query=replace(query, resource_group=group_name), compact=compact
+            ):
+                put(item)
+                if stop.is_set():
+                    return
+        except Exception as err:
+            put(err)
+        finally:
+            put(done)
+
+    group_names = [
+        group['name'] for group in get_resourcegroups_list(
+            subscription_id, session=session, is_china=is_china, timeout=timeout
+        )
+    ]
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(list_group, group_name) for group_name in group_names]
+        try:
+            remaining = len(group_names)
+            while remaining:
+                emit('queue_depth', items.qsize(), queue='groups')
+                item = items.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    key = item['id'].lower()
+                    if key not in seen:
+                        seen.add(key)
+                        yield item
+                        if query.top and len(seen) >= query.top:
+                            return
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
 
 
 def get_resourcegroups_list(subscription_id, session=None, token=None, is_china=False, timeout=None):
@@ -278,22 +750,14 @@ def get_resourcegroups_list(subscription_id, session=None, token=None, is_china=
 
     base_url = get_azure_base_url(is_china=is_china)
 
-    api_version = PROVIDERS.get(
+    api_version = get_providers().get(
         "Microsoft.Resources/subscriptions/resourceGroups".lower()
     )
 
     url = f"{base_url}/subscriptions/{subscription_id}/resourcegroups?api-version={api_version}"
     session = session or get_session(token=token)
 
-    resp = session.get(url, timeout=timeout)
-
-    rate_header, rate_value = get_ratelimit_header(resp.headers)
-    msg = f"ratelimit : {rate_header}={rate_value} - {subscription_id}"
-    logger.info(msg)
-
-    resp.raise_for_status()
-
-    return resp.json()['value']
+    yield from iter_items(url, session, timeout=timeout, log_id=subscription_id)
 
 
 def get_resourcegroup_by_name(
@@ -306,9 +770,42 @@ def get_resourcegroup_by_name(
     raise NotImplementedError()
 
 
-def async_get_resources(subscription_id, session, pool_size=20, timeout=None):
+def async_get_resources(subscription_id, session, pool_size=20, timeout=None, engine="asyncio",
+                        controller=None, batch_size=None, query=None, cache=None, exclude_ids=None,
+                        group_concurrency=None, compact=False, children=False):
+    """Fetch all resources of a subscription concurrently
+
+    :param engine: asyncio (default) or gevent
+    :param controller: ratelimit.ConcurrencyController (asyncio engine only)
+    :param batch_size: ARM batch requests of batch_size resources (asyncio engine only)
+    :param query: query.ResourceQuery for the listing
+    :param cache: cache.ResourceCache
+    :param exclude_ids: resource IDs (lower case) not to fetch
+    :param group_concurrency: list resource groups concurrently (asyncio engine only)
+    :param compact: model.Resource records instead of dicts
+    :param children: list the child resources in the same pool (asyncio engine only)
 
-    if not GEVENT:
+    Use mce_azure.aio.get_resources from a running event loop.
+
+    :return: (resources, errors)
+    """
+
+    if engine == "asyncio":
+        import asyncio
+        from . import aio
+
+        return asyncio.run(
+            aio.get_resources(
+                subscription_id, session, pool_size=pool_size, timeout=timeout,
+                controller=controller, batch_size=batch_size, query=query, cache=cache,
+                exclude_ids=exclude_ids, group_concurrency=group_concurrency, compact=compact,
+                children=children
+            )
+        )
+
+    try:
+        from gevent.pool import Pool
+    except ImportError:
         raise Exception("gevent not available. install mce-lib-azure with pip install .[gevent]")
 
     pool = Pool(pool_size)
@@ -318,12 +815,14 @@ def async_get_resources(subscription_id, session, pool_size=20, timeout=None):
     greenlets = []
 
     for item in get_resources_list(
-        subscription_id, session=session, includes=PROVIDERS
+        subscription_id, session=session, query=query
     ):
         resource_id = item['id']
+        if exclude_ids and resource_id.lower() in exclude_ids:
+            continue
         try:
             greenlets.append(
-                pool.spawn(get_resource_by_id, resource_id, session=session, timeout=timeout)
+                pool.spawn(get_resource_by_id, resource_id, session=session, timeout=timeout, cache=cache)
             )
         except Exception as err:
             msg = "fetch resource [%s] error : %s" % (resource_id, err)
@@ -333,7 +832,7 @@ def async_get_resources(subscription_id, session, pool_size=20, timeout=None):
 
     for g in greenlets:
         if g.successful():
-            resources.append(g.value)
+            resources.append(Resource.from_dict(g.value) if compact else g.value)
         else:
             errors.append(g.exception)
 
@@ -342,6 +841,10 @@ def async_get_resources(subscription_id, session, pool_size=20, timeout=None):
 
 def options():
 
+    # .env is only loaded by the command line
+    from dotenv import load_dotenv
+    load_dotenv(verbose=False)
+
     parser = argparse.ArgumentParser(
         description='Azure Exlorer',
         formatter_class=argparse.RawTextHelpFormatter,
@@ -353,7 +856,7 @@ def options():
         '-b',
         dest='subscription_id',
         help='Subscription_id ID (provider format). Default: %(default)s',
-        default=DEFAULT_SUBSCRIPTION,
+        default=config('MCE_AZURE_SUBSCRIPTION', default=None),
     )  # required=True)
 
     parser.add_argument(
@@ -361,7 +864,7 @@ def options():
         '-t',
         dest='tenant',
         help='Tenant ID. Default: %(default)s',
-        default=DEFAULT_TENANT,
+        default=config('MCE_AZURE_TENANT', default=None),
     )  # required=True)
 
     parser.add_argument(
@@ -369,7 +872,7 @@ def options():
         '-u',
         dest='user',
         help='Client ID or Username. Default: %(default)s',
-        default=DEFAULT_USER,
+        default=config('MCE_AZURE_USER', default=None),
     )  # required=True)
 
     parser.add_argument(
@@ -377,7 +880,7 @@ def options():
         '-p',
         dest='password',
         help='Secret ID or Password.',
-        default=DEFAULT_PASSWORD,
+        default=config('MCE_AZURE_PASSWORD', default=None),
     )  # required=True)
 
     parser.add_argument(
@@ -397,6 +900,13 @@ def options():
         required=False,
     )
 
+    parser.add_argument(
+        '--token-cache',
+        dest='token_cache',
+        help='token cache file shared between processes',
+        default=config('MCE_AZURE_TOKEN_CACHE', default=None),
+    )
+
     parser.add_argument('--json', action="store_true")
 
     parser.add_argument('--debug', action="store_true")
@@ -404,7 +914,7 @@ def options():
     parser.add_argument(
         '--command',
         '-C',
-        choices=['get', 'list', 'group'],
+        choices=['get', 'list', 'group', 'crawl', 'diff'],
         dest='command',
         help='Command',
         required=True,
@@ -414,18 +924,236 @@ def options():
         '--export', dest='export_json_file', help='Export File', required=False
     )
 
+    parser.add_argument(
+        '--old', dest='old_file', help='old export file (for diff command only)',
+    )
+
+    parser.add_argument(
+        '--new', dest='new_file', help='new export file (for diff command only)',
+    )
+
+    parser.add_argument(
+        '--ignore',
+        dest='ignore',
+        action='append',
+        default=[],
+        help='field not compared. ex: properties.provisioningState. Repeat for several fields. '
+             'Keys containing dots are not supported here (see diff.diff_exports). (for diff command only)',
+    )
+
+    parser.add_argument(
+        '--format',
+        dest='export_format',
+        choices=FORMATS,
+        help='Export format. Default: ndjson for .ndjson/.jsonl files, json otherwise',
+    )
+
+    parser.add_argument(
+        '--gzip',
+        action="store_true",
+        help='gzip export file. Default: if export file ends with .gz',
+    )
+
+    parser.add_argument(
+        '--checkpoint',
+        action="store_true",
+        help='record exported resources in a journal (EXPORT.journal) to allow --resume',
+    )
+
+    parser.add_argument(
+        '--resume',
+        action="store_true",
+        help='continue an interrupted export with checkpoint (implies --checkpoint)',
+    )
+
     parser.add_argument(
         '--expand',
         action="store_true",
         help='fetch all informations for each Resource. (for list command only)',
     )
 
+    parser.add_argument(
+        '--children',
+        action="store_true",
+        help='with --expand, add the child resources: subnets, databases, extensions... (list and crawl commands)',
+    )
+
+    parser.add_argument(
+        '--type',
+        dest='types',
+        action='append',
+        help='filter resource type (server side). Repeat for several types. (for list command only)',
+    )
+
+    parser.add_argument(
+        '--resource-group',
+        '-g',
+        dest='resource_group',
+        help='filter resource group. (for list command only)',
+    )
+
+    parser.add_argument(
+        '--tag',
+        dest='tag',
+        help='filter tag: NAME or NAME=VALUE. (for list command only)',
+    )
+
+    parser.add_argument(
+        '--list-expand',
+        dest='list_expand',
+        nargs='+',
+        choices=EXPAND_FIELDS,
+        help='add fields to listed resources. (for list command only)',
+    )
+
+    parser.add_argument(
+        '--incremental',
+        dest='snapshot_file',
+        help='incremental inventory: fetch only resources changed since the snapshot file. (for list command only)',
+    )
+
+    parser.add_argument(
+        '--cache',
+        dest='cache_file',
+        help='SQLite cache file for resources fetched by ID (get command and --expand)',
+    )
+
+    parser.add_argument(
+        '--cache-ttl',
+        dest='cache_ttl',
+        type=int,
+        default=3600,
+        help='cache TTL in seconds. Default: %(default)s',
+    )
+
+    parser.add_argument(
+        '--cache-stale-ttl',
+        dest='cache_stale_ttl',
+        type=int,
+        default=7 * 86400,
+        help='keep expired resources to revalidate them with their ETag (If-None-Match). Default: %(default)s',
+    )
+
+    parser.add_argument(
+        '--group-concurrency',
+        dest='group_concurrency',
+        type=int,
+        help='list resource groups concurrently instead of the whole subscription. (for list command only)',
+    )
+
+    parser.add_argument(
+        '--processes',
+        dest='processes',
+        type=int,
+        default=4,
+        help='worker processes (for crawl command only). Default: %(default)s',
+    )
+
+    parser.add_argument(
+        '--pool-size',
+        dest='pool_size',
+        type=int,
+        default=20,
+        help='concurrent requests per subscription (for crawl command only). Default: %(default)s',
+    )
+
+    parser.add_argument(
+        '--batch',
+        dest='batch_size',
+        type=int,
+        nargs='?',
+        const=BATCH_SIZE,
+        default=None,
+        help=f'with --expand, fetch resources with ARM batch requests. Default and max size: {BATCH_SIZE}',
+    )
+
+    parser.add_argument(
+        '--graph',
+        action="store_true",
+        help='fetch full resources with Azure Resource Graph queries instead of one GET per resource '
+             '(list and crawl commands, implies --expand)',
+    )
+
+    parser.add_argument(
+        '--retries',
+        dest='retries',
+        type=int,
+        default=3,
+        help='retries of a throttled or failed ARM request. Default: %(default)s',
+    )
+
+    parser.add_argument(
+        '--record',
+        dest='record_file',
+        help='record the ARM responses in this archive file (gzip)',
+    )
+
+    parser.add_argument(
+        '--replay',
+        dest='replay_file',
+        help='replay the ARM responses of an archive file, without network and authentication',
+    )
+
+    parser.add_argument(
+        '--replay-timing',
+        dest='replay_timing',
+        action='store_true',
+        help='with --replay, wait the recorded latency of each response',
+    )
+
+    parser.add_argument(
+        '--replay-speed',
+        dest='replay_speed',
+        type=float,
+        default=1.0,
+        help='with --replay-timing, divide the recorded latencies. Default: %(default)s',
+    )
+
+    parser.add_argument(
+        '--metrics',
+        dest='metrics_file',
+        help='write the requests metrics: json summary, or Prometheus text for .prom files',
+    )
+
     return parser.parse_args()
 
 
+def diff_command(args):
+    from .diff import diff_exports
+
+    if not args.old_file or not args.new_file:
+        raise SystemExit("--old and --new are required for diff command")
+
+    start = time.time()
+    summary = {'added': 0, 'removed': 0, 'modified': 0}
+    exporter = None
+    if args.export_json_file:
+        exporter = open_exporter(args.export_json_file, export_format=args.export_format, compress=args.gzip or None)
+    try:
+        for entry in diff_exports(args.old_file, args.new_file, ignore=args.ignore):
+            summary[entry.op] += 1
+            if exporter:
+                exporter.write(entry.to_dict())
+            else:
+                pprint(entry.to_dict())
+    finally:
+        if exporter:
+            exporter.close()
+    pprint(summary)
+
+    duration = time.time() - start
+    logger.info("DURATION: %d" % duration)
+
+
 def main():
     args = options()
 
+    if args.resume:
+        args.checkpoint = True
+
+    if args.checkpoint and (args.gzip or (args.export_json_file or '').endswith('.gz')):
+        raise SystemExit("compressed export (--gzip or .gz) is not available with --checkpoint or --resume")
+
     logging_level = logging.INFO
 
     if args.debug:
@@ -433,95 +1161,210 @@ def main():
 
     logging.basicConfig(level=logging_level)
 
+    if args.command == "diff":
+        # offline: no authentication
+        return diff_command(args)
+
     subscription_id = args.subscription_id
     user = args.user
     password = args.password
     tenant = args.tenant
     resource_id = args.resource_id
 
-    token = get_access_token(
-        subscription_id=subscription_id,
-        user=user,
-        password=password,
-        tenant=tenant,
-        is_china=False,
-    )
+    tmp_token_dir = None
+    if args.command == "crawl" and not args.token_cache:
+        # workers share the token of the main process
+        tmp_token_dir = tempfile.mkdtemp(prefix="mce-azure-")
+        args.token_cache = os.path.join(tmp_token_dir, 'tokens.json')
+
+    if args.command == "crawl" and (args.record_file or args.replay_file):
+        raise SystemExit("--record and --replay are not available for crawl command")
+
+    transport = None
+    if args.record_file:
+        from .transport import RecordingAdapter
+        transport = RecordingAdapter(args.record_file, pool_connections=args.pool_size, pool_maxsize=args.pool_size)
+    elif args.replay_file:
+        from .transport import ReplayAdapter
+        transport = ReplayAdapter(args.replay_file, timing=args.replay_timing, speed=args.replay_speed)
+
+    retry_policy = RetryPolicy(tries=args.retries + 1)
+
+    provider = None
+    if args.replay_file:
+        # offline: no authentication
+        session = get_session(token="replay", retry_policy=retry_policy, transport=transport)
+    else:
+        provider = TokenProvider(
+            user, password, tenant=tenant, is_china=False, cache_file=args.token_cache
+        )
+        session = provider.attach(
+            get_session(pool_size=args.pool_size, retry_policy=retry_policy, transport=transport)
+        )
+        provider.start()
+
+    metrics = cache = None
+    start = time.time()
 
-    session = get_session(token=token['access_token'])
+    try:
+        if args.metrics_file:
+            from .metrics import Metrics
+            metrics = Metrics()
+            metrics.install(session)
+
+        if args.cache_file:
+            from .cache import ResourceCache
+            cache = ResourceCache(args.cache_file, default_ttl=args.cache_ttl, stale_ttl=args.cache_stale_ttl)
+
+        if args.command == "get" and resource_id:
+            data = get_resource_by_id(resource_id, session=session, cache=cache)
+            if args.json:
+                print(codec.dumps(data, indent=4).decode('utf-8'))
+            else:
+                pprint(data)
+
+        elif args.command == "list":
+
+            tag_name, _, tag_value = (args.tag or "").partition('=')
+            query = ResourceQuery(
+                types=args.types,
+                resource_group=args.resource_group,
+                tag_name=tag_name or None,
+                tag_value=tag_value or None,
+                expand=args.list_expand,
+            )
 
-    start = time.time()
+            if args.snapshot_file:
+                from .incremental import SnapshotStore, incremental_inventory
 
-    if args.command == "get" and resource_id:
-        data = get_resource_by_id(resource_id, session=session)
-        if args.json:
-            print(
-                json.dumps(
-                    data, indent=4, escape_forward_slashes=False, ensure_ascii=False
+                changes = incremental_inventory(
+                    subscription_id, SnapshotStore(args.snapshot_file), session=session, query=query
                 )
-            )
-        else:
-            pprint(data)
-
-    elif args.command == "list":
-
-        if args.export_json_file:
-            with open(args.export_json_file, 'w') as fp:
-
-                if args.expand:
-                    datas = []
-
-                    for item in get_resources_list(
-                        subscription_id, session=session, includes=PROVIDERS
-                    ):
-                        try:
-                            datas.append(
-                                get_resource_by_id(item['id'], session=session)
-                            )
-                        except Exception as err:
-                            msg = "fetch resource [%s] error : %s" % (item['id'], err)
-                            logger.error(msg)
-
-                    json.dump(
-                        datas,
-                        fp,
-                        indent=4,
-                        escape_forward_slashes=False,
-                        ensure_ascii=False,
-                    )
+                if args.export_json_file:
+                    with open(args.export_json_file, 'wb') as fp:
+                        fp.write(codec.dumps(changes.to_dict(), indent=4))
                 else:
+                    pprint(changes.to_dict())
 
-                    resource_list = list(
-                        get_resources_list(
-                            subscription_id, session=session, includes=PROVIDERS
-                        )
+            else:
+                exporter = checkpoint = None
+                exclude_ids = set()
+
+                if args.export_json_file and args.checkpoint:
+                    exporter, checkpoint = open_checkpoint(
+                        args.export_json_file, export_format=args.export_format, resume=args.resume,
+                        compress=args.gzip or None
                     )
-                    json.dump(
-                        resource_list,
-                        fp,
-                        indent=4,
-                        escape_forward_slashes=False,
-                        ensure_ascii=False,
+                    exclude_ids = checkpoint.done
+                elif args.export_json_file:
+                    exporter = open_exporter(
+                        args.export_json_file, export_format=args.export_format, compress=args.gzip or None
                     )
-        else:
-            for item in get_resources_list(
-                subscription_id, session=session, includes=PROVIDERS
-            ):
-                if args.expand:
-                    item = get_resource_by_id(item['id'], session=session)
-                print('--------------------------------------------------------')
-                pprint(item)
-                print('--------------------------------------------------------')
-
-    elif args.command == "group":
-        data = get_resourcegroups_list(subscription_id, session=session)
-        if args.json:
-            print(
-                json.dumps(
-                    data, indent=4, escape_forward_slashes=False, ensure_ascii=False
-                )
+
+                if args.graph:
+                    from .graph import iter_resources_graph
+                    items = (
+                        item for item in iter_resources_graph(subscription_id, session=session, query=query)
+                        if item['id'].lower() not in exclude_ids
+                    )
+                elif args.expand:
+                    items = iter_resources_expanded(
+                        subscription_id, session=session, batch_size=args.batch_size, query=query,
+                        cache=cache, exclude_ids=exclude_ids, group_concurrency=args.group_concurrency,
+                        children=args.children
+                    )
+                else:
+                    items = (
+                        item for item in get_resources_list(
+                            subscription_id, session=session, query=query,
+                            group_concurrency=args.group_concurrency
+                        ) if item['id'].lower() not in exclude_ids
+                    )
+
+                if exporter:
+                    try:
+                        for item in items:
+                            if checkpoint:
+                                checkpoint.write(exporter, item)
+                            else:
+                                exporter.write(item)
+                    finally:
+                        exporter.close()
+                        if checkpoint:
+                            checkpoint.close()
+                    if checkpoint:
+                        checkpoint.remove()
+                    logger.info("export %s resources to %s" % (exporter.count, args.export_json_file))
+                else:
+                    for item in items:
+                        print('--------------------------------------------------------')
+                        pprint(item)
+                        print('--------------------------------------------------------')
+
+        elif args.command == "crawl":
+            from .crawler import crawl_tenant, get_enabled_subscriptions
+
+            if not args.export_json_file:
+                raise SystemExit("--export is required for crawl command")
+
+            tag_name, _, tag_value = (args.tag or "").partition('=')
+            query = ResourceQuery(
+                types=args.types,
+                tag_name=tag_name or None,
+                tag_value=tag_value or None,
+                expand=args.list_expand,
             )
-        else:
-            pprint(data)
+            credentials = {
+                'user': user,
+                'password': password,
+                'tenant': tenant,
+                'token_cache': args.token_cache,
+            }
+
+            try:
+                with open_exporter(
+                    args.export_json_file, export_format=args.export_format, compress=args.gzip or None
+                ) as exporter:
+                    if args.graph:
+                        # one query for all the subscriptions: no worker process
+                        from .graph import iter_resources_graph
+                        subscription_ids = get_enabled_subscriptions(session)
+                        for item in iter_resources_graph(subscription_ids, session=session, query=query):
+                            exporter.write(item)
+                        summary = {'subscriptions': len(subscription_ids), 'resources': exporter.count}
+                    else:
+                        summary = crawl_tenant(
+                            credentials, exporter.write, processes=args.processes, expand=args.expand,
+                            batch_size=args.batch_size, pool_size=args.pool_size, query=query,
+                            metrics=metrics, children=args.children,
+                        )
+            finally:
+                if tmp_token_dir:
+                    shutil.rmtree(tmp_token_dir, ignore_errors=True)
+            pprint(summary)
+
+        elif args.command == "group":
+            data = fetch_all(get_resourcegroups_list, subscription_id, session=session)
+            if args.json:
+                print(codec.dumps(data, indent=4).decode('utf-8'))
+            else:
+                pprint(data)
+
+    finally:
+        # also on errors and interrupts: the recorded archive is completed
+        if provider:
+            provider.stop()
+        session.close()
+
+        logger.info("retries: %s" % retry_policy.stats())
+        if cache:
+            logger.info("cache: %s" % cache.stats())
+        if args.replay_file:
+            logger.info("replay: %s" % transport.stats())
+
+        if metrics:
+            metrics.close()
+            metrics.write(args.metrics_file)
 
     duration = time.time() - start
     logger.info("DURATION: %d" % duration)
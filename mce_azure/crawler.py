@@ -0,0 +1,202 @@
+"""Tenant-wide crawler
+
+All enabled subscriptions visible to the credentials are crawled in
+parallel: each subscription is a shard crawled by a worker process into
+a temporary NDJSON file. Shards are merged in one stream as they complete
+and a failed subscription doesn't stop the others.
+
+>>> credentials = {"user": user, "password": password, "tenant": tenant, "token_cache": "/tmp/tokens.json"}
+>>> with open_exporter("tenant.ndjson") as exporter:
+>>> ...summary = crawl_tenant(credentials, exporter.write, processes=8, expand=True)
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import List, NamedTuple, Optional
+
+from . import codec, core
+from .metrics import Metrics
+from .resource_id import parse_resource_id
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ShardResult', 'get_enabled_subscriptions', 'crawl_subscription', 'iter_shards', 'crawl_tenant']
+
+
+class ShardResult(NamedTuple):
+    subscription_id: str
+    count: int = 0
+    errors: List[str] = []
+    filepath: Optional[str] = None
+    error: Optional[str] = None
+    duration: float = 0.0
+    # metrics.Metrics summary of the worker
+    metrics: Optional[dict] = None
+
+
+def get_session_from_credentials(credentials, pool_size=None):
+    """
+    :param credentials: dict with access_token, or user, password, tenant, is_china, token_cache
+    :param pool_size: keep-alive connections of the session (see core.get_session)
+
+    :return: (session, auth.TokenProvider or None). Start the provider for a long crawl
+    """
+    if credentials.get('access_token'):
+        return core.get_session(token=credentials['access_token'], pool_size=pool_size), None
+
+    from .auth import TokenProvider
+
+    provider = TokenProvider(
+        credentials['user'], credentials['password'], tenant=credentials.get('tenant'),
+        is_china=credentials.get('is_china', False), cache_file=credentials.get('token_cache'),
+    )
+    return provider.attach(core.get_session(pool_size=pool_size)), provider
+
+
+def get_enabled_subscriptions(session, is_china=False, timeout=None):
+    return [
+        item['subscriptionId'] for item in core.get_subscriptions_list(
+            session=session, is_china=is_china, timeout=timeout
+        ) if item.get('state') == 'Enabled'
+    ]
+
+
+def crawl_subscription(subscription_id, credentials, workdir, expand=False, batch_size=None,
+                       pool_size=20, query=None, is_china=False, timeout=None, group_concurrency=None,
+                       metrics=False, children=False):
+    """Worker: crawl one subscription into workdir/<subscription_id>.ndjson
+
+    :param metrics: collect the metrics of the requests in ShardResult.metrics
+    :param children: with expand, list the child resources (see children.py)
+
+    :rtype: ShardResult
+    """
+    start = time.time()
+    filepath = os.path.join(workdir, f"{subscription_id}.ndjson")
+    errors = []
+    count = 0
+    collector = Metrics() if metrics else None
+    provider = None
+
+    try:
+        session, provider = get_session_from_credentials(credentials, pool_size=pool_size)
+        if provider:
+            # a shard can outlive the token
+            provider.start()
+        if collector:
+            collector.install(session)
+        with open(filepath, 'wb') as fp:
+
+            def write(resource):
+                nonlocal count
+                fp.write(codec.dumps(resource) + b"\n")
+                count += 1
+
+            if expand:
+                from . import aio
+
+                _, fetch_errors = asyncio.run(aio.get_resources(
+                    subscription_id, session, pool_size=pool_size, timeout=timeout, is_china=is_china,
+                    batch_size=batch_size, query=query, callback=write,
+                    group_concurrency=group_concurrency, children=children,
+                ))
+                errors = [str(err) for err in fetch_errors]
+            else:
+                for item in core.get_resources_list(
+                    subscription_id, session=session, is_china=is_china, timeout=timeout, query=query,
+                    group_concurrency=group_concurrency,
+                ):
+                    write(item)
+
+    except Exception as err:
+        msg = "crawl subscription [%s] error : %s" % (subscription_id, err)
+        logger.error(msg)
+        return ShardResult(subscription_id, count, errors, None, str(err), time.time() - start,
+                           _close_metrics(collector))
+    finally:
+        if provider:
+            provider.stop()
+        # worker processes are reused for the next shards
+        parse_resource_id.cache_clear()
+
+    return ShardResult(subscription_id, count, errors, filepath, None, time.time() - start,
+                       _close_metrics(collector))
+
+
+def _close_metrics(collector):
+    if collector is None:
+        return None
+    collector.close()
+    return collector.summary()
+
+
+def iter_shards(subscription_ids, credentials, workdir, processes=4, **kwargs):
+    """Crawl subscriptions in a process pool and yield ShardResult as they complete"""
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=get_context('spawn')) as executor:
+        futures = {
+            executor.submit(crawl_subscription, subscription_id, credentials, workdir, **kwargs): subscription_id
+            for subscription_id in subscription_ids
+        }
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:
+                # worker process crash
+                yield ShardResult(futures[future], error=str(err))
+
+
+def crawl_tenant(credentials, callback, subscription_ids=None, processes=4, workdir=None,
+                 is_china=False, timeout=None, progress=None, metrics=None, **kwargs):
+    """Crawl all enabled subscriptions and send each resource to callback
+
+    :param credentials: see get_session_from_credentials
+    :param callback: called with each resource (ex: exporter.write)
+    :param subscription_ids: Default: all enabled subscriptions
+    :param progress: called with (done, total, ShardResult) after each shard
+    :param metrics: metrics.Metrics - receives the metrics of all workers
+    :param kwargs: crawl_subscription options: expand, batch_size, pool_size, query, group_concurrency, children
+
+    :return: summary dict
+    """
+    if subscription_ids is None:
+        session, _ = get_session_from_credentials(credentials)
+        subscription_ids = get_enabled_subscriptions(session, is_china=is_china, timeout=timeout)
+
+    total = len(subscription_ids)
+    summary = {'subscriptions': total, 'resources': 0, 'errors': 0, 'failed': {}}
+    tmp_workdir = workdir or tempfile.mkdtemp(prefix="mce-azure-")
+
+    try:
+        for done, result in enumerate(iter_shards(
+            subscription_ids, credentials, tmp_workdir, processes=processes,
+            is_china=is_china, timeout=timeout, metrics=metrics is not None, **kwargs
+        ), start=1):
+            if metrics is not None and result.metrics:
+                metrics.merge(result.metrics)
+            if result.error:
+                summary['failed'][result.subscription_id] = result.error
+            else:
+                with open(result.filepath, 'rb') as fp:
+                    for line in fp:
+                        callback(codec.loads(line))
+                os.remove(result.filepath)
+                summary['resources'] += result.count
+                summary['errors'] += len(result.errors)
+
+            logger.info("[%s/%s] subscription %s : %s resources - %s errors - %.1fs%s" % (
+                done, total, result.subscription_id, result.count, len(result.errors), result.duration,
+                f" - FAILED: {result.error}" if result.error else ""
+            ))
+            if progress:
+                progress(done, total, result)
+    finally:
+        if not workdir:
+            shutil.rmtree(tmp_workdir, ignore_errors=True)
+
+    return summary
@@ -0,0 +1,172 @@
+"""Diff of two inventory exports
+
+Both exports are streamed (ndjson or json array, gzip or not). The old
+export is indexed by resource ID with a digest of each resource (canonical
+json) and its offset in the file: the memory is bounded by this index, not
+by the resources. Resources of the new export with the same digest are
+skipped, only the offsets of the other ones are kept: they are compared
+field by field with the old resources, read again in the order of the old
+file (one pass, also on a gzip file). The modified resources of a gzip new
+export are written to a temporary file to be read again without
+decompressing the file from the start.
+
+>>> for entry in diff_exports("monday.ndjson", "tuesday.ndjson", ignore=["properties.provisioningState"]):
+>>> ...print(entry.op, entry.id, [change.path for change in entry.changes])
+modified /subscriptions/.../virtualMachines/vm1 ['properties.hardwareProfile.vmSize', 'tags.env']
+
+$ mce-az -C diff --old monday.ndjson --new tuesday.ndjson --export drift.ndjson
+"""
+import hashlib
+import logging
+import tempfile
+from typing import Any, List, NamedTuple, Optional
+
+from . import codec
+from .export import ExportReader
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['DiffEntry', 'FieldChange', 'diff_exports', 'diff_resources', 'get_digest']
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+CHANGED = 'changed'
+
+
+class FieldChange(NamedTuple):
+    # added, removed or changed
+    op: str
+    # ex: properties.ipConfigurations[0].name
+    path: str
+    old: Any = None
+    new: Any = None
+
+    def to_dict(self):
+        data = {'op': self.op, 'path': self.path}
+        if self.op != ADDED:
+            data['old'] = self.old
+        if self.op != REMOVED:
+            data['new'] = self.new
+        return data
+
+
+class DiffEntry(NamedTuple):
+    # added, removed or modified
+    op: str
+    id: str
+    # modified: field changes
+    changes: List[FieldChange] = []
+    # added: new resource, removed: old resource
+    resource: Optional[dict] = None
+
+    def to_dict(self):
+        data = {'op': self.op, 'id': self.id}
+        if self.op == MODIFIED:
+            data['changes'] = [change.to_dict() for change in self.changes]
+        else:
+            data['resource'] = self.resource
+        return data
+
+
+def _strip(resource, ignore):
+    """Remove the ignored paths (tuples of keys) of a resource"""
+    for path in ignore:
+        data = resource
+        for key in path[:-1]:
+            data = data.get(key) if isinstance(data, dict) else None
+        if isinstance(data, dict):
+            data.pop(path[-1], None)
+    return resource
+
+
+def get_digest(resource):
+    """Digest of the canonical json of a resource (keys order is ignored)"""
+    return hashlib.blake2b(codec.dumps(resource, sort_keys=True), digest_size=16).digest()
+
+
+def _join(path, key):
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    return f"{path}.{key}" if path else key
+
+
+def diff_resources(old, new, path=""):
+    """Iterate over the FieldChange between two documents
+
+    Lists are compared item by item.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                yield FieldChange(REMOVED, _join(path, key), old=old[key])
+            else:
+                yield from diff_resources(old[key], new[key], _join(path, key))
+        for key in new:
+            if key not in old:
+                yield FieldChange(ADDED, _join(path, key), new=new[key])
+    elif isinstance(old, list) and isinstance(new, list):
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            yield from diff_resources(old_item, new_item, _join(path, index))
+        for index in range(len(new), len(old)):
+            yield FieldChange(REMOVED, _join(path, index), old=old[index])
+        for index in range(len(old), len(new)):
+            yield FieldChange(ADDED, _join(path, index), new=new[index])
+    elif old != new or type(old) != type(new):
+        yield FieldChange(CHANGED, path, old=old, new=new)
+
+
+def diff_exports(old_filepath, new_filepath, ignore=()):
+    """Iterate over the DiffEntry between two exports
+
+    Added resources are yielded in the order of the new export, then the
+    modified and the removed resources in the order of the old export.
+
+    :param ignore: paths not compared. ex: ["etag", "properties.provisioningState"].
+                   A key with dots is given as a list of keys: ["tags", "app.kubernetes.io/name"]
+    """
+    ignore = [tuple(path.split('.')) if isinstance(path, str) else tuple(path) for path in ignore]
+
+    with ExportReader(old_filepath) as old_reader, ExportReader(new_filepath) as new_reader, \
+            tempfile.TemporaryFile() as spill:
+
+        # resource id (lower case) -> (digest, offset)
+        index = {}
+        for offset, resource in old_reader:
+            index[resource['id'].lower()] = (get_digest(_strip(resource, ignore)), offset)
+        logger.info("%s resources in %s" % (len(index), old_filepath))
+
+        def read_new(offset):
+            if new_reader.compressed:
+                spill.seek(offset)
+                return codec.loads(spill.readline())
+            return _strip(new_reader.read_at(offset), ignore)
+
+        seen = set()
+        # (old offset, new offset): new offset in spill for a gzip file
+        modified = []
+        for offset, resource in new_reader:
+            key = resource['id'].lower()
+            if key in seen:
+                logger.warning("duplicate resource [%s] in %s" % (resource['id'], new_filepath))
+                continue
+            seen.add(key)
+
+            old = index.pop(key, None)
+            if old is None:
+                yield DiffEntry(ADDED, resource['id'], resource=resource)
+                continue
+            if get_digest(_strip(resource, ignore)) != old[0]:
+                if new_reader.compressed:
+                    offset = spill.tell()
+                    spill.write(codec.dumps(resource) + b"\n")
+                modified.append((old[1], offset))
+
+        for old_offset, new_offset in sorted(modified):
+            old_resource = _strip(old_reader.read_at(old_offset), ignore)
+            resource = read_new(new_offset)
+            yield DiffEntry(MODIFIED, resource['id'], changes=list(diff_resources(old_resource, resource)))
+
+        for digest, offset in sorted(index.values(), key=lambda item: item[1]):
+            resource = old_reader.read_at(offset)
+            yield DiffEntry(REMOVED, resource['id'], resource=resource)
@@ -0,0 +1,215 @@
+"""Streaming export of resources
+
+Each resource is written as soon as it is received, one resource per line:
+
+- ndjson: one JSON document per line
+- json: a JSON array. On a seekable file each resource is written with
+  the closing bracket, overwritten by the next resource: the file is a
+  valid JSON document at any time (one positioned write per resource).
+
+Files ending with .gz are gzip compressed (a truncated gzip file can't be
+kept valid: prefer ndjson for long crawls).
+
+>>> with open_exporter("resources.ndjson") as exporter:
+>>> ...for resource in iter_resources_expanded(subscription_id, session=session):
+>>> ......exporter.write(resource)
+
+Exports are read back one resource at a time (both formats):
+
+>>> with ExportReader("resources.ndjson.gz") as reader:
+>>> ...for offset, resource in reader:
+>>> ......resource = reader.read_at(offset)
+"""
+import gzip
+import io
+import logging
+import os
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['NDJsonExporter', 'JsonArrayExporter', 'ExportReader', 'open_exporter', 'get_format', 'FORMATS']
+
+FORMATS = ('json', 'ndjson')
+
+_ARRAY_END = b"\n]\n"
+
+
+def _default(obj):
+    # model.Resource
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _dumps(resource):
+    return codec.dumps(resource, default=_default)
+
+
+class NDJsonExporter:
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def write(self, resource):
+        self.fp.write(_dumps(resource) + b"\n")
+        self.count += 1
+
+    @property
+    def offset(self):
+        """Position after the last written resource"""
+        return self.fp.tell()
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonArrayExporter(NDJsonExporter):
+
+    def __init__(self, fp, count=0):
+        super().__init__(fp)
+        self.count = count
+        self.seekable = not isinstance(fp, gzip.GzipFile) and fp.seekable()
+        if not count:
+            self.fp.write(b"[")
+        if self.seekable:
+            self.fp.flush()
+            self._position = self.fp.tell()
+            self._fd = _get_fd(fp) if hasattr(os, 'pwrite') else None
+            self._write_at(b"")
+
+    def _write_at(self, data):
+        # with the end of the array, overwritten by the next resource
+        buffer = data + _ARRAY_END
+        if self._fd is not None:
+            # one system call, the file position is not used
+            position = self._position
+            while buffer:
+                written = os.pwrite(self._fd, buffer, position)
+                buffer = buffer[written:]
+                position += written
+        else:
+            self.fp.seek(self._position)
+            self.fp.write(buffer)
+            self.fp.flush()
+        self._position += len(data)
+
+    @property
+    def offset(self):
+        """Position after the last written resource"""
+        return self._position if self.seekable else self.fp.tell()
+
+    def write(self, resource):
+        data = (b",\n" if self.count else b"\n") + _dumps(resource)
+        self.count += 1
+        if self.seekable:
+            self._write_at(data)
+        else:
+            self.fp.write(data)
+
+    def close(self):
+        if self.seekable:
+            self.fp.seek(self._position)
+        self.fp.write(_ARRAY_END)
+        if self.seekable:
+            self.fp.truncate()
+        self.fp.close()
+
+
+def _get_fd(fp):
+    try:
+        return fp.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+
+def get_format(filepath, export_format=None):
+    """Format from the file extension (.ndjson, .jsonl) or json"""
+    if export_format:
+        return export_format
+    name = filepath[:-3] if filepath.endswith('.gz') else filepath
+    if name.endswith('.ndjson') or name.endswith('.jsonl'):
+        return 'ndjson'
+    return 'json'
+
+
+def open_exporter(filepath, export_format=None, compress=None):
+    """
+    :param export_format: json or ndjson. Default: from the file extension
+    :param compress: gzip compression. Default: True if filepath ends with .gz
+    """
+    export_format = get_format(filepath, export_format)
+    if export_format not in FORMATS:
+        raise ValueError(f"invalid export format [{export_format}]. choices: {', '.join(FORMATS)}")
+
+    if compress is None:
+        compress = filepath.endswith('.gz')
+
+    fp = gzip.open(filepath, 'wb') if compress else open(filepath, 'wb')
+
+    if export_format == 'ndjson':
+        return NDJsonExporter(fp)
+    return JsonArrayExporter(fp)
+
+
+class ExportReader:
+    """Read the resources of an export (ndjson or json array of open_exporter)
+
+    Resources must be one per line (as written by the exporters). Iteration
+    yields (offset, resource): read_at(offset) reads the resource again (on
+    a gzip file, seeking backward decompress again from the start).
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as fp:
+            self.compressed = fp.read(2) == b"\x1f\x8b"
+        self.fp = gzip.open(filepath, 'rb') if self.compressed else open(filepath, 'rb')
+
+    @staticmethod
+    def _parse(line):
+        line = line.strip()
+        if line.startswith(b"["):
+            line = line[1:].lstrip()
+        if line.endswith(b"]"):
+            line = line[:-1].rstrip()
+        if line.endswith(b","):
+            line = line[:-1]
+        if not line:
+            return None
+        return codec.loads(line)
+
+    def __iter__(self):
+        self.fp.seek(0)
+        while True:
+            offset = self.fp.tell()
+            line = self.fp.readline()
+            if not line:
+                return
+            try:
+                resource = self._parse(line)
+            except ValueError:
+                raise ValueError(f"{self.filepath}: not one resource per line at offset {offset}")
+            if resource is not None:
+                yield offset, resource
+
+    def read_at(self, offset):
+        self.fp.seek(offset)
+        return self._parse(self.fp.readline())
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,142 @@
+"""Azure Resource Graph listing engine
+
+Full resources (with properties) of many subscriptions are read with
+Resource Graph queries: pages of up to 1000 rows followed with $skipToken,
+instead of one get_resource_by_id per resource.
+
+Rows are returned in the shape of get_resource_by_id: the Resource Graph
+columns (tenantId, subscriptionId, resourceGroup) and the empty fields are
+removed, the type is restored from the ID (Resource Graph types are lower case).
+
+The etag and systemData of a resource are not available in Resource Graph.
+
+>>> for resource in iter_resources_graph([subscription_id1, subscription_id2], session=session):
+>>> ...print(resource['id'], resource['properties'])
+
+@see: https://docs.microsoft.com/en-us/rest/api/azure-resourcegraph/resourcegraph/resources/resources
+"""
+import logging
+
+from . import codec, core
+from .model import Resource
+from .query import ResourceQuery
+from .resource_id import parse_resource_id
+from .utils import chunks
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['iter_resources_graph', 'get_graph_query', 'to_resource_dict', 'GRAPH_API_VERSION']
+
+GRAPH_API_VERSION = "2021-03-01"
+
+GRAPH_PATH = "providers/Microsoft.ResourceGraph/resources"
+
+# rows per page (service limit)
+GRAPH_PAGE_SIZE = 1000
+
+# subscriptions per query
+GRAPH_MAX_SUBSCRIPTIONS = 1000
+
+_GRAPH_COLUMNS = ('tenantId', 'subscriptionId', 'resourceGroup')
+
+
+def _kql_string(value):
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def get_graph_query(query=None):
+    """KQL query of the Resources table for a query.ResourceQuery
+
+    >>> get_graph_query(ResourceQuery(types=('Microsoft.Compute/virtualMachines',), resource_group='rg1'))
+    "Resources | where type in~ ('Microsoft.Compute/virtualMachines') | where resourceGroup =~ 'rg1'"
+    """
+    query = query or ResourceQuery()
+    clauses = ["Resources"]
+    if query.types:
+        clauses.append("where type in~ (%s)" % ", ".join(_kql_string(t) for t in query.types))
+    if query.resource_group:
+        clauses.append("where resourceGroup =~ %s" % _kql_string(query.resource_group))
+    if query.tag_name is not None:
+        tag = "tags[%s]" % _kql_string(query.tag_name)
+        if query.tag_value is not None:
+            clauses.append("where %s == %s" % (tag, _kql_string(query.tag_value)))
+        else:
+            clauses.append("where isnotnull(%s)" % tag)
+    if query.top:
+        clauses.append("limit %s" % query.top)
+    return " | ".join(clauses)
+
+
+def to_resource_dict(row):
+    """Resource Graph row to the shape of get_resource_by_id"""
+    data = {k: v for k, v in row.items() if k not in _GRAPH_COLUMNS and v is not None and v != ""}
+    try:
+        data['type'] = parse_resource_id(data['id']).resource_type
+    except (KeyError, ValueError):
+        pass
+    return data
+
+
+def iter_pages(subscription_ids, kql, session, is_china=False, timeout=None, page_size=GRAPH_PAGE_SIZE):
+    """Iterate over the pages (list of rows) of a Resource Graph query"""
+    base_url = core.get_azure_base_url(is_china=is_china)
+    url = f"{base_url}/{GRAPH_PATH}?api-version={GRAPH_API_VERSION}"
+    policy = core.get_retry_policy(session)
+
+    skip_token = None
+    while True:
+        options = {"$top": page_size, "resultFormat": "objectArray"}
+        if skip_token:
+            options["$skipToken"] = skip_token
+        body = {"subscriptions": subscription_ids, "query": kql, "options": options}
+
+        resp = policy.call(session.post, url, json=body, timeout=timeout, name='graph')
+        logger.info("graph quota : x-ms-user-quota-remaining=%s - %s subscriptions" % (
+            resp.headers.get('x-ms-user-quota-remaining'), len(subscription_ids)
+        ))
+        resp.raise_for_status()
+
+        data = codec.response_json(resp)
+        yield data.get('data') or []
+
+        skip_token = data.get('$skipToken')
+        if not skip_token:
+            return
+
+
+def iter_resources_graph(subscription_ids, session=None, token=None, is_china=False, query=None, timeout=None,
+                         includes=core.KNOWN_TYPES, page_size=GRAPH_PAGE_SIZE, compact=False):
+    """Iterate over the full resources of subscriptions with Resource Graph queries
+
+    :param subscription_ids: subscription ID or list of subscription IDs
+    :param query: query.ResourceQuery - translated to KQL (expand is ignored).
+                  query.top is the limit of all the subscriptions
+    :param includes: resource types (lower case) to keep, client side
+    :param page_size: rows per page (max GRAPH_PAGE_SIZE)
+    :param compact: yield model.Resource records instead of dicts
+    """
+    if isinstance(subscription_ids, str):
+        subscription_ids = [subscription_ids]
+    session = session or core.get_session(token=token)
+    kql = get_graph_query(query)
+    top = query.top if query else None
+    count = 0
+
+    if includes is core.KNOWN_TYPES:
+        includes = core.get_providers()
+
+    for chunk in chunks(subscription_ids, GRAPH_MAX_SUBSCRIPTIONS):
+        for page in iter_pages(chunk, kql, session, is_china=is_china, timeout=timeout, page_size=page_size):
+            for row in page:
+                data = to_resource_dict(row)
+                if 'id' not in data:
+                    logger.warning("graph row without id : %s" % row)
+                    continue
+                if includes is not None and data['type'].lower() not in includes:
+                    logger.debug("exclude type : %s" % data['type'].lower())
+                    continue
+                yield Resource.from_dict(data) if compact else data
+                count += 1
+                # top: limit of all the queries, not of each chunk of subscriptions
+                if top and count >= top:
+                    return
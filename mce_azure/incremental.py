@@ -0,0 +1,137 @@
+"""Incremental inventory
+
+The previous inventory is kept in a snapshot file. Resources are listed
+with $expand=changedTime and only new or changed resources are fetched
+by ID. Resources of the snapshot not listed anymore are reported as deleted.
+
+>>> store = SnapshotStore("/var/lib/mce/00000000-0000-0000-0000-000000000000.json")
+>>> changes = incremental_inventory(subscription_id, store, session=session)
+>>> changes.added, changes.changed, changes.deleted
+"""
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field, replace
+from typing import List
+
+from . import core
+from .query import ResourceQuery
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SnapshotStore', 'InventoryChanges', 'incremental_inventory']
+
+
+class SnapshotStore:
+    """Snapshot file: {"<resource id lower>": {"changedTime": "...", "resource": {...}}}"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return {}
+        with open(self.filepath) as fp:
+            return json.load(fp)
+
+    def save(self, entries):
+        """Atomic write: a crash never leaves a truncated snapshot"""
+        tmp_filepath = f"{self.filepath}.tmp"
+        with open(tmp_filepath, 'w') as fp:
+            json.dump(entries, fp, ensure_ascii=False)
+        os.replace(tmp_filepath, self.filepath)
+
+    def resources(self):
+        """Full resources of the snapshot"""
+        return [entry['resource'] for entry in self.load().values()]
+
+
+@dataclass
+class InventoryChanges:
+    added: List[dict] = field(default_factory=list)
+    changed: List[dict] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    errors: List[Exception] = field(default_factory=list)
+
+    def to_dict(self):
+        return {
+            'added': self.added,
+            'changed': self.changed,
+            'deleted': self.deleted,
+        }
+
+
+async def _fetch(session, resource_ids, pool_size, timeout, is_china):
+    from .aio import AsyncFetcher
+
+    async with AsyncFetcher(session, pool_size=pool_size, timeout=timeout, is_china=is_china) as fetcher:
+        return await fetcher.get_resources(resource_ids)
+
+
+def incremental_inventory(subscription_id, store, session=None, token=None, is_china=False,
+                          timeout=None, query=None, pool_size=20):
+    """Update the snapshot store and return the changes since the previous run
+
+    A resource which can't be fetched keeps its previous snapshot entry
+    (without changedTime update), so it's fetched again on the next run.
+
+    :param store: SnapshotStore
+    :param query: query.ResourceQuery for the listing (changedTime is always expanded)
+
+    :rtype: InventoryChanges
+    """
+    session = session or core.get_session(token=token)
+    query = query or ResourceQuery()
+    if 'changedTime' not in query.expand:
+        query = replace(query, expand=query.expand + ('changedTime',))
+
+    previous = store.load()
+    current = {}
+    to_fetch = {}
+    changes = InventoryChanges()
+
+    for item in core.get_resources_list(
+        subscription_id, session=session, is_china=is_china, timeout=timeout, query=query
+    ):
+        key = item['id'].lower()
+        entry = previous.get(key)
+        changed_time = item.get('changedTime')
+        if entry and changed_time and entry.get('changedTime') == changed_time:
+            current[key] = entry
+            changes.unchanged += 1
+        else:
+            to_fetch[key] = (item['id'], changed_time)
+
+    if to_fetch:
+        resources, changes.errors = asyncio.run(
+            _fetch(session, [v[0] for v in to_fetch.values()], pool_size, timeout, is_china)
+        )
+        for resource in resources:
+            key = resource['id'].lower()
+            current[key] = {'changedTime': to_fetch.get(key, (None, None))[1], 'resource': resource}
+            if key in previous:
+                changes.changed.append(resource)
+            else:
+                changes.added.append(resource)
+
+        # keep the previous version without changedTime: fetched again next time
+        for key in to_fetch:
+            if key not in current and key in previous:
+                current[key] = dict(previous[key], changedTime=None)
+
+    changes.deleted = [
+        entry['resource']['id'] for key, entry in previous.items() if key not in current
+    ]
+
+    store.save(current)
+
+    logger.info(
+        "incremental inventory %s : added=%s changed=%s deleted=%s unchanged=%s errors=%s" % (
+            subscription_id, len(changes.added), len(changes.changed), len(changes.deleted),
+            changes.unchanged, len(changes.errors)
+        )
+    )
+
+    return changes
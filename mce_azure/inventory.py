@@ -0,0 +1,165 @@
+"""In-memory inventory with secondary indexes
+
+Resources (dicts of the ARM api or model.Resource) are indexed by type,
+location, resource group, subscription and tag: a query intersects the sets
+of IDs of its criteria (smallest first) instead of scanning all the resources.
+
+Type, location, resource group, subscription and tag names are case
+insensitive (as in ARM), tag values are not.
+
+>>> inventory = Inventory(core.get_resources_list(subscription_id, session=session, compact=True))
+>>> inventory.find(type='Microsoft.Compute/virtualMachines', location='westeurope', tags={'env': 'prod'})
+[<Resource Microsoft.Compute/virtualMachines /subscriptions/.../virtualMachines/vm1>]
+>>> inventory.count(type=['Microsoft.Network/virtualNetworks', 'Microsoft.Network/publicIPAddresses'])
+12
+>>> inventory.counts('location')
+{'westeurope': 120, 'northeurope': 30}
+"""
+from collections import defaultdict
+
+from .resource_id import parse_resource_id
+
+__all__ = ['Inventory', 'INDEXES']
+
+INDEXES = ('type', 'location', 'resource_group', 'subscription_id')
+
+_EMPTY = frozenset()
+
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _values(value):
+    """Accepted values of a criteria (str or iterable)"""
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+def _get_keys(resource):
+    """Index keys of a resource: {index: key}, [(tag_name, tag_value)]"""
+    resource_id = parse_resource_id(resource['id'])
+    keys = {
+        'type': _lower(resource.get('type')),
+        'location': _lower(resource.get('location')),
+        'resource_group': _lower(resource_id.resource_group),
+        'subscription_id': _lower(resource_id.subscription_id),
+    }
+    tags = [(_lower(k), v) for k, v in (resource.get('tags') or {}).items()]
+    return keys, tags
+
+
+class Inventory:
+    """
+    :param resources: iterable of resources (dict or model.Resource)
+    """
+
+    def __init__(self, resources=None):
+        self.resources = {}
+        self.indexes = {name: defaultdict(set) for name in INDEXES}
+        self.tag_names = defaultdict(set)
+        self.tag_values = defaultdict(set)
+        if resources is not None:
+            self.update(resources)
+
+    def __len__(self):
+        return len(self.resources)
+
+    def __iter__(self):
+        return iter(self.resources.values())
+
+    def __contains__(self, resource_id):
+        return _lower(resource_id) in self.resources
+
+    def get(self, resource_id, default=None):
+        return self.resources.get(_lower(resource_id), default)
+
+    def add(self, resource):
+        """Add or replace a resource"""
+        key = resource['id'].lower()
+        if key in self.resources:
+            self.remove(key)
+        self.resources[key] = resource
+
+        keys, tags = _get_keys(resource)
+        for name, value in keys.items():
+            if value is not None:
+                self.indexes[name][value].add(key)
+        for tag in tags:
+            self.tag_names[tag[0]].add(key)
+            self.tag_values[tag].add(key)
+
+    def update(self, resources):
+        for resource in resources:
+            self.add(resource)
+
+    def remove(self, resource_id):
+        """Remove a resource, return it (None if not found)"""
+        key = resource_id.lower()
+        resource = self.resources.pop(key, None)
+        if resource is None:
+            return None
+
+        keys, tags = _get_keys(resource)
+        for name, value in keys.items():
+            if value is not None:
+                self._discard(self.indexes[name], value, key)
+        for tag in tags:
+            self._discard(self.tag_names, tag[0], key)
+            self._discard(self.tag_values, tag, key)
+        return resource
+
+    @staticmethod
+    def _discard(index, value, key):
+        ids = index.get(value)
+        if ids is not None:
+            ids.discard(key)
+            if not ids:
+                del index[value]
+
+    def _select(self, index, values):
+        """IDs matching one of the values"""
+        sets = [index.get(value, _EMPTY) for value in values]
+        if len(sets) == 1:
+            return sets[0]
+        return set().union(*sets)
+
+    def select(self, type=None, location=None, resource_group=None, subscription_id=None, tags=None):
+        """Set of the (lower case) IDs matching all the criteria
+
+        :param type, location, resource_group, subscription_id: value or list of values (or)
+        :param tags: {name: value} - a None value match all the values of the tag
+        """
+        criteria = []
+        for name, value in zip(INDEXES, (type, location, resource_group, subscription_id)):
+            if value is not None:
+                criteria.append(self._select(self.indexes[name], [_lower(v) for v in _values(value)]))
+        for tag_name, tag_value in (tags or {}).items():
+            if tag_value is None:
+                criteria.append(self.tag_names.get(_lower(tag_name), _EMPTY))
+            else:
+                criteria.append(self.tag_values.get((_lower(tag_name), tag_value), _EMPTY))
+
+        if not criteria:
+            return set(self.resources)
+
+        criteria.sort(key=len)
+        if not criteria[0]:
+            return set()
+        if len(criteria) == 1:
+            return set(criteria[0])
+        return criteria[0].intersection(*criteria[1:])
+
+    def find(self, **criteria):
+        """Resources matching all the criteria (see select)"""
+        return [self.resources[key] for key in self.select(**criteria)]
+
+    def count(self, **criteria):
+        return len(self.select(**criteria))
+
+    def counts(self, index):
+        """Resources by value of an index (type, location, resource_group, subscription_id or tags)"""
+        if index == 'tags':
+            return {name: len(ids) for name, ids in self.tag_names.items()}
+        return {value: len(ids) for value, ids in self.indexes[index].items()}
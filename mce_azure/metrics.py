@@ -0,0 +1,279 @@
+"""Instrumentation of the ARM calls
+
+Metrics observes all responses of a session (requests response hook):
+latency histograms per endpoint and per resource type, bytes received
+and status codes. Retries, throttle waits and queue depths are events
+emitted by the other modules to the registered listeners.
+
+>>> metrics = Metrics()
+>>> metrics.install(session)
+>>> resources, errors = core.async_get_resources(subscription_id, session)
+>>> metrics.close()
+>>> json.dumps(metrics.summary())
+>>> metrics.to_prometheus()
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from .resource_id import parse_resource_id
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Histogram', 'Metrics', 'add_listener', 'remove_listener', 'emit', 'get_endpoint']
+
+# seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_LISTENERS = []
+
+_LIST_ENDPOINTS = {
+    'resources': 'resources.list',
+    'resourcegroups': 'resourcegroups.list',
+    'locations': 'locations.list',
+}
+
+
+def add_listener(listener):
+    """listener(event, value, labels) is called with each emitted event"""
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _LISTENERS:
+        _LISTENERS.remove(listener)
+
+
+def emit(event, value=1.0, **labels):
+    """Send an event to the listeners. events: retry, throttle_wait, queue_depth"""
+    for listener in _LISTENERS:
+        try:
+            listener(event, value, labels)
+        except Exception as err:
+            logger.error("metrics listener error : %s" % err)
+
+
+def get_endpoint(url):
+    """(endpoint, resource type) of an ARM url
+
+    >>> get_endpoint("https://management.azure.com/subscriptions/xxx/resources?api-version=2019-10-01")
+    ('resources.list', None)
+    """
+    segments = urlsplit(url).path.strip('/').split('/')
+    last = segments[-1].lower()
+
+    if last == 'batch':
+        return 'batch', None
+    if [s.lower() for s in segments] == ['providers', 'microsoft.resourcegraph', 'resources']:
+        return 'graph', None
+    if len(segments) == 1 and last in ('subscriptions', 'tenants'):
+        return f"{last}.list", None
+    if segments[0].lower() == 'subscriptions' and len(segments) in (3, 5) and last in _LIST_ENDPOINTS:
+        return _LIST_ENDPOINTS[last], None
+
+    try:
+        return 'resources.get', parse_resource_id('/'.join(segments)).resource_type
+    except ValueError:
+        return 'other', None
+
+
+class Histogram:
+    """Cumulative histogram (Prometheus buckets)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket of the q quantile (None above the last bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return None
+
+    def merge(self, data):
+        for i, count in enumerate(data['counts']):
+            self.counts[i] += count
+        self.sum += data['sum']
+        self.count += data['count']
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+        }
+
+
+def _new_endpoint():
+    return {'latency': Histogram(), 'bytes': 0, 'status': defaultdict(int)}
+
+
+class Metrics:
+    """Thread safe collector of the requests of the installed sessions"""
+
+    def __init__(self):
+        self.endpoints = defaultdict(_new_endpoint)
+        self.types = defaultdict(Histogram)
+        self.retries = defaultdict(int)
+        self.retry_wait = 0.0
+        self.throttle_wait = 0.0
+        self.queue_depth = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, url, status_code, latency, size):
+        endpoint, resource_type = get_endpoint(url)
+        with self._lock:
+            data = self.endpoints[endpoint]
+            data['latency'].observe(latency)
+            data['bytes'] += size
+            data['status'][str(status_code)] += 1
+            if resource_type:
+                self.types[resource_type].observe(latency)
+
+    def response_hook(self, resp, *args, **kwargs):
+        # elapsed: until the headers. the body is downloaded here
+        start = time.perf_counter()
+        size = len(resp.content or b"")
+        latency = resp.elapsed.total_seconds() + time.perf_counter() - start
+        self.observe(resp.url, resp.status_code, latency, size)
+
+    def on_event(self, event, value, labels):
+        with self._lock:
+            if event == 'retry':
+                self.retries[labels.get('name') or 'call'] += 1
+                self.retry_wait += value
+                if labels.get('status_code') == 429:
+                    self.throttle_wait += value
+            elif event == 'throttle_wait':
+                self.throttle_wait += value
+            elif event == 'queue_depth':
+                name = labels.get('queue', 'fetch')
+                depth = self.queue_depth.setdefault(name, {'last': 0, 'max': 0})
+                depth['last'] = value
+                depth['max'] = max(depth['max'], value)
+
+    def install(self, session):
+        """Observe all responses of a requests Session and the emitted events"""
+        if self.response_hook not in session.hooks['response']:
+            session.hooks['response'].append(self.response_hook)
+        add_listener(self.on_event)
+        return session
+
+    def close(self):
+        remove_listener(self.on_event)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'duration': round(time.time() - self.started, 3),
+                'requests': sum(data['latency'].count for data in self.endpoints.values()),
+                'endpoints': {
+                    name: {
+                        'latency': data['latency'].to_dict(),
+                        'bytes': data['bytes'],
+                        'status': dict(data['status']),
+                    } for name, data in self.endpoints.items()
+                },
+                'types': {name: histogram.to_dict() for name, histogram in self.types.items()},
+                'retries': dict(self.retries),
+                'retry_wait': round(self.retry_wait, 3),
+                'throttle_wait': round(self.throttle_wait, 3),
+                'queue_depth': {name: dict(depth) for name, depth in self.queue_depth.items()},
+            }
+
+    def merge(self, summary):
+        """Add a summary of another collector (ex: crawl worker process)"""
+        with self._lock:
+            for name, values in summary['endpoints'].items():
+                data = self.endpoints[name]
+                data['latency'].merge(values['latency'])
+                data['bytes'] += values['bytes']
+                for status, count in values['status'].items():
+                    data['status'][status] += count
+            for name, values in summary['types'].items():
+                self.types[name].merge(values)
+            for name, count in summary['retries'].items():
+                self.retries[name] += count
+            self.retry_wait += summary['retry_wait']
+            self.throttle_wait += summary['throttle_wait']
+            for name, values in summary['queue_depth'].items():
+                depth = self.queue_depth.setdefault(name, {'last': 0, 'max': 0})
+                depth['last'] = values['last']
+                depth['max'] = max(depth['max'], values['max'])
+
+    def to_prometheus(self, prefix="mce_azure"):
+        """Prometheus text exposition format"""
+        summary = self.summary()
+        lines = []
+
+        def histogram(name, help_text, label, items):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for value, data in items:
+                labels = f'{label}="{value}"'
+                total = 0
+                for bound, count in zip(data['buckets'] + ['+Inf'], data['counts']):
+                    total += count
+                    lines.append(f'{prefix}_{name}_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f"{prefix}_{name}_sum{{{labels}}} {data['sum']}")
+                lines.append(f"{prefix}_{name}_count{{{labels}}} {data['count']}")
+
+        def metric(name, metric_type, help_text, values):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for labels, value in values:
+                lines.append(f"{prefix}_{name}{{{labels}}} {value}" if labels else f"{prefix}_{name} {value}")
+
+        endpoints = sorted(summary['endpoints'].items())
+        histogram('request_duration_seconds', 'ARM request latency', 'endpoint',
+                  [(name, data['latency']) for name, data in endpoints])
+        histogram('resource_type_duration_seconds', 'ARM get resource latency by type', 'type',
+                  sorted(summary['types'].items()))
+        metric('responses_total', 'counter', 'ARM responses by status code', [
+            (f'endpoint="{name}",status="{status}"', count)
+            for name, data in endpoints for status, count in sorted(data['status'].items())
+        ])
+        metric('response_bytes_total', 'counter', 'ARM response bytes',
+               [(f'endpoint="{name}"', data['bytes']) for name, data in endpoints])
+        metric('retries_total', 'counter', 'retried ARM calls',
+               [(f'name="{name}"', count) for name, count in sorted(summary['retries'].items())])
+        metric('retry_wait_seconds_total', 'counter', 'time waited before retries',
+               [(None, summary['retry_wait'])])
+        metric('throttle_wait_seconds_total', 'counter', 'time waited for throttling',
+               [(None, summary['throttle_wait'])])
+        metric('queue_depth_max', 'gauge', 'max pending requests or items',
+               [(f'queue="{name}"', depth['max']) for name, depth in sorted(summary['queue_depth'].items())])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, filepath):
+        """JSON summary or Prometheus text (.prom, .txt)"""
+        with open(filepath, 'w') as fp:
+            if filepath.endswith('.prom') or filepath.endswith('.txt'):
+                fp.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), fp, indent=4)
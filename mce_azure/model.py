@@ -0,0 +1,150 @@
+"""Compact resource record
+
+Resource keeps the fields of an ARM resource used to index and query an
+inventory in slots, with interned strings (type, location, kind, tag keys
+and values are shared by all the resources), tags as a tuple and the
+other fields (properties, sku, identity...) as a compact json blob
+decoded on access.
+
+Read access is compatible with the ARM dict: resource['id'],
+resource.get('properties'), 'tags' in resource.
+
+>>> resources = list(core.get_resources_list(subscription_id, session=session, compact=True))
+>>> resources[0].type, resources[0].resource_group, resources[0].tags
+('Microsoft.Compute/virtualMachines', 'MY_RG', {'env': 'prod'})
+>>> resources[0].to_dict()
+"""
+from sys import intern
+
+from . import codec
+from .resource_id import parse_resource_id
+
+__all__ = ['Resource', 'to_resource']
+
+_FIELDS = ('id', 'name', 'type', 'location', 'kind', 'tags')
+
+
+def _intern(value):
+    return intern(value) if isinstance(value, str) else value
+
+
+class Resource:
+
+    __slots__ = ('id', 'name', 'type', 'location', 'kind', '_tags', '_raw')
+
+    def __init__(self, id, name=None, type=None, location=None, kind=None, tags=None, raw=None):
+        self.id = id
+        self.name = name
+        self.type = _intern(type)
+        self.location = _intern(location)
+        self.kind = _intern(kind)
+        self._tags = None if tags is None else tuple(
+            (_intern(k), _intern(v)) for k, v in tags.items()
+        )
+        # exact size copy: the buffers of orjson are over-allocated
+        self._raw = memoryview(codec.dumps(raw)).tobytes() if raw else None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Record of an ARM resource (dict from the api)"""
+        raw = {k: v for k, v in data.items() if k not in _FIELDS}
+        return cls(
+            data['id'], name=data.get('name'), type=data.get('type'), location=data.get('location'),
+            kind=data.get('kind'), tags=data.get('tags'), raw=raw
+        )
+
+    @property
+    def tags(self):
+        return None if self._tags is None else dict(self._tags)
+
+    @property
+    def raw(self):
+        """Fields other than id, name, type, location, kind and tags (decoded on each access)"""
+        return codec.loads(self._raw) if self._raw else {}
+
+    @property
+    def properties(self):
+        return self.raw.get('properties')
+
+    @property
+    def resource_id(self):
+        """resource_id.ResourceId (parsed IDs are memoized)"""
+        return parse_resource_id(self.id)
+
+    @property
+    def subscription_id(self):
+        return self.resource_id.subscription_id
+
+    @property
+    def resource_group(self):
+        return self.resource_id.resource_group
+
+    def get_tag(self, key, default=None):
+        for k, v in self._tags or ():
+            if k == key:
+                return v
+        return default
+
+    def to_dict(self):
+        data = {'id': self.id}
+        for field in ('name', 'type', 'location', 'kind'):
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        if self._tags is not None:
+            data['tags'] = self.tags
+        data.update(self.raw)
+        return data
+
+    # read only dict interface
+
+    def __getitem__(self, key):
+        if key == 'tags':
+            if self._tags is None:
+                raise KeyError(key)
+            return self.tags
+        if key in _FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.raw[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if key in _FIELDS:
+            return self.get(key) is not None
+        return key in self.raw
+
+    def __eq__(self, other):
+        if isinstance(other, Resource):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<Resource {self.type} {self.id}>"
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+        for slot in ('type', 'location', 'kind'):
+            setattr(self, slot, _intern(getattr(self, slot)))
+        if self._tags is not None:
+            self._tags = tuple((_intern(k), _intern(v)) for k, v in self._tags)
+
+
+def to_resource(data):
+    """Resource of a dict, unchanged for a Resource"""
+    return data if isinstance(data, Resource) else Resource.from_dict(data)
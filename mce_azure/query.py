@@ -0,0 +1,92 @@
+"""Server-side filters for get_resources_list
+
+ARM only accepts some combinations in $filter:
+
+- resourceType eq 'A' or resourceType eq 'B'
+- tagName eq 'name' and tagValue eq 'value' (can't be combined with another filter)
+
+The resource group is pushed down with the resourceGroups/{name}/resources
+endpoint. What the server can't filter is done client side by match().
+
+@see: https://docs.microsoft.com/en-us/rest/api/resources/resources/list
+"""
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+from urllib.parse import urlencode, quote
+
+__all__ = ['ResourceQuery', 'EXPAND_FIELDS']
+
+EXPAND_FIELDS = ('createdTime', 'changedTime', 'provisioningState')
+
+
+def _quote(value):
+    return value.replace("'", "''")
+
+
+@dataclass(frozen=True)
+class ResourceQuery:
+    """
+    >>> query = ResourceQuery(types=('Microsoft.Compute/virtualMachines',), expand=('changedTime',))
+    >>> get_resources_list(subscription_id, session=session, query=query)
+    """
+
+    types: Tuple[str, ...] = ()
+    resource_group: Optional[str] = None
+    tag_name: Optional[str] = None
+    tag_value: Optional[str] = None
+    top: Optional[int] = None
+    expand: Tuple[str, ...] = field(default=())
+
+    def __post_init__(self):
+        # accept lists / sets
+        object.__setattr__(self, 'types', tuple(self.types or ()))
+        object.__setattr__(self, 'expand', tuple(self.expand or ()))
+        for name in self.expand:
+            if name not in EXPAND_FIELDS:
+                raise ValueError(f"invalid expand field [{name}]. choices: {', '.join(EXPAND_FIELDS)}")
+        if self.tag_value is not None and self.tag_name is None:
+            raise ValueError("tag_value require tag_name")
+
+    @property
+    def lower_types(self):
+        return {t.lower() for t in self.types}
+
+    def get_filter(self):
+        """$filter value or None"""
+        if self.tag_name is not None:
+            value = f"tagName eq '{_quote(self.tag_name)}'"
+            if self.tag_value is not None:
+                value += f" and tagValue eq '{_quote(self.tag_value)}'"
+            return value
+        if self.types:
+            return " or ".join(f"resourceType eq '{_quote(t)}'" for t in self.types)
+        return None
+
+    def get_params(self):
+        params = {}
+        _filter = self.get_filter()
+        if _filter:
+            params['$filter'] = _filter
+        if self.top:
+            params['$top'] = self.top
+        if self.expand:
+            params['$expand'] = ",".join(self.expand)
+        return params
+
+    def get_path(self, subscription_id):
+        if self.resource_group:
+            return f"subscriptions/{subscription_id}/resourceGroups/{self.resource_group}/resources"
+        return f"subscriptions/{subscription_id}/resources"
+
+    def get_querystring(self):
+        """urlencoded params ('&' prefixed) to add after api-version"""
+        params = self.get_params()
+        if not params:
+            return ""
+        return "&" + urlencode(params, quote_via=quote, safe="$,'/")
+
+    def match(self, item):
+        """Client-side filtering for what has not been sent to the server"""
+        if self.tag_name is not None and self.types:
+            return item['type'].lower() in self.lower_types
+        return True
@@ -0,0 +1,117 @@
+"""Adaptive concurrency from ARM throttling headers
+
+ARM returns the remaining quota in x-ms-ratelimit-remaining-* headers and
+a Retry-After header with 429 responses. The controller reads them from
+every response of a session (requests response hook) and computes the
+number of requests the fetch pool may keep in flight.
+
+@see: https://docs.microsoft.com/en-us/azure/azure-resource-manager/management/request-limits-and-throttling
+
+>>> controller = ConcurrencyController(min_width=2, max_width=50)
+>>> controller.install(session)
+>>> resources, errors = core.async_get_resources(subscription_id, session, controller=controller)
+>>> controller.stats()
+{'width': 34, 'remaining': 11234, 'throttle_events': 0, 'wait_time': 0.0}
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ConcurrencyController', 'get_remaining_quota', 'get_retry_after']
+
+DEFAULT_RETRY_AFTER = 5
+
+
+def get_remaining_quota(headers):
+    """Lowest value of all x-ms-ratelimit-remaining-* headers or None"""
+    values = []
+    for k, v in headers.items():
+        if k.lower().startswith("x-ms-ratelimit-remaining"):
+            try:
+                values.append(int(v))
+            except ValueError:
+                continue
+    return min(values) if values else None
+
+
+def get_retry_after(headers, default=None):
+    """Retry-After header value in seconds (only the delay-seconds form)"""
+    value = headers.get('Retry-After')
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return default
+
+
+class ConcurrencyController:
+    """Widen concurrency while quota is plentiful, narrow it as quota runs out
+
+    - remaining quota >= high_watermark: width + 1
+    - remaining quota <= low_watermark: width / 2
+    - 429: width / 2 and no new request until Retry-After is elapsed
+
+    Thread safe: responses are observed from the worker threads.
+    """
+
+    def __init__(self, min_width=1, max_width=50, initial_width=None,
+                 low_watermark=200, high_watermark=1000):
+        self.min_width = min_width
+        self.max_width = max_width
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.width = initial_width or min(max_width, max(min_width, 10))
+        self.remaining = None
+        self.throttle_events = 0
+        self.wait_time = 0.0
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, headers, status_code=None):
+        remaining = get_remaining_quota(headers)
+
+        with self._lock:
+            if status_code == 429:
+                retry_after = get_retry_after(headers, default=DEFAULT_RETRY_AFTER)
+                self.throttle_events += 1
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                self.width = max(self.min_width, self.width // 2)
+                logger.warning(
+                    "throttled - retry after %ss - width=%s" % (retry_after, self.width)
+                )
+            elif remaining is not None:
+                if remaining <= self.low_watermark:
+                    self.width = max(self.min_width, self.width // 2)
+                elif remaining >= self.high_watermark:
+                    self.width = min(self.max_width, self.width + 1)
+
+            if remaining is not None:
+                self.remaining = remaining
+
+    def response_hook(self, resp, *args, **kwargs):
+        self.observe(resp.headers, resp.status_code)
+
+    def install(self, session):
+        """Observe all responses of a requests Session"""
+        if self.response_hook not in session.hooks['response']:
+            session.hooks['response'].append(self.response_hook)
+        return session
+
+    def delay(self):
+        """Seconds to wait before sending a new request"""
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def add_wait_time(self, seconds):
+        with self._lock:
+            self.wait_time += seconds
+
+    def stats(self):
+        return {
+            'width': self.width,
+            'remaining': self.remaining,
+            'throttle_events': self.throttle_events,
+            'wait_time': round(self.wait_time, 3),
+        }
@@ -0,0 +1,125 @@
+"""Resource ID parsing and api-version resolution
+
+Resource IDs are parsed into a ResourceId, the last parsed IDs are
+memoized (MCE_AZURE_PARSE_CACHE_SIZE, default 4096) and the
+resource type is matched against a trie of the providers types: the
+api-version of the longest known type prefix is used, so a nested type
+missing from the providers file (ex: Microsoft.Network/virtualNetworks/subnets)
+uses the api-version of its parent.
+
+Supported IDs:
+
+- /subscriptions/{id}
+- /subscriptions/{id}/resourceGroups/{name}
+- [/subscriptions/{id}[/resourceGroups/{name}]]/providers/{namespace}/{type}/{name}[/{type}/{name}]...
+- extension resources: {resource id}/providers/{namespace}/{type}/{name}...
+"""
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from decouple import config
+
+__all__ = ['ResourceId', 'parse_resource_id', 'ProviderTrie']
+
+# the same IDs are parsed several times while a resource is processed,
+# not across a crawl: a small cache is enough
+PARSE_CACHE_SIZE = config('MCE_AZURE_PARSE_CACHE_SIZE', default=4096, cast=int)
+
+_VERSION = object()
+
+
+class ResourceId(NamedTuple):
+    subscription_id: Optional[str]
+    resource_group: Optional[str]
+    namespace: Optional[str]
+    types: Tuple[str, ...]
+    names: Tuple[str, ...]
+    # resource extended by an extension resource
+    scope: Optional[str] = None
+
+    @property
+    def resource_type(self):
+        """ex: Microsoft.Sql/servers/databases"""
+        return "/".join((self.namespace,) + self.types)
+
+    @property
+    def name(self):
+        return self.names[-1] if self.names else None
+
+    @property
+    def parent_type(self):
+        if len(self.types) < 2:
+            return None
+        return "/".join((self.namespace,) + self.types[:-1])
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_resource_id(resource_id):
+    """Parse a resource ID. Raise ValueError for an invalid ID"""
+    segments = resource_id.strip('/').split('/')
+    lower = [s.lower() for s in segments]
+
+    # last providers segment: extension resources have several
+    try:
+        index = len(lower) - 1 - lower[::-1].index('providers')
+    except ValueError:
+        index = None
+
+    scope = None
+    if index is not None:
+        if index > 0 and 'providers' in lower[:index]:
+            scope = "/" + "/".join(segments[:index])
+        prefix, lower_prefix, rest = segments[:index], lower[:index], segments[index + 1:]
+    else:
+        prefix, lower_prefix, rest = segments, lower, []
+
+    subscription_id = resource_group = None
+    if lower_prefix[:1] == ['subscriptions'] and len(prefix) >= 2:
+        subscription_id = prefix[1]
+    if lower_prefix[2:3] == ['resourcegroups'] and len(prefix) >= 4:
+        resource_group = prefix[3]
+
+    if index is None:
+        if resource_group and len(prefix) == 4:
+            return ResourceId(subscription_id, resource_group, 'Microsoft.Resources',
+                              ('subscriptions', 'resourceGroups'), (subscription_id, resource_group))
+        if subscription_id and len(prefix) == 2:
+            return ResourceId(subscription_id, None, 'Microsoft.Resources',
+                              ('subscriptions',), (subscription_id,))
+        raise ValueError(f"invalid resource id [{resource_id}]")
+
+    if len(rest) < 3 or len(rest) % 2 == 0:
+        raise ValueError(f"invalid resource id [{resource_id}]")
+
+    namespace = rest[0]
+    types = tuple(rest[1::2])
+    names = tuple(rest[2::2])
+    return ResourceId(subscription_id, resource_group, namespace, types, names, scope)
+
+
+class ProviderTrie:
+    """Resource types -> api-version, matched by the longest type prefix
+
+    >>> trie = ProviderTrie({"microsoft.sql/servers": "2019-06-01-preview"})
+    >>> trie.get("Microsoft.Sql/servers/databases")
+    '2019-06-01-preview'
+    """
+
+    def __init__(self, providers):
+        self.root = {}
+        for resource_type, api_version in providers.items():
+            node = self.root
+            for segment in resource_type.lower().split('/'):
+                node = node.setdefault(segment, {})
+            node[_VERSION] = api_version
+        self.get = lru_cache(maxsize=4096)(self._get)
+
+    def _get(self, resource_type):
+        api_version = None
+        node = self.root
+        for segment in resource_type.lower().split('/'):
+            node = node.get(segment)
+            if node is None:
+                break
+            api_version = node.get(_VERSION, api_version)
+        return api_version
@@ -0,0 +1,494 @@
+"""Local stand-in for the Azure Resource Manager api
+
+A small threaded HTTP server (stdlib only) serving a fixed set of resources,
+used by tests and benchmarks:
+
+- GET /subscriptions
+- GET /subscriptions/{id}/resources (paginated with nextLink)
+- GET /subscriptions/{id}/resourcegroups
+- GET /subscriptions/{id}/resourceGroups/{name}/resources
+- GET {resource_id} (ETag header, 304 for a matching If-None-Match)
+- GET {resource_id}/{collection} (child resources, ex: subnets)
+- POST /batch
+- POST /providers/Microsoft.ResourceGraph/resources (KQL queries of graph.get_graph_query only)
+
+Latency, throttling (429 with Retry-After) and the ARM read quota
+(x-ms-ratelimit-remaining-subscription-reads, token bucket) can be simulated.
+
+>>> with FakeARMServer(resources) as server:
+>>> ...core.AZURE_BASE_URL = server.base_url
+
+Synthetic tenant in a separate process (benchmarks):
+
+$ python -m mce_azure.testing --synthetic 100000 --subscriptions 2 --latency 0.02
+http://127.0.0.1:41235
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['FakeARMServer', 'synthetic_resources']
+
+_KQL_STRING = re.compile(r"'((?:[^'\\]|\\.)*)'")
+
+SYNTHETIC_TYPES = (
+    ("Microsoft.Compute/virtualMachines", "vm"),
+    ("Microsoft.Compute/disks", "disk"),
+    ("Microsoft.Network/networkInterfaces", "nic"),
+    ("Microsoft.Network/virtualNetworks", "vnet"),
+    ("Microsoft.Network/networkSecurityGroups", "nsg"),
+    ("Microsoft.Network/publicIPAddresses", "pip"),
+    ("Microsoft.Storage/storageAccounts", "sa"),
+    ("Microsoft.KeyVault/vaults", "kv"),
+    ("Microsoft.Web/sites", "app"),
+    ("Microsoft.Sql/servers", "sql"),
+    ("Microsoft.Sql/servers/databases", "db"),
+)
+
+SYNTHETIC_LOCATIONS = ("westeurope", "northeurope", "francecentral", "eastus", "westus2")
+
+
+def synthetic_resources(count, subscription_id="00000000-0000-0000-0000-000000000000", groups=None,
+                        seed=0):
+    """Generate count resources of a subscription (deterministic for a seed)
+
+    :param groups: number of resource groups. Default: one group per 50 resources
+    """
+    rnd = random.Random(seed)
+    groups = groups or max(1, count // 50)
+    for i in range(count):
+        resource_type, prefix = SYNTHETIC_TYPES[i % len(SYNTHETIC_TYPES)]
+        namespace, _, types = resource_type.partition('/')
+        group = f"rg-{i % groups:05d}"
+        if types == "servers/databases":
+            path, name = f"servers/sql-{i:07d}/databases/{prefix}-{i:07d}", f"sql-{i:07d}/{prefix}-{i:07d}"
+        else:
+            path, name = f"{types}/{prefix}-{i:07d}", f"{prefix}-{i:07d}"
+        location = SYNTHETIC_LOCATIONS[i % len(SYNTHETIC_LOCATIONS)]
+        yield {
+            "id": f"/subscriptions/{subscription_id}/resourceGroups/{group}/providers/{namespace}/{path}",
+            "name": name,
+            "type": resource_type,
+            "location": location,
+            "tags": {"env": rnd.choice(("prod", "dev", "test")), "owner": f"team-{i % 7}"},
+            "properties": {
+                "provisioningState": "Succeeded",
+                "createdTime": "2020-%02d-%02dT10:00:00Z" % (i % 12 + 1, i % 28 + 1),
+            },
+        }
+
+
+def get_etag(resource):
+    """Weak ETag of the content of a resource"""
+    digest = hashlib.sha1(json.dumps(resource, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:16]}"'
+
+
+def _error(status, code, message, headers=None):
+    return status, headers or {}, {"error": {"code": code, "message": message}}
+
+
+class FakeARMServer:
+
+    def __init__(self, resources=(), page_size=100, host="127.0.0.1", port=0, subscriptions=None,
+                 latency=0.0, throttle_every=None, retry_after=1, ratelimit=None, ratelimit_refill=None):
+        """
+        :param subscriptions: subscriptions list. Default: from resources, all enabled
+        :param latency: seconds added to each response
+        :param throttle_every: each throttle_every request is rejected with a 429
+        :param retry_after: Retry-After header of the 429 responses
+        :param ratelimit: read quota: x-ms-ratelimit-remaining-subscription-reads header
+                          and 429 when empty
+        :param ratelimit_refill: quota refilled per second. Default: no refill
+        """
+        self.subscriptions = subscriptions
+        self.resources = {}
+        # child resources not returned by the resources list (ex: subnets)
+        self.unlisted = set()
+        self._selections = {}
+        for resource in resources:
+            self.add(resource)
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.ratelimit = ratelimit
+        self.ratelimit_refill = ratelimit_refill
+        self.quota = ratelimit
+        self.throttled = 0
+        self.not_modified = 0
+        self.requests = []
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add(self, resource, listed=True):
+        """
+        :param listed: returned by the resources list. Child resources are always
+                       returned by the collection of their parent
+        """
+        key = resource['id'].lower()
+        self.resources[key] = resource
+        if listed:
+            self.unlisted.discard(key)
+        else:
+            self.unlisted.add(key)
+        self._selections.clear()
+
+    def _cached(self, key, func):
+        """Listings are computed once for all their pages (resources removed: computed again)"""
+        if self._selections.get('_size') != len(self.resources):
+            self._selections = {'_size': len(self.resources)}
+        if key not in self._selections:
+            self._selections[key] = func()
+        return self._selections[key]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, method=None):
+        """Number of requests received"""
+        return len([r for r in self.requests if method is None or r[0] == method])
+
+    # --- routing
+
+    def handle(self, method, url, body=None, request_headers=None):
+        """Return (status, headers, payload) for a request. payload is None for a 304"""
+        with self._lock:
+            self.requests.append((method, url))
+            throttled, headers = self._throttle()
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return _error(429, "TooManyRequests", "too many requests", headers)
+        status, route_headers, payload = self._route(method, url, body, request_headers)
+        return status, dict(route_headers, **headers), payload
+
+    def _throttle(self):
+        """(throttled, headers) of the current request. Called with the lock"""
+        if self.throttle_every and len(self.requests) % self.throttle_every == 0:
+            self.throttled += 1
+            return True, {"Retry-After": str(self.retry_after)}
+
+        if self.ratelimit is None:
+            return False, {}
+
+        if self.ratelimit_refill:
+            now = time.monotonic()
+            self.quota = min(self.ratelimit, self.quota + (now - self._refilled_at) * self.ratelimit_refill)
+            self._refilled_at = now
+        if self.quota < 1:
+            self.throttled += 1
+            retry_after = self.retry_after
+            if self.ratelimit_refill:
+                retry_after = max(1, round((1 - self.quota) / self.ratelimit_refill))
+            return True, {"Retry-After": str(retry_after), "x-ms-ratelimit-remaining-subscription-reads": "0"}
+        self.quota -= 1
+        return False, {"x-ms-ratelimit-remaining-subscription-reads": str(int(self.quota))}
+
+    def _route(self, method, url, body=None, request_headers=None):
+        parts = urlsplit(url)
+        path = parts.path.rstrip('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        segments = path.strip('/').split('/')
+        lower = [s.lower() for s in segments]
+
+        if method == "POST" and lower == ["batch"]:
+            return self._batch(body)
+
+        if method == "POST" and lower == ["providers", "microsoft.resourcegraph", "resources"]:
+            return self._graph(body)
+
+        if method != "GET":
+            return _error(405, "MethodNotAllowed", f"{method} {path}")
+
+        if 'api-version' not in query:
+            return _error(400, "MissingApiVersionParameter", "api-version is required")
+
+        if lower == ["subscriptions"]:
+            return self._page(self._subscriptions(), path, query)
+
+        if len(lower) > 1 and lower[0] == "subscriptions" and lower[1] not in {
+            item['subscriptionId'].lower() for item in self._subscriptions()
+        }:
+            return _error(404, "SubscriptionNotFound", f"The subscription '{segments[1]}' could not be found.")
+
+        if len(lower) == 3 and lower[0] == "subscriptions" and lower[2] == "resources":
+            return self._page(self._select(lower[1]), path, query)
+
+        if len(lower) == 5 and lower[0] == "subscriptions" and lower[2] == "resourcegroups" \
+                and lower[4] == "resources":
+            return self._page(self._select(lower[1], lower[3]), path, query)
+
+        if len(lower) == 3 and lower[0] == "subscriptions" and lower[2] == "resourcegroups":
+            return self._page(self._groups(lower[1]), path, query)
+
+        resource = self.resources.get(path.lower())
+        if resource is None:
+            children = self._children(lower)
+            if children is not None:
+                return self._page(children, path, query)
+            return _error(404, "ResourceNotFound", f"The Resource '{path}' was not found.")
+        etag = get_etag(resource)
+        if request_headers is not None and request_headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return 304, {"ETag": etag}, None
+        return 200, {"ETag": etag}, resource
+
+    def _select(self, subscription_id, resource_group=None):
+        prefix = f"/subscriptions/{subscription_id}/"
+        if resource_group:
+            prefix += f"resourcegroups/{resource_group}/"
+        return self._cached(prefix, lambda: [
+            r for k, r in sorted(self.resources.items()) if k.startswith(prefix) and k not in self.unlisted
+        ])
+
+    def _children(self, lower):
+        """Resources of a child collection ({resource id}/{collection}) or None"""
+        if "providers" not in lower:
+            return None
+        index = len(lower) - 1 - lower[::-1].index("providers")
+        # namespace, then type/name pairs: collection if odd
+        types = lower[index + 2:]
+        if len(types) < 3 or len(types) % 2 == 0:
+            return None
+        parent = "/" + "/".join(lower[:index + 4])
+        if parent not in self.resources:
+            return None
+        prefix = "/" + "/".join(lower) + "/"
+        return self._cached(prefix, lambda: [
+            r for k, r in sorted(self.resources.items()) if k.startswith(prefix) and "/" not in k[len(prefix):]
+        ])
+
+    def _subscriptions(self):
+        if self.subscriptions is not None:
+            return self.subscriptions
+        ids = self._cached('subscriptions', lambda: sorted({r['id'].split('/')[2] for r in self.resources.values()}))
+        return [
+            {
+                "id": f"/subscriptions/{subscription_id}",
+                "subscriptionId": subscription_id,
+                "displayName": subscription_id,
+                "state": "Enabled",
+            }
+            for subscription_id in ids
+        ]
+
+    def _groups(self, subscription_id):
+        return self._cached(f"groups:{subscription_id}", lambda: self._list_groups(subscription_id))
+
+    def _list_groups(self, subscription_id):
+        groups = {}
+        for resource in self._select(subscription_id):
+            rg_id = "/".join(resource['id'].split('/')[:5])
+            groups.setdefault(rg_id.lower(), {
+                "id": rg_id,
+                "name": rg_id.split('/')[-1],
+                "location": resource.get('location'),
+                "properties": {"provisioningState": "Succeeded"},
+            })
+        return [groups[k] for k in sorted(groups)]
+
+    def _page(self, items, path, query):
+        start = int(query.get('$skiptoken', 0))
+        end = start + self.page_size
+        payload = {"value": items[start:end]}
+        if end < len(items):
+            payload["nextLink"] = (
+                f"{self.base_url}{path}?api-version={query['api-version']}&$skiptoken={end}"
+            )
+        return 200, {}, payload
+
+    def _batch(self, body):
+        responses = []
+        for request in body.get('requests', []):
+            status, headers, content = self._route(request.get('httpMethod', 'GET'), request['url'])
+            responses.append({
+                "name": request.get('name'),
+                "httpStatusCode": status,
+                "headers": headers,
+                "content": content,
+            })
+        return 200, {}, {"responses": responses}
+
+    def _graph(self, body):
+        """Resource Graph query: subscriptions, KQL filters, $top / $skipToken paging"""
+        subscriptions = {s.lower() for s in body.get('subscriptions') or []}
+        options = body.get('options') or {}
+        try:
+            filters, limit = _parse_kql(body.get('query', ''))
+        except ValueError as err:
+            return _error(400, "InvalidQuery", str(err))
+
+        def select():
+            rows = [
+                _graph_row(r) for k, r in sorted(self.resources.items())
+                if k.split('/')[2] in subscriptions and k not in self.unlisted and all(f(r) for f in filters)
+            ]
+            return rows[:limit] if limit is not None else rows
+
+        rows = self._cached(f"graph:{sorted(subscriptions)}:{body.get('query')}", select)
+        start = int(options.get('$skipToken') or 0)
+        end = start + min(int(options.get('$top') or 100), 1000)
+        payload = {
+            "totalRecords": len(rows),
+            "count": len(rows[start:end]),
+            "data": rows[start:end],
+            "resultTruncated": "false",
+        }
+        if end < len(rows):
+            payload["$skipToken"] = str(end)
+        return 200, {"x-ms-user-quota-remaining": "14"}, payload
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, method):
+                body = None
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = json.loads(self.rfile.read(length))
+                status, headers, payload = server.handle(method, self.path, body, self.headers)
+                data = b"" if payload is None else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def _parse_kql(query):
+    """(filters, limit) of the KQL queries built by graph.get_graph_query"""
+    clauses = [c.strip() for c in query.split(' | ')]
+    if not clauses or clauses[0] != "Resources":
+        raise ValueError(f"unsupported query: {query}")
+    filters = []
+    limit = None
+    for clause in clauses[1:]:
+        values = [re.sub(r"\\(.)", r"\1", v) for v in _KQL_STRING.findall(clause)]
+        if clause.startswith("where type in~ "):
+            types = {v.lower() for v in values}
+            filters.append(lambda r, types=types: r['type'].lower() in types)
+        elif clause.startswith("where resourceGroup =~ "):
+            group = values[0].lower()
+            filters.append(lambda r, group=group: r['id'].split('/')[4].lower() == group)
+        elif clause.startswith("where tags[") and " == " in clause:
+            name, value = values
+            filters.append(lambda r, name=name, value=value: (r.get('tags') or {}).get(name) == value)
+        elif clause.startswith("where isnotnull(tags["):
+            name = values[0]
+            filters.append(lambda r, name=name: name in (r.get('tags') or {}))
+        elif clause.startswith("limit "):
+            limit = int(clause.split()[1])
+        else:
+            raise ValueError(f"unsupported clause: {clause}")
+    return filters, limit
+
+
+def _graph_row(resource):
+    """Resource as a row of the Resources table (lower case type, all columns)"""
+    segments = resource['id'].split('/')
+    row = {
+        "id": resource['id'],
+        "name": resource.get('name'),
+        "type": resource['type'].lower(),
+        "tenantId": "00000000-0000-0000-0000-000000000001",
+        "kind": "",
+        "location": resource.get('location'),
+        "resourceGroup": segments[4].lower() if len(segments) > 4 else "",
+        "subscriptionId": segments[2],
+        "managedBy": "",
+        "sku": None,
+        "plan": None,
+        "properties": None,
+        "tags": None,
+        "identity": None,
+        "zones": None,
+        "extendedLocation": None,
+    }
+    row.update({k: v for k, v in resource.items() if k != 'type'})
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake ARM api with a synthetic tenant')
+    parser.add_argument('--synthetic', type=int, default=1000, help='resources per subscription')
+    parser.add_argument('--subscriptions', type=int, default=1)
+    parser.add_argument('--page-size', dest='page_size', type=int, default=1000)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per response')
+    parser.add_argument('--throttle-every', dest='throttle_every', type=int, default=None)
+    parser.add_argument('--retry-after', dest='retry_after', type=float, default=1)
+    parser.add_argument('--ratelimit', type=int, default=None, help='read quota')
+    parser.add_argument('--ratelimit-refill', dest='ratelimit_refill', type=float, default=None)
+    args = parser.parse_args()
+
+    server = FakeARMServer(
+        page_size=args.page_size, host=args.host, port=args.port, latency=args.latency,
+        throttle_every=args.throttle_every, retry_after=args.retry_after,
+        ratelimit=args.ratelimit, ratelimit_refill=args.ratelimit_refill,
+    )
+    for index in range(args.subscriptions):
+        for resource in synthetic_resources(args.synthetic, subscription_id=f"{index:08d}-0000-0000-0000-000000000000",
+                                            seed=index):
+            server.add(resource)
+
+    # first line: the url, read by the benchmarks
+    print(server.base_url, flush=True)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Record and replay of the ARM traffic
+
+RecordingAdapter is a requests transport adapter writing each exchange to a
+gzip compressed archive (one json line per response, without the request
+headers: no token in the archive). ReplayAdapter serves the responses of an
+archive without network, at full speed or with the recorded latencies,
+so a real tenant can be crawled again offline and reproducibly.
+
+Responses are matched by method, path and query (not the host) and a digest
+of the request body. Requests sent several times (pages, retries) get their
+responses in the recorded order, the last one is served again after.
+
+>>> session = core.get_session(token, transport=RecordingAdapter("crawl.arm.gz"))
+>>> resources, errors = core.async_get_resources(subscription_id, session)
+>>> session.close()
+
+>>> session = core.get_session(transport=ReplayAdapter("crawl.arm.gz", timing=True))
+>>> resources, errors = core.async_get_resources(subscription_id, session)
+"""
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['RecordingAdapter', 'ReplayAdapter', 'get_key', 'read_archive']
+
+ARCHIVE_VERSION = 1
+
+# the content is stored decoded
+_SKIP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'set-cookie'}
+
+
+def get_key(method, url, body=None):
+    """Key of a request: method, path and query, sha1 of the body"""
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    digest = None
+    if body:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()
+    return method.upper(), path, digest
+
+
+def _encode_content(content):
+    try:
+        return {'text': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(content).decode('ascii')}
+
+
+def _decode_content(entry):
+    if 'base64' in entry:
+        return base64.b64decode(entry['base64'])
+    return entry.get('text', '').encode('utf-8')
+
+
+def read_archive(filepath):
+    """Iterate over the recorded exchanges of an archive"""
+    with gzip.open(filepath, 'rt', encoding='utf-8') as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'version' in entry:
+                continue
+            yield entry
+
+
+class RecordingAdapter(HTTPAdapter):
+    """HTTPAdapter writing all responses to an archive
+
+    :param filepath: archive file (gzip, one json line per response)
+    :param kwargs: HTTPAdapter options (pool_connections, pool_maxsize...)
+    """
+
+    def __init__(self, filepath, **kwargs):
+        super().__init__(**kwargs)
+        self.filepath = filepath
+        self.count = 0
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._fp = gzip.open(filepath, 'wt', encoding='utf-8')
+        self._fp.write(json.dumps({'version': ARCHIVE_VERSION, 'created': time.time()}) + "\n")
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        resp = super().send(request, **kwargs)
+        content = resp.content
+        elapsed = time.monotonic() - start
+
+        method, path, digest = get_key(request.method, request.url, request.body)
+        entry = {
+            'method': method,
+            'path': path,
+            'body': digest,
+            'status': resp.status_code,
+            'reason': resp.reason,
+            'headers': {k: v for k, v in resp.headers.items() if k.lower() not in _SKIP_HEADERS},
+            'offset': round(start - self._start, 4),
+            'elapsed': round(elapsed, 4),
+        }
+        entry.update(_encode_content(content))
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self._fp is not None:
+                self._fp.write(line)
+                self.count += 1
+        return resp
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+                logger.info("%s responses recorded in %s" % (self.count, self.filepath))
+        super().close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter serving the responses of an archive
+
+    :param timing: wait the recorded latency of each response
+    :param speed: with timing, divide the latencies by speed
+
+    Requests not found in the archive get a 404 NotRecorded response.
+    """
+
+    def __init__(self, filepath, timing=False, speed=1.0):
+        super().__init__()
+        self.filepath = filepath
+        self.timing = timing
+        self.speed = speed
+        self.responses = defaultdict(deque)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        for entry in read_archive(filepath):
+            self.responses[(entry['method'], entry['path'], entry.get('body'))].append(entry)
+
+    def _next(self, key):
+        with self._lock:
+            entries = self.responses.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # the last response is kept for the next requests
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry = self._next(get_key(request.method, request.url, request.body))
+
+        if entry is None:
+            logger.warning("not recorded : %s %s" % (request.method, request.url))
+            entry = {
+                'status': 404,
+                'reason': 'Not Found',
+                'headers': {'Content-Type': 'application/json; charset=utf-8'},
+                'text': json.dumps({"error": {
+                    "code": "NotRecorded", "message": f"{request.method} {request.url} not in {self.filepath}"
+                }}),
+                'elapsed': 0,
+            }
+
+        if self.timing and entry['elapsed']:
+            time.sleep(entry['elapsed'] / self.speed)
+
+        resp = Response()
+        resp.status_code = entry['status']
+        resp.reason = entry.get('reason')
+        resp.headers = CaseInsensitiveDict(entry.get('headers') or {})
+        resp._content = _decode_content(entry)
+        resp._content_consumed = True
+        resp.raw = BytesIO(resp._content)
+        resp.url = request.url
+        resp.request = request
+        resp.encoding = 'utf-8'
+        resp.elapsed = timedelta(seconds=entry['elapsed'])
+        return resp
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        pass
@@ -1,18 +1,44 @@
 import logging
+import random
+import threading
 import time
+from collections import defaultdict
 
-from azure.mgmt.resource.resources import ResourceManagementClient
-from azure.common.credentials import UserPassCredentials, ServicePrincipalCredentials
+from requests.exceptions import ConnectionError, Timeout, ChunkedEncodingError
+
+from .ratelimit import get_retry_after
+from .metrics import emit
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['get_access_token', 'retry']
+__all__ = ['get_access_token', 'get_credentials', 'retry', 'RetryPolicy', 'chunks']
+
+# throttled, timeout and transient server errors
+RETRY_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+RETRY_ERRORS = (ConnectionError, Timeout, ChunkedEncodingError)
 
 
 class AuthenticationError(Exception):
     pass
 
 
+def get_credentials(user=None, password=None, tenant=None, is_china=False, timeout=None):
+    """Azure SDK credentials: service principal with tenant, user/password without"""
+    # the Azure SDK is slow to import: only when a token is requested
+    from azure.common.credentials import UserPassCredentials, ServicePrincipalCredentials
+
+    try:
+        if not tenant:
+            return UserPassCredentials(user, password, china=is_china)
+        return ServicePrincipalCredentials(
+            client_id=user, secret=password, tenant=tenant, china=is_china, timeout=timeout
+        )
+    except Exception as e:
+        msg = 'Login Azure FAILED with message : %s' % str(e)
+        logger.error(msg)
+        raise AuthenticationError(msg)
+
+
 def get_access_token(
     subscription_id=None,
     user=None,
@@ -21,7 +47,7 @@ def get_access_token(
     is_china=False,
     timeout=None):
     """
-    Open Azure API session using AzureSDK and return Token
+    Return an Azure token. Tokens are cached in the process (see auth.TokenProvider)
 
     :param subscription_id: Azure Subscription ID
     :type subscription_id: str
@@ -38,30 +64,14 @@ def get_access_token(
     :rtype: dict
 
     """
+    from .auth import TokenProvider
 
     for field_name in ['subscription_id', 'user', 'password']:
         if locals().get(field_name, None) is None:
             raise AttributeError("field [%s] is required" % field_name)
 
-    try:
-        if not tenant:
-            credentials = UserPassCredentials(user, password, china=is_china)
-        else:
-            credentials = ServicePrincipalCredentials(
-                client_id=user, secret=password, tenant=tenant, china=is_china, timeout=timeout
-            )
-    except Exception as e:
-        msg = 'Login Azure FAILED with message : %s' % str(e)
-        logger.error(msg)
-        raise AuthenticationError(msg)
-
-    rm = ResourceManagementClient(credentials, subscription_id)
-    if rm.config.generate_client_request_id:
-        return credentials.token
-    else:
-        msg = 'login azure failed'
-        logger.error(msg)
-        raise AuthenticationError(msg)
+    provider = TokenProvider(user, password, tenant=tenant, is_china=is_china, timeout=timeout)
+    return provider.get_token()
 
 
 def retry(tries=3, sleep_time=2):
@@ -95,3 +105,134 @@ def retry(tries=3, sleep_time=2):
         return f
 
     return try_it
+
+
+class RetryPolicy:
+    """Retry of ARM calls: exponential backoff with jitter, Retry-After and a retry budget
+
+    Only network errors and RETRY_STATUSES are retried: other errors (400, 403, 404...)
+    are returned at the first attempt.
+
+    The delay before the attempt n+1 is Retry-After when the response has one,
+    else a random value between 0 and min(max_backoff, backoff * 2 ** n) (full jitter).
+
+    The budget is shared by all the calls using the policy: each retry costs
+    one token and each successful call gives back budget_refill token. When
+    the budget is empty, errors are returned without retry: under throttling,
+    retries can't multiply the load.
+
+    Thread safe: a policy is shared by the workers of a session.
+
+    >>> policy = RetryPolicy(tries=5, backoff=1, budget=50)
+    >>> session = core.get_session(token, retry_policy=policy)
+    >>> ...
+    >>> policy.stats()
+    {'budget': 47.3, 'calls': {'get': {'calls': 120, 'retries': 3, 'failures': 0, 'wait_time': 4.2}}}
+    """
+
+    def __init__(self, tries=4, backoff=0.5, max_backoff=30, max_retry_after=300,
+                 budget=100, budget_refill=0.1, statuses=RETRY_STATUSES):
+        self.tries = tries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.max_budget = budget
+        self.budget = float(budget)
+        self.budget_refill = budget_refill
+        self.statuses = statuses
+        self._stats = defaultdict(lambda: {'calls': 0, 'retries': 0, 'failures': 0, 'wait_time': 0.0})
+        self._lock = threading.Lock()
+
+    def is_retryable(self, error=None, status_code=None):
+        if error is not None:
+            return isinstance(error, RETRY_ERRORS)
+        return status_code in self.statuses
+
+    def get_delay(self, attempt, headers=None):
+        """Seconds to wait after the attempt number attempt (1 for the first call)"""
+        retry_after = get_retry_after(headers or {})
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def should_retry(self, attempt, name=None):
+        """Attempts left and a token in the budget"""
+        if attempt >= self.tries:
+            return False
+        with self._lock:
+            if self.budget < 1:
+                logger.warning("retry budget exhausted - %s not retried" % (name or 'call'))
+                return False
+            self.budget -= 1
+            self._stats[name]['retries'] += 1
+        return True
+
+    def wait(self, attempt, headers=None, name=None, status_code=None):
+        delay = self.get_delay(attempt, headers)
+        with self._lock:
+            self._stats[name]['wait_time'] += delay
+        emit('retry', delay, name=name, status_code=status_code)
+        time.sleep(delay)
+
+    def _done(self, name, success):
+        with self._lock:
+            self._stats[name]['calls'] += 1
+            if success:
+                self.budget = min(self.max_budget, self.budget + self.budget_refill)
+            else:
+                self._stats[name]['failures'] += 1
+
+    def call(self, func, *args, name=None, **kwargs):
+        """Call func (returning a requests Response) until a final response
+
+        The last response is returned even with a retryable status: the caller checks it.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                resp = func(*args, **kwargs)
+            except Exception as err:
+                if not self.is_retryable(error=err) or not self.should_retry(attempt, name):
+                    self._done(name, False)
+                    raise
+                logger.warning("retry %s - error[%s] - attempts[%s/%s]" % (name, err, attempt, self.tries))
+                self.wait(attempt, name=name)
+                continue
+
+            if not self.is_retryable(status_code=resp.status_code):
+                self._done(name, resp.status_code < 400)
+                return resp
+
+            if not self.should_retry(attempt, name):
+                self._done(name, False)
+                return resp
+
+            logger.warning("retry %s - status[%s] - attempts[%s/%s]" % (name, resp.status_code, attempt, self.tries))
+            self.wait(attempt, resp.headers, name=name, status_code=resp.status_code)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget': round(self.budget, 2),
+                'calls': {
+                    name: dict(values, wait_time=round(values['wait_time'], 3))
+                    for name, values in self._stats.items()
+                },
+            }
+
+
+def chunks(iterable, size):
+    """Split an iterable in lists of size items
+
+    >>> list(chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -35,6 +35,9 @@ extras_requires = {
     'gevent': [
         'gevent',
         'gevent-openssl',
+    ],
+    'orjson': [
+        'orjson',
     ]
 }
 
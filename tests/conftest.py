@@ -44,20 +44,21 @@ class MockResponse:
     
     def __init__(self, status_code, content, raise_error=None, reason=None, headers={}):
         self.status_code = status_code
-        self.content = content
+        # encoded body, as requests.Response
+        self.content = json.dumps(content).encode('utf-8')
         self.raise_error = raise_error
         self.reason = reason
         self.headers = headers
 
     def json(self):
-        return self.content
+        return json.loads(self.content)
 
     def raise_for_status(self):
         if self.raise_error:
             raise Exception(self.reason)
 
     def get_reason(self):
-        return self.reason or self.content
+        return self.reason or self.content.decode('utf-8')
          
     text = property(fget=get_reason)
 
@@ -65,3 +66,17 @@ class MockResponse:
 def mock_response_class():
     return MockResponse
 
+
+@pytest.fixture
+def arm_server(json_file):
+    """Local fake ARM api serving resource_list.json and resource-vm.json"""
+    from mce_azure import core
+    from mce_azure.testing import FakeARMServer
+
+    resources = json_file("resource_list.json")["value"] + [json_file("resource-vm.json")]
+    server = FakeARMServer(resources, page_size=2).start()
+    base_url = core.AZURE_BASE_URL
+    core.AZURE_BASE_URL = server.base_url
+    yield server
+    core.AZURE_BASE_URL = base_url
+    server.stop()
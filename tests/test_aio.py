@@ -0,0 +1,85 @@
+import asyncio
+from unittest.mock import patch
+
+from mce_azure import aio, core
+from mce_azure.ratelimit import ConcurrencyController
+from mce_azure.transport import RecordingAdapter
+
+RESOURCE_ID = (
+    "/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/MY_RG_GROUP"
+    "/providers/Microsoft.Compute/virtualMachines/MY_VM_%s"
+)
+
+
+def test_fetcher_get_resources(mock_response_class, json_file):
+
+    data = json_file("resource-vm.json")
+    in_flight = []
+    max_in_flight = []
+
+    def get(url, **kwargs):
+        in_flight.append(url)
+        max_in_flight.append(len(in_flight))
+        try:
+            if url.endswith("MY_VM_3?api-version=2019-12-01"):
+                return mock_response_class(404, {}, raise_error=True, reason="not found")
+            return mock_response_class(200, data)
+        finally:
+            in_flight.remove(url)
+
+    async def main(session):
+        async with aio.AsyncFetcher(session, pool_size=3) as fetcher:
+            return await fetcher.get_resources(RESOURCE_ID % i for i in range(10))
+
+    with patch("requests.Session.get") as func:
+        func.side_effect = get
+        session = core.get_session("test")
+        resources, errors = asyncio.run(main(session))
+
+    assert len(resources) == 9
+    assert len(errors) == 1
+    assert max(max_in_flight) <= 3
+
+
+def test_get_resources(mock_response_class, json_file):
+
+    resource_list = json_file("resource_list.json")
+    resource_vm = json_file("resource-vm.json")
+
+    def get(url, **kwargs):
+        if "/resources?" in url:
+            return mock_response_class(200, resource_list)
+        return mock_response_class(200, resource_vm)
+
+    with patch("requests.Session.get") as func:
+        func.side_effect = get
+        session = core.get_session("test")
+        resources, errors = asyncio.run(
+            aio.get_resources("00000000-0000-0000-0000-000000000000", session)
+        )
+
+    assert resources == [resource_vm, resource_vm]
+    assert errors == []
+
+
+def test_fetcher_pool_size(tmpdir):
+
+    async def main(session, **kwargs):
+        async with aio.AsyncFetcher(session, **kwargs):
+            pass
+
+    session = core.get_session("test")
+    asyncio.run(main(session, pool_size=30))
+    assert session.get_adapter("https://management.azure.com")._pool_maxsize == 30
+
+    # larger pool is kept
+    session = core.get_session("test", pool_size=50)
+    adapter = session.get_adapter("https://management.azure.com")
+    asyncio.run(main(session, controller=ConcurrencyController(max_width=40)))
+    assert session.get_adapter("https://management.azure.com") is adapter
+
+    # transport is kept
+    transport = RecordingAdapter(str(tmpdir.join("archive.ndjson")))
+    session = core.get_session("test", transport=transport)
+    asyncio.run(main(session, pool_size=30))
+    assert session.get_adapter("https://management.azure.com") is transport
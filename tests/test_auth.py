@@ -0,0 +1,113 @@
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+from requests.hooks import dispatch_hook
+
+from mce_azure import auth, core
+
+
+@pytest.fixture(autouse=True)
+def clear_tokens():
+    auth._TOKENS.clear()
+    yield
+    auth._TOKENS.clear()
+
+
+def tokens(expires_in=3600):
+    count = [0]
+
+    def _acquire(self):
+        count[0] += 1
+        return {"access_token": "token-%s" % count[0], "expires_on": str(int(time.time() + expires_in))}
+
+    return _acquire
+
+
+def test_token_cache():
+    with patch.object(auth.TokenProvider, "_acquire", tokens()):
+        p1 = auth.TokenProvider("client", "secret", tenant="tenant")
+        p2 = auth.TokenProvider("client", "secret", tenant="tenant")
+        p3 = auth.TokenProvider("client", "secret", tenant="tenant", is_china=True)
+        assert p1.access_token == "token-1"
+        assert p2.access_token == "token-1"
+        assert p3.access_token == "token-2"
+        assert p1.refresh()["access_token"] == "token-3"
+        assert p2.access_token == "token-3"
+
+
+def test_token_refresh_sessions():
+    with patch.object(auth.TokenProvider, "_acquire", tokens(expires_in=1.2)):
+        provider = auth.TokenProvider("client", "secret", tenant="tenant", refresh_margin=1)
+        session = provider.attach(core.get_session())
+        assert session.headers["authorization"] == "Bearer token-1"
+        provider.start()
+        try:
+            time.sleep(1.5)
+        finally:
+            provider.stop()
+        assert session.headers["authorization"] != "Bearer token-1"
+
+
+def test_token_refresh_on_401(mock_response_class):
+    with patch.object(auth.TokenProvider, "_acquire", tokens()):
+        provider = auth.TokenProvider("client", "secret", tenant="tenant")
+        session = provider.attach(core.get_session())
+
+        resp = mock_response_class(401, {})
+        resp.request = type("Request", (), {"headers": {"authorization": "Bearer token-1"}})()
+        dispatch_hook("response", session.hooks, resp)
+        assert session.headers["authorization"] == "Bearer token-2"
+
+        # request sent with an old token: no refresh
+        dispatch_hook("response", session.hooks, resp)
+        assert session.headers["authorization"] == "Bearer token-2"
+
+
+def test_token_cache_file(tmpdir):
+    cache_file = os.path.join(str(tmpdir), "tokens.json")
+    with patch.object(auth.TokenProvider, "_acquire", tokens()):
+        p1 = auth.TokenProvider("client", "secret", tenant="tenant", cache_file=cache_file)
+        assert p1.access_token == "token-1"
+        assert oct(os.stat(cache_file).st_mode & 0o777) == oct(0o600)
+
+        # other process
+        auth._TOKENS.clear()
+        p2 = auth.TokenProvider("client", "secret", tenant="tenant", cache_file=cache_file)
+        assert p2.access_token == "token-1"
+        assert p2.refresh()["access_token"] == "token-2"
+
+
+def test_token_replay_on_401():
+    from requests.adapters import BaseAdapter
+    from requests.models import Response
+
+    class Adapter(BaseAdapter):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def send(self, request, **kwargs):
+            self.calls.append(request.headers["authorization"])
+            resp = Response()
+            resp.status_code = 200 if request.headers["authorization"] == "Bearer token-2" else 401
+            resp._content = b"{}"
+            resp.request = request
+            resp.connection = self
+            return resp
+
+        def close(self):
+            pass
+
+    with patch.object(auth.TokenProvider, "_acquire", tokens()):
+        provider = auth.TokenProvider("client", "secret", tenant="tenant")
+        session = provider.attach(core.get_session())
+        adapter = Adapter()
+        session.mount("https://", adapter)
+
+        resp = session.get("https://management.azure.com/subscriptions")
+        assert resp.status_code == 200
+        assert [r.status_code for r in resp.history] == [401]
+        assert adapter.calls == ["Bearer token-1", "Bearer token-2"]
+        assert "_stored_at" not in provider.get_token()
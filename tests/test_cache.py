@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import time
+from multiprocessing import get_context
+from unittest.mock import patch
+
+from mce_azure import core
+from mce_azure.cache import ResourceCache
+from mce_azure.testing import get_etag
+
+VM_ID = (
+    "/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/MY_RG_GROUP"
+    "/providers/Microsoft.Compute/virtualMachines/MY_VM"
+)
+
+
+def _writer(filepath, count):
+    cache = ResourceCache(filepath)
+    for i in range(count):
+        cache.set(f"{VM_ID}_{os.getpid()}_{i}", "2019-12-01", {"id": i, "type": "Microsoft.Compute/virtualMachines"})
+
+
+def test_cache_ttl(tmpdir):
+    cache = ResourceCache(
+        os.path.join(str(tmpdir), "cache.db"), default_ttl=60,
+        ttls={"Microsoft.Compute/virtualMachines": 0},
+    )
+    assert cache.get(VM_ID, "2019-12-01") is None
+
+    cache.set(VM_ID, "2019-12-01", {"id": VM_ID, "type": "Microsoft.Compute/virtualMachines"})
+    assert cache.get(VM_ID, "2019-12-01") is None
+
+    cache.set(VM_ID, "2019-12-01", {"id": VM_ID, "type": "Microsoft.Network/virtualNetworks"})
+    assert cache.get(VM_ID.upper(), "2019-12-01") == {"id": VM_ID, "type": "Microsoft.Network/virtualNetworks"}
+    assert cache.get(VM_ID, "2020-01-01") is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "revalidated": 0, "downloaded": 2, "entries": 1}
+
+
+def test_cache_evict(tmpdir):
+    cache = ResourceCache(os.path.join(str(tmpdir), "cache.db"), max_entries=5, evict_every=1000)
+    for i in range(10):
+        cache.set(f"{VM_ID}{i}", "2019-12-01", {"id": i})
+        time.sleep(0.001)
+    assert len(cache) == 10
+    assert cache.evict() == 5
+    assert cache.get(f"{VM_ID}0", "2019-12-01") is None
+    assert cache.get(f"{VM_ID}9", "2019-12-01") == {"id": 9}
+
+
+def test_cache_processes(tmpdir):
+    filepath = os.path.join(str(tmpdir), "cache.db")
+    ResourceCache(filepath)
+    ctx = get_context("spawn")
+    processes = [ctx.Process(target=_writer, args=(filepath, 50)) for _ in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+    assert len(ResourceCache(filepath)) == 150
+
+
+def test_get_resource_by_id_cache(arm_server, tmpdir, json_file):
+    data = json_file("resource-vm.json")
+    cache = ResourceCache(os.path.join(str(tmpdir), "cache.db"))
+    session = core.get_session("test")
+
+    assert core.get_resource_by_id(data["id"], session=session, cache=cache) == data
+    assert core.get_resource_by_id(data["id"], session=session, cache=cache) == data
+    assert arm_server.count() == 1
+
+    results, errors = core.get_resources_by_ids([data["id"]], session=session, cache=cache)
+    assert results == {data["id"]: data}
+    assert arm_server.count() == 1
+
+
+def test_cache_revalidate(arm_server, tmpdir, json_file):
+    data = json_file("resource-vm.json")
+    cache = ResourceCache(os.path.join(str(tmpdir), "cache.db"), default_ttl=0, stale_ttl=60)
+    session = core.get_session("test")
+
+    assert core.get_resource_by_id(data["id"], session=session, cache=cache) == data
+    # expired: revalidated with the ETag
+    assert core.get_resource_by_id(data["id"], session=session, cache=cache) == data
+    assert arm_server.not_modified == 1
+    assert cache.stats()["revalidated"] == 1 and cache.stats()["downloaded"] == 1
+
+    # modified: downloaded again
+    arm_server.resources[data["id"].lower()] = dict(data, tags={"env": "changed"})
+    assert core.get_resource_by_id(data["id"], session=session, cache=cache)["tags"] == {"env": "changed"}
+    assert arm_server.not_modified == 1
+    assert cache.stats()["revalidated"] == 1 and cache.stats()["downloaded"] == 2
+    assert arm_server.count() == 3
+
+    # stale entries are kept by the eviction
+    assert cache.evict() == 0
+    cache.stale_ttl = 0
+    assert cache.evict() == 1
+
+    # evicted between get_stale and the 304: stored again
+    cache.stale_ttl = 60
+    current = core.get_resource_by_id(data["id"], session=session, cache=cache)
+    stale = cache.get_stale(data["id"], core.get_api_version(data["id"]))
+    cache.clear()
+    with patch.object(cache, "get_stale", lambda *args: stale):
+        assert core.get_resource_by_id(data["id"], session=session, cache=cache) == current
+    assert len(cache) == 1
+
+
+def test_cache_not_modified_without_stale(arm_server, tmpdir, json_file):
+    data = json_file("resource-vm.json")
+    session = core.get_session("test")
+    # conditional request without cached resource (ex: session header)
+    session.headers["If-None-Match"] = get_etag(data)
+    cache = ResourceCache(os.path.join(str(tmpdir), "cache.db"))
+    assert cache.get_stale(data["id"], core.get_api_version(data["id"])) is None
+    assert core.get_resource_by_id(data["id"], session=session, cache=cache) == data
+    assert core.get_resource_by_id(data["id"], session=session) == data
+    assert arm_server.not_modified == 2
+
+
+def test_cache_revalidate_async(arm_server, tmpdir):
+    cache = ResourceCache(os.path.join(str(tmpdir), "cache.db"), default_ttl=0, stale_ttl=60)
+    session = core.get_session("test")
+    resources, errors = core.async_get_resources("00000000-0000-0000-0000-000000000000", session, cache=cache)
+    assert len(resources) == 3 and cache.stats()["downloaded"] == 3
+
+    again, errors = core.async_get_resources("00000000-0000-0000-0000-000000000000", session, cache=cache)
+    assert sorted(r["id"] for r in again) == sorted(r["id"] for r in resources)
+    assert cache.stats()["revalidated"] == 3 and cache.stats()["downloaded"] == 3
+
+
+def _create_v1(filepath):
+    """cache file created before the etag column"""
+    conn = sqlite3.connect(filepath)
+    conn.executescript("""
+        CREATE TABLE resources (
+            resource_id TEXT NOT NULL, api_version TEXT NOT NULL, data TEXT NOT NULL,
+            stored_at REAL NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (resource_id, api_version)
+        );
+    """)
+    conn.close()
+
+
+def test_cache_etag_migration_processes(tmpdir):
+    filepath = os.path.join(str(tmpdir), "cache.db")
+    _create_v1(filepath)
+    ctx = get_context("spawn")
+    processes = [ctx.Process(target=_writer, args=(filepath, 1)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+    assert len(ResourceCache(filepath)) == 4
+
+
+def test_cache_etag_migration(tmpdir):
+    filepath = os.path.join(str(tmpdir), "cache.db")
+    _create_v1(filepath)
+
+    cache = ResourceCache(filepath, stale_ttl=60)
+    cache.set(VM_ID, "2019-12-01", {"id": VM_ID}, etag='W/"1"')
+    assert cache.get(VM_ID, "2019-12-01") == {"id": VM_ID}
+    assert cache.get_stale(VM_ID, "2019-12-01") == ({"id": VM_ID}, 'W/"1"')
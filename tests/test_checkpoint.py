@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+import pytest
+
+from mce_azure import core
+from mce_azure.checkpoint import open_checkpoint
+
+
+@pytest.mark.parametrize("filename", ["export.json", "export.ndjson"])
+def test_resume(tmpdir, json_file, filename):
+    filepath = os.path.join(str(tmpdir), filename)
+    resources = json_file("resource_list.json")["value"] + [json_file("resource-vm.json")]
+
+    exporter, checkpoint = open_checkpoint(filepath)
+    checkpoint.write(exporter, resources[0])
+    checkpoint.write(exporter, resources[1])
+    # crash while writing the third resource
+    exporter.fp.seek(exporter.offset)
+    exporter.fp.write(b',\n{"id": "/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/MY_')
+    exporter.fp.flush()
+    checkpoint._fp.write("123\t/subscriptions/partial")
+    checkpoint._fp.flush()
+
+    exporter, checkpoint = open_checkpoint(filepath, resume=True)
+    assert checkpoint.done == {resources[0]["id"].lower(), resources[1]["id"].lower()}
+    for resource in resources:
+        if resource["id"].lower() not in checkpoint.done:
+            checkpoint.write(exporter, resource)
+    exporter.close()
+    assert exporter.count == 3
+
+    with open(filepath) as fp:
+        if filename.endswith(".ndjson"):
+            assert [json.loads(line) for line in fp] == resources
+        else:
+            assert json.load(fp) == resources
+
+    with open(checkpoint.filepath) as fp:
+        assert len(fp.readlines()) == 3
+    checkpoint.remove()
+    assert not os.path.exists(checkpoint.filepath)
+
+
+def test_resume_without_journal(tmpdir, json_file):
+    filepath = os.path.join(str(tmpdir), "export.json")
+    resources = json_file("resource_list.json")["value"]
+
+    exporter, checkpoint = open_checkpoint(filepath, resume=True)
+    assert checkpoint.done == set()
+    checkpoint.write(exporter, resources[0])
+    exporter.close()
+    with open(filepath) as fp:
+        assert json.load(fp) == resources[:1]
+
+    with pytest.raises(ValueError):
+        open_checkpoint(filepath + ".gz")
+    with pytest.raises(ValueError):
+        open_checkpoint(filepath, compress=True)
+
+
+@pytest.mark.parametrize("options", [["--export", "export.ndjson.gz"], ["--export", "export.ndjson", "--gzip"]])
+def test_checkpoint_compressed_option(tmpdir, monkeypatch, options):
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(sys, "argv", ["mce-az", "-C", "list", "--checkpoint"] + options)
+    with pytest.raises(SystemExit) as exc:
+        core.main()
+    assert "--checkpoint" in str(exc.value)
@@ -0,0 +1,116 @@
+import pytest
+
+from mce_azure import core, aio
+from mce_azure.children import (
+    CHILD_COLLECTIONS, get_child_collections, get_children_list, iter_children, register_child_collection
+)
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+GROUP = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/network"
+VNET = f"{GROUP}/providers/Microsoft.Network/virtualNetworks/vnet1"
+SQL = f"{GROUP}/providers/Microsoft.Sql/servers/sql1"
+STORAGE = f"{GROUP}/providers/Microsoft.Storage/storageAccounts/sa1"
+
+
+@pytest.fixture
+def network_server(arm_server):
+    def add(resource_id, resource_type, listed=True):
+        arm_server.add({
+            "id": resource_id, "name": resource_id.split("/")[-1], "type": resource_type, "properties": {}
+        }, listed=listed)
+
+    add(VNET, "Microsoft.Network/virtualNetworks")
+    for i in range(3):
+        add(f"{VNET}/subnets/subnet{i}", "Microsoft.Network/virtualNetworks/subnets", listed=False)
+    add(SQL, "Microsoft.Sql/servers")
+    # listed and child of its server
+    add(f"{SQL}/databases/db1", "Microsoft.Sql/servers/databases")
+    add(STORAGE, "Microsoft.Storage/storageAccounts")
+    add(f"{STORAGE}/blobServices/default/containers/c1", "Microsoft.Storage/storageAccounts/blobServices/containers",
+        listed=False)
+    return arm_server
+
+
+def test_get_child_collections():
+    assert ("blobServices/default/containers", "Microsoft.Storage/storageAccounts/blobServices/containers") in \
+        get_child_collections("Microsoft.Storage/storageAccounts")
+    assert get_child_collections("Microsoft.Unknown/things") == []
+
+    register_child_collection("Microsoft.Network/virtualNetworks/subnets", "ipConfigurations")
+    try:
+        assert get_child_collections("Microsoft.Network/virtualNetworks/subnets") == [
+            ("ipConfigurations", "Microsoft.Network/virtualNetworks/subnets/ipConfigurations")
+        ]
+    finally:
+        del CHILD_COLLECTIONS["microsoft.network/virtualnetworks/subnets"]
+
+
+def test_iter_children(network_server):
+    session = core.get_session("test")
+    assert len(list(get_children_list(VNET, "subnets", session=session))) == 3
+    assert [c["name"] for c in iter_children(STORAGE, session=session)] == ["c1"]
+    assert [c["name"] for c in iter_children(VNET, session=session)] == ["subnet0", "subnet1", "subnet2"]
+
+    # children are not in the resources list
+    listed = {r["id"] for r in core.get_resources_list(SUBSCRIPTION_ID, session=session, includes=None)}
+    assert f"{VNET}/subnets/subnet0" not in listed
+
+    network_server.requests.clear()
+    resources = list(core.iter_resources_expanded(SUBSCRIPTION_ID, session=session, children=True))
+    ids = [r["id"] for r in resources]
+    assert len(ids) == len(set(ids)) == 11
+    assert ids.index(f"{VNET}/subnets/subnet0") == ids.index(VNET) + 1
+    # db1 is listed and returned by its server: not fetched again by ID
+    assert not [url for method, url in network_server.requests if "/databases/db1?" in url]
+
+
+def test_children_resume(network_server):
+    session = core.get_session("test")
+    # exported before the interruption: the vnet and one subnet
+    exclude_ids = {VNET.lower(), f"{VNET}/subnets/subnet0".lower()}
+    expected = {f"{VNET}/subnets/subnet1", f"{VNET}/subnets/subnet2"}
+
+    ids = [r["id"] for r in core.iter_resources_expanded(
+        SUBSCRIPTION_ID, session=session, children=True, exclude_ids=exclude_ids
+    )]
+    assert len(ids) == len(set(ids)) == 9
+    assert expected <= set(ids)
+
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, children=True, exclude_ids=exclude_ids)
+    ids = [r["id"] for r in resources]
+    assert errors == []
+    assert len(ids) == len(set(ids)) == 9
+    assert expected <= set(ids)
+
+
+def test_async_children(network_server):
+    session = core.get_session("test")
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, pool_size=4, children=True)
+    assert errors == []
+    ids = [r["id"].lower() for r in resources]
+    assert len(ids) == len(set(ids)) == 11
+    assert f"{VNET}/subnets/subnet2".lower() in ids
+    assert f"{STORAGE}/blobServices/default/containers/c1".lower() in ids
+    # db1: fetched once, by the listing or by its server
+    assert ids.count(f"{SQL}/databases/db1".lower()) == 1
+
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, batch_size=2, children=True)
+    assert len(resources) == 11 and errors == []
+
+
+def test_children_pipeline(network_server, monkeypatch):
+    """children are listed while the resources are fetched (no level barrier)"""
+    network_server.latency = 0.05
+    session = core.get_session("test")
+    started = []
+    original = aio.get_children_list
+
+    def get_children_list(parent_id, collection, **kwargs):
+        started.append(network_server.count())
+        yield from original(parent_id, collection, **kwargs)
+
+    monkeypatch.setattr(aio, "get_children_list", get_children_list)
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, pool_size=8, children=True)
+    assert len(resources) == 11
+    # the first children are listed before all the resources are fetched
+    assert min(started) < network_server.count() - len(started)
@@ -0,0 +1,63 @@
+import json
+from importlib.util import find_spec
+
+import pytest
+
+from mce_azure import codec
+from mce_azure.export import _default
+from mce_azure.model import Resource
+
+BACKENDS = [
+    'json',
+    pytest.param('orjson', marks=pytest.mark.skipif(not find_spec('orjson'), reason="orjson not installed")),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    previous = codec.get_backend().name
+    yield codec.set_backend(request.param)
+    codec.set_backend(previous)
+
+
+def test_codec_roundtrip(backend, json_file):
+    data = json_file("resource-vm.json")
+    data['tags'] = {'owner': "stéphane"}
+
+    encoded = codec.dumps(data)
+    assert isinstance(encoded, bytes)
+    assert encoded == json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    assert codec.loads(encoded) == data
+    assert codec.loads(encoded.decode('utf-8')) == data
+
+    assert codec.dumps(data, sort_keys=True) == json.dumps(
+        data, ensure_ascii=False, separators=(',', ':'), sort_keys=True
+    ).encode('utf-8')
+    assert codec.loads(codec.dumps(data, indent=2)) == data
+    # stdlib fallback
+    assert codec.dumps(data, indent=4).decode('utf-8') == json.dumps(data, ensure_ascii=False, indent=4)
+
+
+def test_codec_default(backend, json_file):
+    data = json_file("resource-vm.json")
+    resource = Resource.from_dict(data)
+    assert codec.loads(codec.dumps([resource], default=_default)) == [data]
+
+    with pytest.raises(TypeError):
+        codec.dumps({'value': object()})
+
+    big = {'value': 2 ** 70}
+    assert codec.loads(codec.dumps(big)) == big
+
+
+def test_codec_backend(monkeypatch):
+    previous = codec.get_backend().name
+    try:
+        with pytest.raises(ValueError):
+            codec.set_backend('ujson')
+
+        monkeypatch.setenv('MCE_AZURE_JSON', 'json')
+        monkeypatch.setattr(codec, '_backend', None)
+        assert codec.get_backend().name == 'json'
+    finally:
+        codec.set_backend(previous)
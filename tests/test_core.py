@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import patch
 
 from mce_azure import core
+from mce_azure.query import ResourceQuery
 
 def test_get_resourcegroups_list(mock_response_class, json_file):
 
@@ -10,7 +11,7 @@ def test_get_resourcegroups_list(mock_response_class, json_file):
     with patch("requests.Session.get") as func:
         func.return_value = mock_response_class(200, data)
         session = core.get_session("test")
-        response = core.get_resourcegroups_list("00000000-0000-0000-0000-000000000000", session=session)
+        response = core.fetch_all(core.get_resourcegroups_list, "00000000-0000-0000-0000-000000000000", session=session)
         assert response == data["value"]
 
 def test_get_resources_list(mock_response_class, json_file):
@@ -23,6 +24,23 @@ def test_get_resources_list(mock_response_class, json_file):
         response = list(core.get_resources_list("00000000-0000-0000-0000-000000000000", session=session))
         assert response == data["value"]
 
+def test_get_resources_list_next_link(mock_response_class, json_file):
+
+    data = json_file("resource_list.json")
+    page1 = {"value": data["value"][:1], "nextLink": "https://management.azure.com/next?page=2"}
+    page2 = {"value": data["value"][1:]}
+
+    with patch("requests.Session.get") as func:
+        func.side_effect = [
+            mock_response_class(200, page1),
+            mock_response_class(200, page2),
+        ]
+        session = core.get_session("test")
+        response = list(core.get_resources_list("00000000-0000-0000-0000-000000000000", session=session))
+        assert response == data["value"]
+        assert func.call_count == 2
+        assert func.call_args_list[1][0][0] == page1["nextLink"]
+
 def test_get_resource_by_id(mock_response_class, json_file):
 
     data = json_file("resource-vm.json")
@@ -34,6 +52,186 @@ def test_get_resource_by_id(mock_response_class, json_file):
         response = core.get_resource_by_id(resource_id, session=session)
         assert response == data
 
-@pytest.mark.skipif(core.GEVENT is False, reason="Gevent not available")
 def test_async_get_resources(mock_response_class, json_file):
-    raise NotImplementedError()
+
+    resource_list = json_file("resource_list.json")
+    resource_vm = json_file("resource-vm.json")
+
+    def get(url, **kwargs):
+        if "/resources?" in url:
+            return mock_response_class(200, resource_list)
+        return mock_response_class(200, resource_vm)
+
+    with patch("requests.Session.get") as func:
+        func.side_effect = get
+        session = core.get_session("test", pool_size=5)
+        resources, errors = core.async_get_resources(
+            "00000000-0000-0000-0000-000000000000", session, pool_size=5
+        )
+        assert resources == [resource_vm, resource_vm]
+        assert errors == []
+        assert func.call_count == 3
+
+def test_get_resources_by_ids(arm_server, json_file):
+
+    data = json_file("resource-vm.json")
+    missing_id = data["id"].replace("MY_VM", "MISSING_VM")
+
+    session = core.get_session("test")
+    results, errors = core.get_resources_by_ids([data["id"], missing_id, "/bad/id"], session=session)
+    assert results == {data["id"]: data}
+    assert set(errors) == {missing_id, "/bad/id"}
+    assert errors[missing_id].status_code == 404
+    assert arm_server.count("POST") == 1
+
+def test_get_resources_by_ids_split(arm_server, json_file):
+
+    data = json_file("resource-vm.json")
+    missing_ids = [data["id"].replace("MY_VM", f"MISSING_VM_{i}") for i in range(core.BATCH_SIZE + 4)]
+
+    session = core.get_session("test")
+    results, errors = core.get_resources_by_ids([data["id"]] + missing_ids, session=session)
+    assert results == {data["id"]: data}
+    assert set(errors) == set(missing_ids)
+    # one batch request per BATCH_SIZE resources
+    assert arm_server.count("POST") == 2
+
+@pytest.mark.parametrize("engine", ["sync", "async"])
+def test_get_resources_batch_size_above_limit(arm_server, engine):
+
+    session = core.get_session("test")
+    if engine == "sync":
+        resources = list(core.iter_resources_expanded(
+            "00000000-0000-0000-0000-000000000000", session=session, batch_size=50
+        ))
+    else:
+        resources, errors = core.async_get_resources(
+            "00000000-0000-0000-0000-000000000000", session, batch_size=50
+        )
+        assert errors == []
+    assert len(resources) == 3
+    assert arm_server.count("POST") == 1
+
+def test_iter_resources_expanded_batch(arm_server):
+
+    session = core.get_session("test")
+    resources = list(core.iter_resources_expanded(
+        "00000000-0000-0000-0000-000000000000", session=session, batch_size=20
+    ))
+    assert len(resources) == 3
+    assert arm_server.count("POST") == 1
+    # 3 resources, page_size=2
+    assert arm_server.count("GET") == 2
+
+def test_async_get_resources_batch(arm_server):
+
+    session = core.get_session("test")
+    resources, errors = core.async_get_resources(
+        "00000000-0000-0000-0000-000000000000", session, batch_size=2
+    )
+    assert len(resources) == 3
+    assert errors == []
+    assert arm_server.count("POST") == 2
+
+def test_get_resources_list_query(mock_response_class, json_file):
+
+    data = json_file("resource_list.json")
+    query = ResourceQuery(
+        types=["Microsoft.Storage/storageAccounts", "Microsoft.Compute/virtualMachines"],
+        expand=["changedTime", "createdTime"],
+        top=100,
+    )
+
+    with patch("requests.Session.get") as func:
+        func.return_value = mock_response_class(200, {"value": data["value"][:1]})
+        session = core.get_session("test")
+        response = list(core.get_resources_list("00000000-0000-0000-0000-000000000000", session=session, query=query))
+        assert response == data["value"][:1]
+        url = func.call_args[0][0]
+        assert "/subscriptions/00000000-0000-0000-0000-000000000000/resources?api-version=" in url
+        assert "$filter=resourceType%20eq%20'Microsoft.Storage/storageAccounts'%20or%20resourceType%20eq%20" in url
+        assert "$top=100" in url
+        assert "$expand=changedTime,createdTime" in url
+
+def test_get_resources_list_query_tag(mock_response_class, json_file):
+
+    data = json_file("resource_list.json")
+    query = ResourceQuery(
+        types=["Microsoft.Storage/storageAccounts"],
+        resource_group="Cloud-Shell",
+        tag_name="ms-resource-usage",
+        tag_value="azure-cloud-shell",
+    )
+    assert query.get_filter() == "tagName eq 'ms-resource-usage' and tagValue eq 'azure-cloud-shell'"
+
+    with patch("requests.Session.get") as func:
+        func.return_value = mock_response_class(200, data)
+        session = core.get_session("test")
+        response = list(core.get_resources_list("00000000-0000-0000-0000-000000000000", session=session, query=query))
+        # type is filtered client side
+        assert response == data["value"][:1]
+        assert "/resourceGroups/Cloud-Shell/resources?" in func.call_args[0][0]
+
+    with pytest.raises(ValueError):
+        ResourceQuery(expand=["properties"])
+
+def test_get_resources_list_by_groups(arm_server):
+
+    session = core.get_session("test")
+
+    response = list(core.get_resources_list(
+        "00000000-0000-0000-0000-000000000000", session=session, group_concurrency=4
+    ))
+    assert sorted(r["id"].lower() for r in response) == sorted(arm_server.resources)
+    # 2 pages of groups + 1 request by group
+    assert arm_server.count() == 5
+    assert all("/resourceGroups/" in url for method, url in arm_server.requests[2:])
+
+    # stop early: the groups not started are not listed
+    arm_server.requests.clear()
+    items = core.get_resources_list_by_groups(
+        "00000000-0000-0000-0000-000000000000", session=session, max_pending=1, includes=None, concurrency=1
+    )
+    assert next(items)["id"]
+    items.close()
+    assert len([url for method, url in arm_server.requests if "/resourceGroups/" in url]) < 3
+
+    # top of all the groups
+    response = list(core.get_resources_list_by_groups(
+        "00000000-0000-0000-0000-000000000000", session=session, query=ResourceQuery(top=1), includes=None
+    ))
+    assert len(response) == 1
+
+
+def test_load_providers_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, '_PROVIDERS', None)
+    monkeypatch.setattr(core, '_PROVIDER_TRIE', None)
+
+    filepath = tmp_path / "providers.json"
+    filepath.write_text('{"Microsoft.Sql/servers": "2019-06-01-preview"}')
+
+    providers = core.load_providers(str(filepath))
+    assert providers == {"microsoft.sql/servers": "2019-06-01-preview"}
+    assert (tmp_path / "providers.marshal").exists()
+
+    # from the cache
+    with patch('json.load') as json_load:
+        assert core.load_providers(str(filepath)) == providers
+        json_load.assert_not_called()
+
+    # json file updated: the cache is ignored
+    filepath.write_text('{"Microsoft.Sql/servers": "2021-11-01", "Microsoft.Web/sites": "2022-03-01"}')
+    assert core.load_providers(str(filepath))["microsoft.sql/servers"] == "2021-11-01"
+    assert core.get_type_api_version("Microsoft.Web/sites/slots") == "2022-03-01"
+
+
+def test_import_is_lazy():
+    import subprocess
+    import sys
+
+    code = (
+        "import sys; from mce_azure import core; "
+        "print(core._PROVIDERS is None, 'azure.common' in sys.modules, 'dotenv' in sys.modules)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.split() == ["True", "False", "False"]
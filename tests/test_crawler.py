@@ -0,0 +1,75 @@
+import copy
+import time
+from unittest.mock import patch
+
+from mce_azure import auth, core
+from mce_azure.crawler import crawl_subscription, crawl_tenant, get_enabled_subscriptions, get_session_from_credentials
+from mce_azure.metrics import Metrics
+
+OTHER_SUBSCRIPTION = "11111111-1111-1111-1111-111111111111"
+
+
+def test_crawl_tenant(arm_server, monkeypatch):
+    monkeypatch.setenv("MCE_AZURE_BASE_URL", arm_server.base_url)
+
+    for resource in list(arm_server.resources.values()):
+        other = copy.deepcopy(resource)
+        other["id"] = other["id"].replace("00000000-0000-0000-0000-000000000000", OTHER_SUBSCRIPTION)
+        arm_server.add(other)
+
+    arm_server.subscriptions = [
+        {"subscriptionId": "00000000-0000-0000-0000-000000000000", "state": "Enabled"},
+        {"subscriptionId": OTHER_SUBSCRIPTION, "state": "Enabled"},
+        {"subscriptionId": "22222222-2222-2222-2222-222222222222", "state": "Disabled"},
+    ]
+    session = core.get_session("test")
+    assert get_enabled_subscriptions(session) == [
+        "00000000-0000-0000-0000-000000000000", OTHER_SUBSCRIPTION
+    ]
+
+    resources = []
+    progress = []
+    metrics = Metrics()
+    summary = crawl_tenant(
+        {"access_token": "test"}, resources.append, expand=True, processes=2,
+        subscription_ids=get_enabled_subscriptions(session) + ["not-found"],
+        progress=lambda done, total, result: progress.append((done, total)),
+        metrics=metrics,
+    )
+
+    assert len(resources) == 6
+    assert len({r["id"] for r in resources}) == 6
+    assert summary["resources"] == 6
+    assert summary["errors"] == 0
+    assert list(summary["failed"]) == ["not-found"]
+    assert sorted(progress) == [(1, 3), (2, 3), (3, 3)]
+
+    # merged metrics of the workers
+    endpoints = metrics.summary()["endpoints"]
+    assert endpoints["resources.get"]["latency"]["count"] == 6
+    assert endpoints["resources.list"]["status"]["404"] == 1
+
+
+def test_crawl_subscription_token_refresh(arm_server, tmpdir):
+    credentials = {"user": "client", "password": "secret", "tenant": "tenant"}
+    calls = []
+    token = {"access_token": "test", "expires_on": str(int(time.time() + 3600))}
+
+    with patch.object(auth.TokenProvider, "_acquire", lambda self: dict(token)), \
+            patch.object(auth.TokenProvider, "start", lambda self: calls.append("start")), \
+            patch.object(auth.TokenProvider, "stop", lambda self: calls.append("stop")):
+        session, provider = get_session_from_credentials(credentials, pool_size=30)
+        assert session.get_adapter("https://")._pool_maxsize == 30
+        assert provider is not None
+
+        result = crawl_subscription("00000000-0000-0000-0000-000000000000", credentials, str(tmpdir), expand=True)
+        assert result.error is None
+        assert result.count == 3
+        assert calls == ["start", "stop"]
+
+        # stopped on errors too
+        result = crawl_subscription("not-found", credentials, str(tmpdir))
+        assert result.error
+        assert calls == ["start", "stop", "start", "stop"]
+
+    auth._TOKENS.clear()
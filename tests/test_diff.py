@@ -0,0 +1,97 @@
+import copy
+import json
+import os
+import sys
+import subprocess
+
+import pytest
+
+from mce_azure.diff import diff_exports, diff_resources, get_digest
+from mce_azure.export import open_exporter
+from mce_azure.testing import synthetic_resources
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _export(filepath, resources):
+    with open_exporter(filepath) as exporter:
+        for resource in resources:
+            exporter.write(resource)
+    return filepath
+
+
+def test_diff_resources():
+    old = {"a": 1, "b": {"c": [1, {"d": "x"}], "e": True}, "f": None}
+    new = {"a": 1.0, "b": {"c": [1, {"d": "y"}, 3]}, "g": {}}
+    changes = [change.to_dict() for change in diff_resources(old, new)]
+    assert changes == [
+        {"op": "changed", "path": "a", "old": 1, "new": 1.0},
+        {"op": "changed", "path": "b.c[1].d", "old": "x", "new": "y"},
+        {"op": "added", "path": "b.c[2]", "new": 3},
+        {"op": "removed", "path": "b.e", "old": True},
+        {"op": "removed", "path": "f", "old": None},
+        {"op": "added", "path": "g", "new": {}},
+    ]
+    assert list(diff_resources(old, copy.deepcopy(old))) == []
+    assert get_digest({"a": 1, "b": 2}) == get_digest({"b": 2, "a": 1})
+
+
+@pytest.mark.parametrize("new_filename", ["new.json", "new.ndjson.gz"])
+def test_diff_exports(tmpdir, new_filename):
+    resources = list(synthetic_resources(100))
+    new = copy.deepcopy(resources[10:]) + list(synthetic_resources(105))[100:]
+    new[0]["tags"]["env"] = "changed"
+    new[1]["properties"]["provisioningState"] = "Updating"
+    # order of the keys is ignored
+    new[2] = dict(reversed(list(new[2].items())))
+
+    old_file = _export(os.path.join(str(tmpdir), "old.ndjson.gz"), resources)
+    new_file = _export(os.path.join(str(tmpdir), new_filename), new)
+
+    entries = list(diff_exports(old_file, new_file))
+    assert [(e.op, e.id) for e in entries if e.op == "added"] == [("added", r["id"]) for r in new[90:]]
+    assert [(e.op, e.id) for e in entries if e.op == "removed"] == [("removed", r["id"]) for r in resources[:10]]
+    assert entries[-1].resource == resources[9]
+
+    modified = [e for e in entries if e.op == "modified"]
+    assert [e.id for e in modified] == [new[0]["id"], new[1]["id"]]
+    assert [c.to_dict() for c in modified[0].changes] == [
+        {"op": "changed", "path": "tags.env", "old": resources[10]["tags"]["env"], "new": "changed"}
+    ]
+    assert modified[1].changes[0].path == "properties.provisioningState"
+
+    entries = list(diff_exports(old_file, new_file, ignore=["properties.provisioningState"]))
+    assert len([e for e in entries if e.op == "modified"]) == 1
+
+    # key with dots
+    resources[10]["tags"]["app.kubernetes.io/name"] = "old"
+    new[0]["tags"]["app.kubernetes.io/name"] = "new"
+    old_file = _export(os.path.join(str(tmpdir), "old.ndjson.gz"), resources)
+    new_file = _export(os.path.join(str(tmpdir), new_filename), new)
+    entries = list(diff_exports(old_file, new_file, ignore=[["tags", "app.kubernetes.io/name"], "tags.env"]))
+    assert [e.id for e in entries if e.op == "modified"] == [new[1]["id"]]
+
+
+def test_diff_command(tmpdir):
+    resources = list(synthetic_resources(3))
+    new = copy.deepcopy(resources[1:])
+    new[0]["location"] = "changed"
+    old_file = _export(os.path.join(str(tmpdir), "old.ndjson"), resources)
+    new_file = _export(os.path.join(str(tmpdir), "new.ndjson"), new)
+    output = os.path.join(str(tmpdir), "diff.ndjson")
+
+    # no credentials
+    env = {k: v for k, v in os.environ.items() if not k.startswith("MCE_AZURE")}
+    subprocess.check_call([
+        sys.executable, "-c", "from mce_azure.core import main; main()",
+        "-C", "diff", "--old", old_file, "--new", new_file, "--export", output,
+    ], env=env, cwd=ROOT, stdout=subprocess.DEVNULL)
+
+    with open(output) as fp:
+        entries = [json.loads(line) for line in fp]
+    assert [(e["op"], e["id"]) for e in entries] == [
+        ("modified", new[0]["id"]), ("removed", resources[0]["id"])
+    ]
+    assert entries[0]["changes"] == [
+        {"op": "changed", "path": "location", "old": resources[1]["location"], "new": "changed"}
+    ]
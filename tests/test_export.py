@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from mce_azure.export import open_exporter, get_format, ExportReader
+
+
+def test_get_format():
+    assert get_format("export.json") == "json"
+    assert get_format("export.ndjson.gz") == "ndjson"
+    assert get_format("export.jsonl") == "ndjson"
+    assert get_format("export.json", "ndjson") == "ndjson"
+
+
+def test_json_array_always_valid(tmpdir, json_file):
+    filepath = os.path.join(str(tmpdir), "export.json")
+    resources = json_file("resource_list.json")["value"] + [json_file("resource-vm.json")]
+
+    exporter = open_exporter(filepath)
+    with open(filepath) as fp:
+        assert json.load(fp) == []
+
+    for i, resource in enumerate(resources):
+        exporter.write(resource)
+        # crawl interrupted here (no flush, no close): the file is still valid
+        with open(filepath) as fp:
+            assert json.load(fp) == resources[:i + 1]
+
+    exporter.close()
+    with open(filepath) as fp:
+        assert json.load(fp) == resources
+    assert exporter.count == 3
+
+    exporter = open_exporter(filepath)
+    for i in range(1500):
+        exporter.write({"id": i})
+    with open(filepath) as fp:
+        assert len(json.load(fp)) == 1500
+    exporter.close()
+
+
+@pytest.mark.parametrize("filename", ["export.ndjson", "export.ndjson.gz", "export.json.gz"])
+def test_export(tmpdir, json_file, filename):
+    filepath = os.path.join(str(tmpdir), filename)
+    resources = json_file("resource_list.json")["value"]
+
+    with open_exporter(filepath) as exporter:
+        for resource in resources:
+            exporter.write(resource)
+
+    _open = gzip.open if filename.endswith(".gz") else open
+    with _open(filepath, "rt") as fp:
+        if "ndjson" in filename:
+            assert [json.loads(line) for line in fp] == resources
+        else:
+            assert json.load(fp) == resources
+
+
+@pytest.mark.parametrize("filename", ["export.ndjson", "export.json", "export.ndjson.gz", "export.json.gz"])
+def test_export_reader(tmpdir, json_file, filename):
+    filepath = os.path.join(str(tmpdir), filename)
+    resources = json_file("resource_list.json")["value"] + [json_file("resource-vm.json")]
+
+    with open_exporter(filepath) as exporter:
+        for resource in resources:
+            exporter.write(resource)
+
+    with ExportReader(filepath) as reader:
+        items = list(reader)
+        assert [resource for offset, resource in items] == resources
+        for offset, resource in reversed(items):
+            assert reader.read_at(offset) == resource
@@ -0,0 +1,108 @@
+import copy
+
+from mce_azure import core, graph
+from mce_azure.graph import get_graph_query, iter_resources_graph, to_resource_dict
+from mce_azure.metrics import Metrics
+from mce_azure.model import Resource
+from mce_azure.query import ResourceQuery
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+OTHER_SUBSCRIPTION = "11111111-1111-1111-1111-111111111111"
+
+
+def test_get_graph_query():
+    assert get_graph_query() == "Resources"
+    query = ResourceQuery(
+        types=("Microsoft.Compute/virtualMachines", "Microsoft.Storage/storageAccounts"),
+        resource_group="it's", tag_name="env", tag_value="prod", top=10,
+    )
+    assert get_graph_query(query) == (
+        "Resources"
+        " | where type in~ ('Microsoft.Compute/virtualMachines', 'Microsoft.Storage/storageAccounts')"
+        " | where resourceGroup =~ 'it\\'s'"
+        " | where tags['env'] == 'prod'"
+        " | limit 10"
+    )
+    assert get_graph_query(ResourceQuery(tag_name="env")) == "Resources | where isnotnull(tags['env'])"
+
+
+def test_to_resource_dict():
+    row = {
+        "id": "/subscriptions/xxx/resourceGroups/RG1/providers/Microsoft.Compute/virtualMachines/vm1",
+        "name": "vm1",
+        "type": "microsoft.compute/virtualmachines",
+        "tenantId": "t",
+        "subscriptionId": "xxx",
+        "resourceGroup": "rg1",
+        "kind": "",
+        "managedBy": "",
+        "sku": None,
+        "tags": {},
+        "properties": {"vmId": "1"},
+    }
+    assert to_resource_dict(row) == {
+        "id": row["id"],
+        "name": "vm1",
+        "type": "Microsoft.Compute/virtualMachines",
+        "tags": {},
+        "properties": {"vmId": "1"},
+    }
+
+
+def test_iter_resources_graph(arm_server):
+    for resource in list(arm_server.resources.values()):
+        other = copy.deepcopy(resource)
+        other["id"] = other["id"].replace(SUBSCRIPTION_ID, OTHER_SUBSCRIPTION)
+        arm_server.add(other)
+
+    session = core.get_session("test")
+    metrics = Metrics()
+    metrics.install(session)
+
+    resources = list(iter_resources_graph([SUBSCRIPTION_ID, OTHER_SUBSCRIPTION], session=session, page_size=2))
+    assert len(resources) == 6
+    # 3 pages of 2 rows
+    assert metrics.summary()["endpoints"]["graph"]["latency"]["count"] == 3
+    assert arm_server.count("GET") == 0
+
+    # same shape as get_resource_by_id
+    for resource in resources:
+        assert resource == core.get_resource_by_id(resource["id"], session=session)
+
+    query = ResourceQuery(types=("Microsoft.Storage/storageAccounts",), tag_name="ms-resource-usage")
+    resources = list(iter_resources_graph(SUBSCRIPTION_ID, session=session, query=query, compact=True))
+    assert [r.type for r in resources] == ["Microsoft.Storage/storageAccounts"]
+    assert isinstance(resources[0], Resource)
+
+    resources = list(iter_resources_graph(SUBSCRIPTION_ID, session=session, query=ResourceQuery(
+        resource_group="not-found"
+    )))
+    assert resources == []
+
+
+def test_iter_resources_graph_top(arm_server, monkeypatch):
+    for resource in list(arm_server.resources.values()):
+        other = copy.deepcopy(resource)
+        other["id"] = other["id"].replace(SUBSCRIPTION_ID, OTHER_SUBSCRIPTION)
+        arm_server.add(other)
+
+    # one query per subscription: top is the limit of all the queries
+    monkeypatch.setattr(graph, "GRAPH_MAX_SUBSCRIPTIONS", 1)
+    session = core.get_session("test")
+    resources = list(iter_resources_graph(
+        [SUBSCRIPTION_ID, OTHER_SUBSCRIPTION], session=session, query=ResourceQuery(top=4)
+    ))
+    assert len(resources) == 4
+
+    # row without id
+    monkeypatch.setattr(graph, "iter_pages", lambda *args, **kwargs: iter([[{"name": "x"}, {"id": resources[0]["id"]}]]))
+    assert [r["id"] for r in iter_resources_graph(SUBSCRIPTION_ID, session=session, includes=None)] == [resources[0]["id"]]
+
+
+def test_iter_resources_graph_retry(arm_server):
+    arm_server.throttle_every = 2
+    arm_server.retry_after = 0
+    session = core.get_session("test")
+    resources = list(iter_resources_graph(SUBSCRIPTION_ID, session=session, page_size=1))
+    assert len(resources) == 3
+    assert arm_server.throttled > 0
@@ -0,0 +1,40 @@
+import os
+
+from mce_azure import core
+from mce_azure.incremental import SnapshotStore, incremental_inventory
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def test_incremental_inventory(arm_server, tmpdir):
+
+    for i, resource in enumerate(arm_server.resources.values()):
+        resource["changedTime"] = "2020-01-0%sT00:00:00Z" % (i + 1)
+
+    store = SnapshotStore(os.path.join(str(tmpdir), "snapshot.json"))
+    session = core.get_session("test")
+
+    changes = incremental_inventory(SUBSCRIPTION_ID, store, session=session)
+    assert len(changes.added) == 3
+    assert changes.changed == [] and changes.deleted == []
+    assert len(store.resources()) == 3
+    assert "$expand=changedTime" in arm_server.requests[0][1]
+
+    # no change: listing only
+    count = arm_server.count()
+    changes = incremental_inventory(SUBSCRIPTION_ID, store, session=session)
+    assert changes.unchanged == 3
+    assert changes.added == [] and changes.changed == [] and changes.deleted == []
+    assert arm_server.count() - count == 2
+
+    resources = sorted(arm_server.resources)
+    arm_server.resources[resources[0]]["changedTime"] = "2020-02-01T00:00:00Z"
+    deleted = arm_server.resources.pop(resources[1])
+
+    count = arm_server.count()
+    changes = incremental_inventory(SUBSCRIPTION_ID, store, session=session)
+    assert [r["id"] for r in changes.changed] == [arm_server.resources[resources[0]]["id"]]
+    assert changes.deleted == [deleted["id"]]
+    assert changes.unchanged == 1
+    assert arm_server.count() - count == 2
+    assert len(store.resources()) == 2
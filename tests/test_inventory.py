@@ -0,0 +1,92 @@
+import time
+
+from mce_azure import core
+from mce_azure.inventory import Inventory
+from mce_azure.model import Resource
+from mce_azure.testing import synthetic_resources
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+VM = "Microsoft.Compute/virtualMachines"
+
+
+def test_inventory_find():
+    resources = list(synthetic_resources(1000))
+    inventory = Inventory(resources)
+    assert len(inventory) == 1000
+
+    def scan(resource_type, location, env):
+        return sorted(
+            r["id"] for r in resources
+            if r["type"] == resource_type and r["location"] == location and (r.get("tags") or {}).get("env") == env
+        )
+
+    resource = resources[0]
+    env = resource["tags"]["env"]
+    found = inventory.find(type=resource["type"], location=resource["location"], tags={"env": env})
+    assert sorted(r["id"] for r in found) == scan(resource["type"], resource["location"], env)
+    assert resource in found
+
+    # case insensitive, except the tag values
+    assert inventory.count(type=resource["type"].upper(), location=resource["location"].upper(),
+                           tags={"ENV": env}) == len(found)
+    assert inventory.count(tags={"env": env.upper()}) == 0
+
+    # or between the values of a criteria
+    types = sorted(inventory.counts("type"))[:2]
+    assert inventory.count(type=types) == sum(inventory.counts("type")[t] for t in types)
+
+    # all the values of a tag
+    assert inventory.count(tags={"env": None}) == sum(1 for r in resources if "env" in (r.get("tags") or {}))
+
+    assert inventory.count(subscription_id=SUBSCRIPTION_ID) == 1000
+    assert inventory.count(resource_group="not-found") == 0
+    assert inventory.count() == 1000
+    assert sum(inventory.counts("resource_group").values()) == 1000
+
+
+def test_inventory_add_remove():
+    resource = next(iter(synthetic_resources(1)))
+    inventory = Inventory()
+    inventory.add(resource)
+    assert resource["id"].upper() in inventory
+    assert inventory.count(tags={"env": resource["tags"]["env"]}) == 1
+
+    # replace
+    changed = dict(resource, location="changed", tags={"owner": "me"})
+    inventory.add(changed)
+    assert len(inventory) == 1
+    assert inventory.count(location=resource["location"]) == 0
+    assert inventory.count(tags={"env": None}) == 0
+    assert inventory.find(location="changed", tags={"owner": "me"}) == [changed]
+
+    assert inventory.remove(resource["id"]) == changed
+    assert inventory.remove(resource["id"]) is None
+    assert len(inventory) == 0
+    assert inventory.counts("location") == {} and inventory.counts("tags") == {}
+
+
+def test_inventory_compact(arm_server):
+    session = core.get_session("test")
+    inventory = Inventory(core.get_resources_list(SUBSCRIPTION_ID, session=session, compact=True))
+    assert len(inventory) == 3
+    assert all(isinstance(r, Resource) for r in inventory)
+
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, compact=True)
+    inventory.update(resources)
+    assert len(inventory) == 3
+    for resource in resources:
+        assert inventory.get(resource.id) is resource
+        assert inventory.find(type=resource.type, resource_group=resource.resource_group) != []
+
+
+def test_inventory_query_time():
+    inventory = Inventory(Resource.from_dict(item) for item in synthetic_resources(20000))
+    resource = next(iter(inventory))
+
+    start = time.perf_counter()
+    for _ in range(100):
+        found = inventory.select(type=resource.type, location=resource.location,
+                                 resource_group=resource.resource_group)
+    elapsed = (time.perf_counter() - start) / 100
+    assert resource.id.lower() in found
+    assert elapsed < 0.005
@@ -0,0 +1,73 @@
+from mce_azure import core, metrics
+from mce_azure.metrics import Histogram, Metrics, get_endpoint
+from mce_azure.utils import RetryPolicy
+
+SUB = "/subscriptions/00000000-0000-0000-0000-000000000000"
+BASE = "https://management.azure.com"
+
+
+def test_get_endpoint():
+    assert get_endpoint(f"{BASE}/subscriptions?api-version=2019-11-01") == ("subscriptions.list", None)
+    assert get_endpoint(f"{BASE}/tenants?api-version=2019-11-01") == ("tenants.list", None)
+    assert get_endpoint(f"{BASE}{SUB}/resources?api-version=2019-10-01") == ("resources.list", None)
+    assert get_endpoint(f"{BASE}{SUB}/resourceGroups/rg/resources?$top=10") == ("resources.list", None)
+    assert get_endpoint(f"{BASE}{SUB}/resourcegroups?api-version=2019-10-01") == ("resourcegroups.list", None)
+    assert get_endpoint(f"{BASE}{SUB}/locations") == ("locations.list", None)
+    assert get_endpoint(f"{BASE}/batch?api-version=2020-06-01") == ("batch", None)
+    assert get_endpoint(f"{BASE}{SUB}/resourceGroups/rg/providers/Microsoft.Sql/servers/s/databases/db") == \
+        ("resources.get", "Microsoft.Sql/servers/databases")
+    assert get_endpoint(f"{BASE}/unknown/path") == ("other", None)
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 0.7, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 1]
+    assert histogram.quantile(0.4) == 0.1
+    assert histogram.quantile(0.8) == 1.0
+    assert histogram.quantile(1) is None
+
+    other = Histogram(buckets=(0.1, 1.0))
+    other.merge(histogram.to_dict())
+    assert other.counts == histogram.counts
+    assert other.count == 5
+
+
+def test_metrics(arm_server, json_file, mock_response_class):
+    collector = Metrics()
+    session = collector.install(core.get_session("test"))
+    try:
+        resources, errors = core.async_get_resources(SUB.split('/')[-1], session, pool_size=2)
+        assert len(resources) == 3
+
+        # events of the other modules
+        policy = RetryPolicy(backoff=0)
+        responses = [mock_response_class(429, {}, headers={"Retry-After": "0.01"}), mock_response_class(200, {})]
+        policy.call(lambda: responses.pop(0), name='get')
+    finally:
+        collector.close()
+
+    metrics.emit('retry', 1.0, name='get')
+    summary = collector.summary()
+
+    assert summary["requests"] == arm_server.count() == 5
+    assert summary["endpoints"]["resources.list"]["status"] == {"200": 2}
+    assert summary["endpoints"]["resources.get"]["latency"]["count"] == 3
+    assert summary["endpoints"]["resources.get"]["bytes"] > 0
+    assert summary["types"]["Microsoft.Compute/virtualMachines"]["count"] == 1
+    assert summary["retries"] == {"get": 1}
+    assert summary["throttle_wait"] == 0.01
+    assert summary["queue_depth"]["fetch"]["max"] >= 1
+
+    text = collector.to_prometheus()
+    assert '# TYPE mce_azure_request_duration_seconds histogram' in text
+    assert 'mce_azure_request_duration_seconds_bucket{endpoint="resources.get",le="+Inf"} 3' in text
+    assert 'mce_azure_responses_total{endpoint="resources.list",status="200"} 2' in text
+    assert 'mce_azure_retries_total{name="get"} 1' in text
+
+    merged = Metrics()
+    merged.merge(summary)
+    merged.merge(summary)
+    assert merged.summary()["endpoints"]["resources.get"]["latency"]["count"] == 6
+    assert merged.summary()["retries"] == {"get": 2}
@@ -0,0 +1,78 @@
+import io
+import json
+import pickle
+import tracemalloc
+
+import pytest
+
+from mce_azure import core
+from mce_azure.export import NDJsonExporter
+from mce_azure.model import Resource, to_resource
+from mce_azure.testing import synthetic_resources
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def test_resource(json_file):
+    data = json_file("resource-vm.json")
+    resource = Resource.from_dict(data)
+
+    assert resource.to_dict() == data
+    assert resource == data
+    assert resource["id"] == resource.id == data["id"]
+    assert resource["properties"] == resource.properties == data["properties"]
+    assert resource.get("tags") == data.get("tags")
+    assert resource.get("unknown", 1) == 1
+    assert "properties" in resource
+    assert "kind" not in resource
+    with pytest.raises(KeyError):
+        resource["kind"]
+
+    assert resource.subscription_id == SUBSCRIPTION_ID
+    assert resource.resource_group == "MY_RG_GROUP"
+    assert resource.resource_id.resource_type == "Microsoft.Compute/virtualMachines"
+    assert to_resource(resource) is resource
+    assert pickle.loads(pickle.dumps(resource)) == resource
+
+
+def test_resource_interned():
+    first, second = (
+        Resource.from_dict(json.loads(json.dumps(item))) for item in list(synthetic_resources(12))[::11]
+    )
+    assert first.type is second.type
+    assert first.location is not None
+    assert first.get_tag("owner") == "team-0"
+    assert list(first.tags)[0] is list(second.tags)[0]
+
+
+def test_resource_memory():
+    items = [json.dumps(item) for item in synthetic_resources(2000)]
+
+    def allocated(func):
+        tracemalloc.start()
+        resources = [func(json.loads(item)) for item in items]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(resources) == 2000
+        return size
+
+    assert allocated(Resource.from_dict) < allocated(dict) / 2
+
+
+def test_get_resources_list_compact(arm_server):
+    session = core.get_session("test")
+    resources = list(core.get_resources_list(SUBSCRIPTION_ID, session=session, compact=True))
+    assert len(resources) == 3
+    assert all(isinstance(r, Resource) for r in resources)
+    assert [r.to_dict() for r in resources] == list(core.get_resources_list(SUBSCRIPTION_ID, session=session))
+
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, compact=True)
+    assert len(resources) == 3
+    assert all(isinstance(r, Resource) for r in resources)
+
+    expanded = list(core.iter_resources_expanded(SUBSCRIPTION_ID, session=session, batch_size=20, compact=True))
+    assert sorted(r.id for r in expanded) == sorted(r.id for r in resources)
+
+    fp = io.BytesIO()
+    NDJsonExporter(fp).write(resources[0])
+    assert json.loads(fp.getvalue()) == resources[0].to_dict()
@@ -0,0 +1,92 @@
+import asyncio
+from unittest.mock import patch
+
+from requests.hooks import dispatch_hook
+
+from mce_azure import aio, core
+from mce_azure.ratelimit import ConcurrencyController, get_remaining_quota, get_retry_after
+from mce_azure.utils import RetryPolicy
+
+RESOURCE_ID = (
+    "/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/MY_RG_GROUP"
+    "/providers/Microsoft.Compute/virtualMachines/MY_VM_%s"
+)
+
+
+def test_get_remaining_quota():
+    headers = {
+        "x-ms-ratelimit-remaining-subscription-reads": "11999",
+        "x-ms-ratelimit-remaining-tenant-reads": "50",
+        "content-type": "application/json",
+    }
+    assert get_remaining_quota(headers) == 50
+    assert get_remaining_quota({}) is None
+
+
+def test_get_retry_after():
+    assert get_retry_after({"Retry-After": "17"}) == 17
+    assert get_retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, default=5) == 5
+    assert get_retry_after({}) is None
+
+
+def test_controller_observe():
+    controller = ConcurrencyController(min_width=2, max_width=12, initial_width=10)
+
+    for _ in range(5):
+        controller.observe({"x-ms-ratelimit-remaining-subscription-reads": "11000"}, 200)
+    assert controller.width == 12
+
+    controller.observe({"x-ms-ratelimit-remaining-subscription-reads": "500"}, 200)
+    assert controller.width == 12
+
+    controller.observe({"x-ms-ratelimit-remaining-subscription-reads": "100"}, 200)
+    assert controller.width == 6
+
+    controller.observe({"Retry-After": "0.2"}, 429)
+    assert controller.width == 3
+    assert 0 < controller.delay() <= 0.2
+
+    controller.observe({"Retry-After": "0"}, 429)
+    controller.observe({}, 429)
+    assert controller.width == 2
+
+    stats = controller.stats()
+    assert stats["width"] == 2
+    assert stats["remaining"] == 100
+    assert stats["throttle_events"] == 3
+
+
+def test_fetcher_with_controller(mock_response_class, json_file):
+
+    data = json_file("resource-vm.json")
+    controller = ConcurrencyController(min_width=1, max_width=4, initial_width=1)
+    policy = RetryPolicy()
+    session = core.get_session("test", retry_policy=policy)
+
+    throttled = []
+
+    def get(url, **kwargs):
+        # throttled once, then retried
+        if url.endswith("MY_VM_0?api-version=2019-12-01") and not throttled:
+            throttled.append(url)
+            resp = mock_response_class(429, {}, raise_error=True, reason="too many requests",
+                                       headers={"Retry-After": "0.1"})
+        else:
+            resp = mock_response_class(200, data, headers={"x-ms-ratelimit-remaining-subscription-reads": "10"})
+        dispatch_hook('response', session.hooks, resp)
+        return resp
+
+    async def main():
+        async with aio.AsyncFetcher(session, controller=controller) as fetcher:
+            return await fetcher.get_resources(RESOURCE_ID % i for i in range(6))
+
+    with patch("requests.Session.get") as func:
+        func.side_effect = get
+        resources, errors = asyncio.run(main())
+
+    assert len(resources) == 6
+    assert len(errors) == 0
+    assert controller.width == 1
+    assert controller.stats()["throttle_events"] == 1
+    # Retry-After waited by the retry
+    assert policy.stats()["calls"]["get"]["wait_time"] >= 0.1
@@ -0,0 +1,68 @@
+import pytest
+
+from mce_azure import core
+from mce_azure.resource_id import parse_resource_id, ProviderTrie
+
+SUB = "/subscriptions/00000000-0000-0000-0000-000000000000"
+
+
+def test_parse_resource_id():
+    rid = parse_resource_id(f"{SUB}/resourceGroups/MY_RG/providers/Microsoft.Sql/servers/srv1/databases/db1")
+    assert rid.subscription_id == "00000000-0000-0000-0000-000000000000"
+    assert rid.resource_group == "MY_RG"
+    assert rid.resource_type == "Microsoft.Sql/servers/databases"
+    assert rid.parent_type == "Microsoft.Sql/servers"
+    assert rid.names == ("srv1", "db1")
+    assert rid.name == "db1"
+    assert rid.scope is None
+
+    rid = parse_resource_id(
+        f"{SUB}/resourceGroups/MY_RG/providers/Microsoft.Storage/storageAccounts/sa/blobServices/default/containers/c1"
+    )
+    assert rid.resource_type == "Microsoft.Storage/storageAccounts/blobServices/containers"
+
+    rid = parse_resource_id(f"{SUB}/resourceGroups/MY_RG")
+    assert rid.resource_type == "Microsoft.Resources/subscriptions/resourceGroups"
+    assert parse_resource_id(SUB).resource_type == "Microsoft.Resources/subscriptions"
+
+    vm_id = f"{SUB}/resourceGroups/MY_RG/providers/Microsoft.Compute/virtualMachines/vm1"
+    rid = parse_resource_id(f"{vm_id}/providers/microsoft.insights/diagnosticSettings/setting1")
+    assert rid.resource_type == "microsoft.insights/diagnosticSettings"
+    assert rid.scope == vm_id
+    assert rid.resource_group == "MY_RG"
+
+    rid = parse_resource_id("/providers/Microsoft.Management/managementGroups/mg1")
+    assert rid.subscription_id is None
+    assert rid.resource_type == "Microsoft.Management/managementGroups"
+
+    for bad in ["/subscriptions", f"{SUB}/resourceGroups/MY_RG/providers/Microsoft.Compute/virtualMachines"]:
+        with pytest.raises(ValueError):
+            parse_resource_id(bad)
+
+
+def test_provider_trie():
+    trie = ProviderTrie({
+        "microsoft.sql/servers": "2019-06-01-preview",
+        "microsoft.sql/servers/databases": "2017-10-01-preview",
+    })
+    assert trie.get("Microsoft.Sql/servers/databases") == "2017-10-01-preview"
+    assert trie.get("Microsoft.Sql/servers/firewallRules") == "2019-06-01-preview"
+    assert trie.get("Microsoft.Sql/managedInstances") is None
+    assert trie.get("Microsoft.Unknown/servers") is None
+
+
+def test_get_api_version():
+    rg = f"{SUB}/resourceGroups/MY_RG/providers"
+    assert core.get_api_version(f"{rg}/Microsoft.Compute/virtualMachines/vm1") == "2019-12-01"
+    assert core.get_api_version(f"{rg}/Microsoft.Sql/servers/srv1/databases/db1") == \
+        core.PROVIDERS["microsoft.sql/servers/databases"]
+    # unknown nested type: parent api-version
+    assert core.get_api_version(f"{rg}/Microsoft.Network/virtualNetworks/vnet/subnets/default") == \
+        core.PROVIDERS["microsoft.network/virtualnetworks"]
+    assert core.get_api_version(f"{SUB}/resourceGroups/MY_RG") == \
+        core.PROVIDERS["microsoft.resources/subscriptions/resourcegroups"]
+
+    with pytest.raises(Exception):
+        core.get_api_version(f"{rg}/Microsoft.Unknown/things/thing1")
+    with pytest.raises(Exception):
+        core.get_api_version("/bad/id")
@@ -0,0 +1,36 @@
+from mce_azure import core
+from mce_azure.testing import FakeARMServer, synthetic_resources
+from mce_azure.utils import RetryPolicy
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def test_synthetic_resources():
+    resources = list(synthetic_resources(100, groups=4))
+    assert len(resources) == len({r["id"] for r in resources}) == 100
+    assert len({r["id"].split("/")[4] for r in resources}) == 4
+    assert resources == list(synthetic_resources(100, groups=4))
+    for resource in resources:
+        assert core.get_api_version(resource["id"])
+
+
+def test_fake_server_throttling(monkeypatch):
+    with FakeARMServer(synthetic_resources(30), page_size=10, throttle_every=2, retry_after=0) as server:
+        monkeypatch.setattr(core, "AZURE_BASE_URL", server.base_url)
+        session = core.get_session("test", retry_policy=RetryPolicy(backoff=0))
+        assert len(list(core.get_resources_list(SUBSCRIPTION_ID, session=session))) == 30
+        # 3 pages: requests 2 and 4 throttled
+        assert server.throttled == 2
+        assert session.retry_policy.stats()["calls"]["get"]["retries"] == 2
+
+
+def test_fake_server_ratelimit(monkeypatch):
+    with FakeARMServer(synthetic_resources(30), page_size=10, ratelimit=2) as server:
+        monkeypatch.setattr(core, "AZURE_BASE_URL", server.base_url)
+        session = core.get_session("test", retry_policy=RetryPolicy(tries=1))
+        url = f"{server.base_url}/subscriptions/{SUBSCRIPTION_ID}/resources?api-version=2019-10-01"
+        assert session.get(url).headers["x-ms-ratelimit-remaining-subscription-reads"] == "1"
+        assert session.get(url).headers["x-ms-ratelimit-remaining-subscription-reads"] == "0"
+        resp = session.get(url)
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "1"
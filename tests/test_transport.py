@@ -0,0 +1,96 @@
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+from mce_azure import auth, core
+from mce_azure.transport import RecordingAdapter, ReplayAdapter, get_key, read_archive
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def test_get_key():
+    assert get_key("get", "https://management.azure.com/subscriptions?api-version=1") == \
+        ("GET", "/subscriptions?api-version=1", None)
+    assert get_key("POST", "http://127.0.0.1:8000/batch", '{"requests": []}')[2] == \
+        get_key("POST", "https://management.azure.com/batch", b'{"requests": []}')[2]
+
+
+def test_record_replay(arm_server, tmp_path, monkeypatch):
+    filepath = str(tmp_path / "crawl.arm.gz")
+
+    session = core.get_session("secret-token", transport=RecordingAdapter(filepath))
+    resources, errors = core.async_get_resources(SUBSCRIPTION_ID, session, batch_size=20)
+    session.close()
+
+    entries = list(read_archive(filepath))
+    assert len(entries) == arm_server.count() == 3
+    assert {entry["method"] for entry in entries} == {"GET", "POST"}
+    with open(filepath, "rb") as fp:
+        assert b"secret-token" not in fp.read()
+
+    # offline: another base url, the server is not used
+    monkeypatch.setattr(core, "AZURE_BASE_URL", "https://management.azure.com")
+    count = arm_server.count()
+    replay = ReplayAdapter(filepath)
+    session = core.get_session(transport=replay)
+    replayed, replay_errors = core.async_get_resources(SUBSCRIPTION_ID, session, batch_size=20)
+
+    assert arm_server.count() == count
+    assert replay_errors == []
+    assert sorted(r["id"] for r in replayed) == sorted(r["id"] for r in resources)
+    assert replay.stats() == {"hits": 3, "misses": 0}
+
+    resp = session.get(f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/unknown?api-version=1")
+    assert resp.status_code == 404
+    assert resp.json()["error"]["code"] == "NotRecorded"
+    assert replay.stats()["misses"] == 1
+
+
+def test_replay_timing(arm_server, tmp_path, monkeypatch):
+    filepath = str(tmp_path / "crawl.arm.gz")
+    arm_server.latency = 0.05
+
+    session = core.get_session(transport=RecordingAdapter(filepath))
+    items = list(core.get_resources_list(SUBSCRIPTION_ID, session=session))
+    session.close()
+
+    # pages are served in the recorded order, after the recorded latency
+    start = time.perf_counter()
+    session = core.get_session(transport=ReplayAdapter(filepath, timing=True))
+    assert list(core.get_resources_list(SUBSCRIPTION_ID, session=session)) == items
+    assert time.perf_counter() - start >= 0.1
+
+    start = time.perf_counter()
+    session = core.get_session(transport=ReplayAdapter(filepath))
+    assert list(core.get_resources_list(SUBSCRIPTION_ID, session=session)) == items
+    assert time.perf_counter() - start < 0.05
+
+
+def test_record_failed_command(arm_server, tmp_path, monkeypatch):
+    filepath = str(tmp_path / "failed.arm.gz")
+    resource_id = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/rg/providers/Microsoft.Compute/disks/unknown"
+    monkeypatch.setattr(sys, "argv", [
+        "mce-az", "-C", "get", "-r", resource_id, "-u", "client", "-p", "secret", "-t", "tenant", "-b", SUBSCRIPTION_ID,
+        "--record", filepath,
+    ])
+    token = {"access_token": "test", "expires_on": str(int(time.time() + 3600))}
+
+    stopped = []
+    stop = auth.TokenProvider.stop
+
+    def _stop(self):
+        stopped.append(True)
+        stop(self)
+
+    with patch.object(auth.TokenProvider, "_acquire", lambda self: dict(token)), \
+            patch.object(auth.TokenProvider, "stop", _stop):
+        with pytest.raises(Exception):
+            core.main()
+    auth._TOKENS.clear()
+    assert stopped == [True]
+
+    # the archive is completed on errors
+    entries = list(read_archive(filepath))
+    assert [entry["status"] for entry in entries] == [404]
@@ -0,0 +1,119 @@
+import pytest
+from unittest.mock import patch
+
+import requests
+
+from mce_azure import core
+from mce_azure.utils import RetryPolicy, chunks
+
+
+def test_chunks():
+    assert list(chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunks([], 2)) == []
+
+
+def test_retry_policy_classify():
+    policy = RetryPolicy()
+    assert policy.is_retryable(status_code=429)
+    assert policy.is_retryable(status_code=503)
+    assert not policy.is_retryable(status_code=404)
+    assert not policy.is_retryable(status_code=200)
+    assert policy.is_retryable(error=requests.exceptions.ConnectionError())
+    assert policy.is_retryable(error=requests.exceptions.ReadTimeout())
+    assert not policy.is_retryable(error=ValueError())
+
+
+def test_retry_policy_delay():
+    policy = RetryPolicy(backoff=1, max_backoff=5, max_retry_after=60)
+    for attempt in range(1, 10):
+        assert 0 <= policy.get_delay(attempt) <= min(5, 2 ** (attempt - 1))
+    assert policy.get_delay(1, {"Retry-After": "17"}) == 17
+    assert policy.get_delay(1, {"Retry-After": "3600"}) == 60
+
+
+def test_retry_policy_call(mock_response_class):
+    policy = RetryPolicy(tries=3, backoff=0)
+    responses = [
+        mock_response_class(429, {}, headers={"Retry-After": "0"}),
+        mock_response_class(503, {}),
+        mock_response_class(200, {"ok": True}),
+    ]
+    resp = policy.call(lambda: responses.pop(0), name='get')
+    assert resp.status_code == 200
+    assert policy.stats()['calls']['get'] == {'calls': 1, 'retries': 2, 'failures': 0, 'wait_time': 0.0}
+
+    # fatal: no retry
+    resp = policy.call(lambda: mock_response_class(404, {}), name='get')
+    assert resp.status_code == 404
+    assert policy.stats()['calls']['get']['retries'] == 2
+    assert policy.stats()['calls']['get']['failures'] == 1
+
+    with pytest.raises(ValueError):
+        policy.call(lambda: (_ for _ in ()).throw(ValueError("bad")), name='other')
+    assert policy.stats()['calls']['other']['retries'] == 0
+
+    # tries exhausted: last response
+    resp = policy.call(lambda: mock_response_class(500, {}), name='get')
+    assert resp.status_code == 500
+    assert policy.stats()['calls']['get']['retries'] == 4
+
+
+def test_retry_policy_budget(mock_response_class):
+    policy = RetryPolicy(tries=10, backoff=0, budget=3, budget_refill=0.5)
+
+    resp = policy.call(lambda: mock_response_class(503, {}), name='get')
+    assert resp.status_code == 503
+    assert policy.stats()['calls']['get']['retries'] == 3
+    assert policy.budget == 0
+
+    # budget empty: not retried, refilled by successful calls
+    policy.call(lambda: mock_response_class(503, {}), name='get')
+    assert policy.stats()['calls']['get']['retries'] == 3
+    policy.call(lambda: mock_response_class(200, {}), name='get')
+    policy.call(lambda: mock_response_class(200, {}), name='get')
+    assert policy.budget == 1
+
+
+def test_get_json_retry(mock_response_class, json_file):
+    policy = RetryPolicy(backoff=0)
+    session = core.get_session("test", retry_policy=policy)
+    data = json_file("resource-vm.json")
+    responses = [
+        requests.exceptions.ConnectionError("reset"),
+        mock_response_class(502, {}, raise_error=True, reason="bad gateway"),
+        mock_response_class(200, data),
+    ]
+
+    with patch("requests.Session.get") as func:
+        func.side_effect = responses
+        assert core.get_resource_by_id(data['id'], session=session) == data
+
+    assert policy.stats()['calls']['get']['retries'] == 2
+
+
+def test_get_resources_by_ids_retry(arm_server, json_file):
+    """Throttled requests of a batch are sent again"""
+    policy = RetryPolicy(backoff=0)
+    session = core.get_session("test", retry_policy=policy)
+    ids = [item['id'] for item in json_file("resource_list.json")["value"]]
+    real_post = requests.Session.post
+    calls = []
+
+    def post(self, url, json=None, **kwargs):
+        calls.append(len(json["requests"]))
+        resp = real_post(self, url, json=json, **kwargs)
+        if len(calls) == 1:
+            data = resp.json()
+            data["responses"][0] = {
+                "name": data["responses"][0]["name"], "httpStatusCode": 429, "headers": {"Retry-After": "0"}
+            }
+            resp._content = core.json.dumps(data).encode()
+        return resp
+
+    with patch("requests.Session.post", post):
+        results, errors = core.get_resources_by_ids(ids, session=session)
+
+    assert calls == [2, 1]
+    assert len(results) == 2
+    assert errors == {}
+    assert policy.stats()['calls']['batch']['retries'] == 1